@@ -0,0 +1,284 @@
+import os
+import re
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+import importlib.util
+import resource
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_CONFIGS = ('customer.yaml', 'product.yaml')
+ENTRY_POINTS = {'customer.py': 'customer.yaml', 'product.py': 'product.yaml', 'order.py': 'order.yaml'}
+DEFAULT_SCALES = (1000, 10000)
+DEFAULT_THRESHOLD = 0.15
+BENCH_SEED = 1234
+BATCH_SIZE = 10000
+WARMUP_RECORDS = 10
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[logging.StreamHandler()]
+)
+
+
+def load_config(file_name):
+    """Read one of the repository's YAML configurations."""
+    with open(os.path.join(REPO_DIR, file_name), 'r') as file:
+        return yaml.safe_load(file)
+
+
+def source_domains():
+    """Return every domain of the source configurations, without unique_combinations."""
+    domains = []
+    for file_name in SOURCE_CONFIGS:
+        for domain in load_config(file_name)['mock_data_generator']['domains']:
+            domains.append({key: value for key, value in domain.items() if key != 'unique_combinations'})
+    return domains
+
+
+def _field_closure(field, fields_by_name):
+    """Return a field together with every field it (transitively) needs, in config order."""
+    from schema_compiler import field_dependencies
+    needed, pending = set(), [field['name']]
+    while pending:
+        name = pending.pop()
+        if name in needed or name not in fields_by_name:
+            continue
+        needed.add(name)
+        pending.extend(field_dependencies(fields_by_name[name], set(fields_by_name)))
+    return [candidate for candidate in fields_by_name.values() if candidate['name'] in needed]
+
+
+def field_cases():
+    """Build one synthetic single-field domain per field type and faker provider in the source configs.
+
+    Fields a case depends on (a dependency's parent, a formula's inputs) are included, so the
+    throughput of a dependent field includes its inputs.
+    """
+    cases = {}
+    for domain in source_domains():
+        fields_by_name = {field['name']: field for field in domain['fields']}
+        for field in domain['fields']:
+            kind = f"faker.{field['faker']}" if field.get('type') == 'string' and 'faker' in field else field.get('type')
+            if kind and kind not in cases:
+                cases[kind] = {'domain': {'name': f"bench_{kind}", 'fields': _field_closure(field, fields_by_name)}}
+    parent = next(domain for domain in source_domains()
+                  if any(field.get('type') == 'primary_key' for field in domain['fields']))
+    key_field = next(field for field in parent['fields'] if field.get('type') == 'primary_key')
+    for distribution in ('uniform', 'zipf', 'every_parent'):
+        cases[f"relationship.{distribution}"] = {
+            'domain': {'name': f"bench_relationship_{distribution}", 'fields': [{
+                'name': key_field['name'], 'type': 'relationship',
+                'relation': {'domain': parent['name'], 'field': key_field['name'], 'distribution': distribution},
+            }]},
+            'parent': parent,
+        }
+    return cases
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KB on Linux
+
+
+def _reference_data(parent, record_count):
+    """Key index for a relationship case's parent domain, sized like the child."""
+    if parent is None:
+        return None
+    from relationships import key_range_index
+    return {parent['name']: {field['name']: key_range_index(parent, field['name'], record_count, BENCH_SEED)
+                             for field in parent['fields'] if field.get('type') == 'primary_key'}}
+
+
+def run_generation(domain, record_count, engine, parent=None):
+    """Generate a domain in-process, discarding batches, and return (records, seconds, peak RSS)."""
+    from sharding import generate_sharded
+    reference_data = _reference_data(parent, record_count)
+    # Warm up so lazy imports and Faker construction are not timed
+    logging.disable(logging.WARNING)
+    try:
+        for _ in generate_sharded(domain, WARMUP_RECORDS, BENCH_SEED, workers=1, engine=engine,
+                                  reference_data=reference_data, integer_ranges=True, date_only=True):
+            pass
+    finally:
+        logging.disable(logging.NOTSET)
+    start = time.perf_counter()
+    records = 0
+    for batch in generate_sharded(domain, record_count, BENCH_SEED, workers=1, shard_size=BATCH_SIZE,
+                                  engine=engine, reference_data=reference_data, integer_ranges=True, date_only=True):
+        records += len(batch)
+    return records, time.perf_counter() - start, _peak_rss_mb()
+
+
+def run_writer(domain, record_count, output_format):
+    """Write pre-generated batches of a domain in one format and return (records, seconds, peak RSS)."""
+    from sharding import generate_sharded
+    from schema_compiler import schema_field_names
+    from writers import write_output
+    batches = list(generate_sharded(domain, record_count, BENCH_SEED, workers=1, shard_size=BATCH_SIZE,
+                                    integer_ranges=True, date_only=True))
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        records = write_output(os.path.join(directory, f"bench.{output_format}"), batches, output_format,
+                               schema_field_names(domain), fields=domain['fields'])
+        return records, time.perf_counter() - start, _peak_rss_mb()
+
+
+def run_entry_point(script, record_count):
+    """Run an entry-point script on a scaled copy of its config and return (records, seconds, peak RSS)."""
+    config = load_config(ENTRY_POINTS[script])
+    settings = config['mock_data_generator']['settings']
+    settings.update(record_count=record_count, seed=BENCH_SEED)
+    for reference in config['mock_data_generator'].get('references') or ():  # Still read from the repository
+        reference['config'] = os.path.join(REPO_DIR, reference['config'])
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, ENTRY_POINTS[script]), 'w') as file:
+            yaml.safe_dump(config, file)
+        environment = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+        start = time.perf_counter()
+        with open(os.path.join(directory, 'bench.log'), 'w+') as log:
+            process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, script)], cwd=directory,
+                                       env=environment, stdout=subprocess.DEVNULL, stderr=log)
+            _, status, usage = os.wait4(process.pid, 0)
+            seconds = time.perf_counter() - start
+            log.seek(0)
+            output = log.read()
+    if status != 0 or 'CRITICAL' in output:
+        raise RuntimeError(f"{script} failed: {output.strip().splitlines()[-1] if output.strip() else status}")
+    # Domains may write fewer records than asked (e.g. a small combination space), so count what was written
+    records = sum(int(match) for match in re.findall(r"(\d+) (?:\w+ )?records successfully written", output))
+    peak = usage.ru_maxrss / (1024 * 1024) if sys.platform == 'darwin' else usage.ru_maxrss / 1024
+    return records, seconds, peak
+
+
+def benchmark_cases(scales, engines):
+    """List every benchmark as (case name, function, arguments)."""
+    cases = []
+    writer_domain = next(domain for domain in source_domains() if domain['name'] == 'customers')
+    for scale in scales:
+        for kind, case in field_cases().items():
+            for engine in engines:
+                cases.append((f"field/{kind}/{engine}@{scale}", run_generation,
+                              (case['domain'], scale, engine, case.get('parent'))))
+        for domain in source_domains():
+            for engine in engines:
+                cases.append((f"domain/{domain['name']}/{engine}@{scale}", run_generation, (domain, scale, engine)))
+        for output_format in available_formats():
+            cases.append((f"writer/{output_format}@{scale}", run_writer, (writer_domain, scale, output_format)))
+        for script in ENTRY_POINTS:
+            cases.append((f"entry/{script}@{scale}", run_entry_point, (script, scale)))
+    return cases
+
+
+def available_formats():
+    """Output formats whose optional dependencies are installed."""
+    from writers import WRITERS
+    if importlib.util.find_spec('pyarrow') is None:
+        return [name for name in WRITERS if name not in ('parquet', 'arrow')]
+    return list(WRITERS)
+
+
+def available_engines():
+    """Generation engines whose optional dependencies are installed."""
+    return ['row', 'columnar'] if importlib.util.find_spec('numpy') is not None else ['row']
+
+
+def run_case(function, arguments, repeat):
+    """Run one case `repeat` times, each in a fresh process so peak RSS is per case; keep the fastest."""
+    best = None
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+            records, seconds, peak_rss_mb = executor.submit(function, *arguments).result()
+        if best is None or seconds < best['seconds']:
+            best = {'records': records, 'seconds': round(seconds, 4), 'peak_rss_mb': round(peak_rss_mb, 1)}
+    best['records_per_sec'] = round(best['records'] / best['seconds'], 1) if best['seconds'] else None
+    return best
+
+
+def run_benchmarks(scales, repeat, only=None):
+    """Run every matching case and return the results document."""
+    results = {}
+    for name, function, arguments in benchmark_cases(scales, available_engines()):
+        if only and not any(pattern in name for pattern in only):
+            continue
+        try:
+            results[name] = run_case(function, arguments, repeat)
+            logging.info(f"{name}: {results[name]['records_per_sec']} records/s, "
+                         f"peak {results[name]['peak_rss_mb']} MB")
+        except Exception as e:
+            logging.error(f"{name} failed: {e}")
+            results[name] = {'error': str(e)}
+    return {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': BENCH_SEED,
+            'scales': list(scales),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Report throughput against a baseline and return the cases that regressed past `threshold`."""
+    regressions = []
+    for name, current in sorted(results['results'].items()):
+        previous = baseline['results'].get(name)
+        if not previous or not previous.get('records_per_sec') or not current.get('records_per_sec'):
+            logging.info(f"{name}: no baseline to compare")
+            continue
+        ratio = current['records_per_sec'] / previous['records_per_sec']
+        status = 'REGRESSION' if ratio < 1 - threshold else 'ok'
+        logging.info(f"{name}: {current['records_per_sec']} vs {previous['records_per_sec']} records/s "
+                     f"({ratio - 1:+.1%}) {status}")
+        if status != 'ok':
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark generators and writers against a stored baseline.")
+    parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)),
+                        help="comma-separated record counts (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per case; the fastest is kept")
+    parser.add_argument('--only', action='append', help="run only cases whose name contains this text")
+    parser.add_argument('--output', help="write results to this JSON file (e.g. a new baseline)")
+    parser.add_argument('--compare', help="baseline JSON file to compare against")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="fail when throughput drops by more than this fraction (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    scales = [int(scale) for scale in args.scales.split(',')]
+    results = run_benchmarks(scales, args.repeat, args.only)
+    if args.output:
+        temp_path = f"{args.output}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        os.replace(temp_path, args.output)
+        logging.info(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            logging.error(f"{len(regressions)} case(s) regressed by more than {args.threshold:.0%}: "
+                          f"{', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
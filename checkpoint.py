@@ -0,0 +1,218 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import logging
+import threading
+
+from writers import open_writer, merge_parts, output_name
+from children import child_tables, table_options
+from key_allocator import KeyAllocator, allocator_seed
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def config_hash(config):
+    """Hash a configuration so a resumed run can check it generates the same data."""
+    canonical = json.dumps(config, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _write_json(path, document):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(document, file, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def allocator_states(domain_config, seed, record_count, position):
+    """Describe the primary-key allocators of a domain after `position` records."""
+    states = {}
+    for field in domain_config['fields']:
+        if field.get('type') == 'primary_key':
+            key_range = field['range']
+            allocator = KeyAllocator(key_range['start'], key_range['end'], field.get('mode', 'shuffled'),
+                                     allocator_seed(seed, domain_config['name'], field['name']),
+                                     min(position, record_count))
+            states[field['name']] = allocator.state()
+    return states
+
+
+class Checkpoint:
+    """Manifest of a checkpointed run, kept in `directory` next to the per-shard part files.
+
+    Shards are generated and written in order, so the manifest records each domain's completed
+    shards as a count: shard i is complete once its part files were renamed into place and the
+    manifest says so. A resumed run regenerates the shards from that count on; shards are seeded
+    by index, so the merged output is byte-identical to an uninterrupted run.
+    """
+
+    def __init__(self, directory, config, resume=False):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        digest = config_hash(config)
+        if resume and os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self.manifest = json.load(file)
+            if self.manifest.get('version') != MANIFEST_VERSION:
+                raise ValueError(f"Checkpoint {self.path} has unsupported version {self.manifest.get('version')}.")
+            if self.manifest['config_hash'] != digest:
+                raise ValueError(f"Configuration changed since checkpoint {self.path} was written; "
+                                 f"run without --resume to start over.")
+            logging.info(f"Resuming from checkpoint {self.path}")
+        else:
+            if resume:
+                logging.warning(f"No checkpoint at {self.path}; starting a new run.")
+            elif os.path.exists(self.path):
+                logging.warning(f"Overwriting checkpoint {self.path}; pass --resume to continue it instead.")
+            os.makedirs(directory, exist_ok=True)
+            self.manifest = {'version': MANIFEST_VERSION, 'config_hash': digest, 'domains': {}}
+            self._save()
+
+    def _save(self):
+        _write_json(self.path, self.manifest)
+
+    def seed(self, domain_name):
+        """Return the seed a domain was started with, so a random seed survives a restart."""
+        with self._lock:
+            return self.manifest['domains'].get(domain_name, {}).get('seed')
+
+    def start_domain(self, domain_config, seed, record_count, shard_size, tables):
+        """Register a domain, or check a resumed one still matches; return the number of completed shards."""
+        name = domain_config['name']
+        layout = {'seed': seed, 'record_count': record_count, 'shard_size': shard_size,
+                  'shards': -(-record_count // shard_size)}
+        with self._lock:
+            entry = self.manifest['domains'].get(name)
+            if entry is not None and any(entry[key] != value for key, value in layout.items()):
+                logging.warning(f"Checkpoint of domain '{name}' has a different layout; regenerating it.")
+                entry = None
+            if entry is None:
+                entry = self.manifest['domains'][name] = dict(
+                    layout, completed=0, merged=False, records={table: 0 for table in tables},
+                    key_allocators=allocator_states(domain_config, seed, record_count, 0), indexes={})
+                self._save()
+            return entry['completed']
+
+    def domain(self, domain_name):
+        with self._lock:
+            return dict(self.manifest['domains'][domain_name])
+
+    def part_name(self, domain_name, table, shard_index, output_format):
+        return os.path.join(self.directory, domain_name, f"{table}-{shard_index:06d}.{output_format}")
+
+    def complete_shard(self, domain_config, shard_index, records):
+        """Mark a shard done after its parts are in place; `records` counts the rows per table."""
+        name = domain_config['name']
+        with self._lock:
+            entry = self.manifest['domains'][name]
+            if shard_index != entry['completed']:
+                raise ValueError(f"Shard {shard_index} of domain '{name}' completed out of order.")
+            entry['completed'] = shard_index + 1
+            for table, count in records.items():
+                entry['records'][table] += count
+            position = entry['completed'] * entry['shard_size']
+            entry['key_allocators'] = allocator_states(domain_config, entry['seed'], entry['record_count'], position)
+            self._save()
+
+    def save_indexes(self, domain_name, indexes):
+        """Persist a finished domain's reference indexes so resumed children need not regenerate it."""
+        index_names = {}
+        for field_name, index in indexes.items():
+            path = os.path.join(self.directory, domain_name, f"{field_name}.index")
+            with open(f"{path}.tmp", 'wb') as file:
+                pickle.dump(index, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{path}.tmp", path)
+            index_names[field_name] = os.path.basename(path)
+        with self._lock:
+            self.manifest['domains'][domain_name]['indexes'] = index_names
+            self._save()
+
+    def load_indexes(self, domain_name):
+        indexes = {}
+        for field_name, file_name in self.domain(domain_name)['indexes'].items():
+            with open(os.path.join(self.directory, domain_name, file_name), 'rb') as file:
+                indexes[field_name] = pickle.load(file)
+        return indexes
+
+    def mark_merged(self, domain_name):
+        with self._lock:
+            self.manifest['domains'][domain_name]['merged'] = True
+            self._save()
+
+
+def output_tables(domain_config, output_format, field_names, compression=None):
+    """Return (table, output file, field names, writer options) for a domain and its child tables.
+
+    Files compressed as a whole get the `compression` suffix (see `output_name`).
+    """
+    name = domain_config['name']
+    return [(name, output_name(f"{name}_mock_data.{output_format}", output_format, compression), field_names,
+             table_options(domain_config))] + [
+        (child['name'], output_name(f"{name}_{child['name']}_mock_data.{output_format}", output_format, compression),
+         names, table_options(domain_config, child))
+        for child, names in child_tables(domain_config)
+    ]
+
+
+def write_shard_parts(checkpoint, domain_config, batches, first_shard, output_format, field_names, writer_options,
+                      skip_before=0):
+    """Write each shard of a domain to its own part files, child tables included, and record it in the manifest.
+
+    `batches` yields one batch per shard starting at `first_shard`; shards before `skip_before`
+    are already on disk and only pass through. Returns the number of parent records written.
+    """
+    name = domain_config['name']
+    entry = checkpoint.domain(name)
+    os.makedirs(os.path.join(checkpoint.directory, name), exist_ok=True)
+    tables = output_tables(domain_config, output_format, field_names, writer_options.get('compression'))
+    records = dict(entry['records'])
+    written = 0
+    for shard_index, batch in enumerate(batches, start=first_shard):
+        if shard_index < skip_before:  # Regenerated only for the columns child domains reference
+            continue
+        part_records = {name: batch}
+        for child_name, _, _, _ in tables[1:]:
+            part_records[child_name] = batch.pop(child_name).batch
+        for table, file_name, names, options in tables:
+            # The writer renames a finished part into place; the shard counts once the manifest says so
+            part_name = checkpoint.part_name(name, table, shard_index, output_format)
+            part = (shard_index == 0, shard_index == entry['shards'] - 1, records[table])
+            with open_writer(part_name, output_format, names, part=part, output_name=file_name,
+                             **options, **writer_options) as writer:
+                writer.write_batch(part_records[table])
+        counts = {table: len(rows) for table, rows in part_records.items()}
+        checkpoint.complete_shard(domain_config, shard_index, counts)
+        for table, count in counts.items():
+            records[table] += count
+        written += len(batch)
+    return written
+
+
+def merge_domain(checkpoint, domain_config, output_format, field_names, writer_options):
+    """Merge a finished domain's part files into its output files and remove the parts."""
+    name = domain_config['name']
+    entry = checkpoint.domain(name)
+    if entry['completed'] != entry['shards']:
+        raise ValueError(f"Domain '{name}' has {entry['completed']} of {entry['shards']} shards; cannot merge.")
+    tables = output_tables(domain_config, output_format, field_names, writer_options.get('compression'))
+    for table, file_name, names, options in tables:
+        parts = [checkpoint.part_name(name, table, index, output_format) for index in range(entry['shards'])]
+        if parts:
+            merge_parts(parts, file_name, output_format, names, **options, **writer_options)
+        else:  # An empty domain still gets a valid, empty file
+            open_writer(file_name, output_format, names, **options, **writer_options).close()
+        logging.info(f"{entry['records'][table]} {table} records successfully written to {file_name}")
+    checkpoint.mark_merged(name)
+    for table, _, _, _ in tables:
+        for index in range(entry['shards']):
+            os.remove(checkpoint.part_name(name, table, index, output_format))
+    return entry['records'][name]
+
+
+def remove_checkpoint(checkpoint):
+    """Delete a finished run's checkpoint directory."""
+    shutil.rmtree(checkpoint.directory, ignore_errors=True)
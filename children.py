@@ -0,0 +1,190 @@
+from collections import namedtuple
+
+from schema_compiler import field_dependencies, schema_field_names, sort_fields_by_dependency
+from key_allocator import needs_allocator
+from instrumentation import new_shard_stats, add_field_time
+from temporal import with_base_format, datetime_formats
+from writers import WRITERS
+from record_batch import RecordBatch, ChildRows, plan_categories
+from value_lists import AliasTable
+
+CHILD_OUTPUTS = ('nested', 'table')
+
+# A compiled child collection. `inputs` are the parent fields its rows read (repeated once per
+# child row), `index_fields` are its `child_index` fields and `field_names` its output columns.
+ChildPlan = namedtuple('ChildPlan', ['name', 'output', 'foreign_key', 'sample_counts', 'plan',
+                                     'inputs', 'index_fields', 'field_names'])
+
+
+def child_collections(domain_config):
+    """Return a domain's `children` entries."""
+    return domain_config.get('children') or ()
+
+
+def foreign_key(domain_config, child):
+    """Return the parent field copied into each child row: `foreign_key`, else the parent's primary key."""
+    if child.get('foreign_key'):
+        return child['foreign_key']
+    for field in domain_config['fields']:
+        if field.get('type') == 'primary_key':
+            return field['name']
+    raise ValueError(f"Child collection '{child['name']}' of domain '{domain_config['name']}' needs a "
+                     f"foreign_key because the domain has no primary key.")
+
+
+def child_field_names(domain_config, child):
+    """Return a child collection's output columns: foreign key (tables only), child indexes, then fields."""
+    index_fields = [field['name'] for field in child['fields'] if field.get('type') == 'child_index']
+    fields = [field for field in child['fields'] if field.get('type') != 'child_index']
+    available = set(schema_field_names(domain_config)) | set(index_fields)
+    names = index_fields + [field['name'] for field in sort_fields_by_dependency(fields, available)]
+    if child.get('output', 'nested') == 'table':
+        names = [foreign_key(domain_config, child)] + names
+    return tuple(names)
+
+
+def output_field_names(domain_config):
+    """Return a domain's output columns, including child collections nested into each record."""
+    nested = [child['name'] for child in child_collections(domain_config) if child.get('output', 'nested') == 'nested']
+    return tuple(schema_field_names(domain_config)) + tuple(nested)
+
+
+def check_output_format(domain_config, output_format):
+    """Reject nested child collections for output formats that cannot hold lists of records."""
+    writer_class = WRITERS.get(output_format)
+    if writer_class is not None and not writer_class.nested:
+        for child in child_collections(domain_config):
+            if child.get('output', 'nested') == 'nested':
+                raise ValueError(f"Child collection '{child['name']}' of domain '{domain_config['name']}' "
+                                 f"cannot be nested in {output_format} output; set `output: table`.")
+
+
+def child_tables(domain_config):
+    """Yield (child config, output field names) for each child collection written to its own table."""
+    for child in child_collections(domain_config):
+        if child.get('output', 'nested') == 'table':
+            yield child, child_field_names(domain_config, child)
+
+
+def table_options(domain_config, child=None):
+    """Writer options describing the domain's table, or one of its child tables: name, field configs and keys.
+
+    A child table row is identified by its foreign key and `child_index` fields, and its foreign
+    key is indexed for joins (used by database output).
+    """
+    if child is None:
+        return {'table': domain_config['name'], 'fields': domain_config['fields']}
+    key = foreign_key(domain_config, child)
+    index_fields = [field['name'] for field in child['fields'] if field.get('type') == 'child_index']
+    return {'table': f"{domain_config['name']}_{child['name']}", 'fields': [*domain_config['fields'], *child['fields']],
+            'primary_key': [key, *index_fields] if index_fields else [], 'indexes': [key]}
+
+
+def _count_sampler(child, rng):
+    """Compile a child collection's `count` into `sample(parents)` returning one count per parent."""
+    import numpy as np
+    count = child.get('count', 1)
+    if isinstance(count, int):
+        return lambda parents: np.full(parents, count, dtype=np.int64)
+    if 'values' in count:  # Weighted choice of counts
+        values = np.asarray(count['values'], dtype=np.int64)
+        weights = count.get('probabilities') or [1] * len(values)
+        if len(weights) != len(values):
+            raise ValueError(f"Number of probabilities does not match number of counts for child '{child['name']}'.")
+        table = AliasTable.build(weights)
+        return lambda parents: values[table.draw_array(rng, parents)]
+    low, high = int(count.get('min', 0)), count.get('max')
+    if 'mean' in count:  # Poisson counts, clipped to min/max
+        mean = float(count['mean'])
+        return lambda parents: np.clip(rng.poisson(mean, parents), low, high)
+    if high is None:
+        raise ValueError(f"Child collection '{child['name']}' needs count.max, count.mean or count.values.")
+    return lambda parents: rng.integers(low, int(high), parents, endpoint=True)
+
+
+def compile_children(domain_config, fake, rng, reference_data=None, **options):
+    """Compile a domain's child collections for vectorized generation across a batch of parents."""
+    from columnar import compile_columns
+    parent_names = set(schema_field_names(domain_config))
+    parent_formats = datetime_formats(domain_config['fields'], options.get('date_only', False))
+    plans = []
+    for child in child_collections(domain_config):
+        name, output = child['name'], child.get('output', 'nested')
+        if output not in CHILD_OUTPUTS:
+            raise ValueError(f"Unsupported output '{output}' for child collection '{name}'. "
+                             f"Options: {', '.join(CHILD_OUTPUTS)}")
+        index_fields = tuple((field['name'], int(field.get('start', 1)))
+                             for field in child['fields'] if field.get('type') == 'child_index')
+        # Offsets from a parent datetime parse it with the parent field's format
+        fields = [with_base_format(field, domain_config['fields'], options.get('date_only', False))
+                  for field in child['fields'] if field.get('type') != 'child_index']
+        available = parent_names | {field_name for field_name, _ in index_fields}
+        plan = compile_columns({'name': f"{domain_config['name']}.{name}", 'fields': fields}, fake, rng,
+                               reference_data, parent_fields=available, parent_formats=parent_formats, **options)
+        unique = [field.name for field in plan.fields if needs_allocator(field)]
+        if unique:
+            raise ValueError(f"Fields {', '.join(unique)} of child collection '{plan.name}' need unique values, "
+                             f"which child collections cannot allocate; use child_index and the foreign key.")
+        inputs = set().union(*(field_dependencies(field, parent_names) for field in fields)) & parent_names
+        key = foreign_key(domain_config, child) if output == 'table' else None
+        if key is not None:
+            inputs.add(key)
+        plans.append(ChildPlan(name, output, key, _count_sampler(child, rng), plan, tuple(sorted(inputs)),
+                               index_fields, child_field_names(domain_config, child)))
+    return plans
+
+
+def _parent_column(batch, name):
+    """Return a parent column as a typed array, as child fields read it."""
+    import numpy as np
+    from columnar import _object_array
+    values = batch.columns[name]
+    if isinstance(values, np.ndarray):
+        return values
+    timestamps = batch.timestamps(name)
+    if timestamps is not None:  # Microseconds, as child offsets read them; formulas format them
+        return np.asarray(timestamps.micros, dtype=np.int64)
+    categorical = batch.categorical(name)
+    if categorical is not None:
+        return _object_array(categorical.categories)[categorical.code_array()]
+    column = np.asarray(values)
+    if column.dtype.kind in 'iufb':
+        return column
+    return _object_array(values)
+
+
+def attach_children(child_plans, batch, stats=None):
+    """Generate every child collection for a batch of parent records at once and attach the rows.
+
+    Each child row sees its parent's fields (repeated per row), so all children of all parents
+    are generated as one column batch. The rows are added to the parent batch as a `ChildRows`
+    column under the child's name. Field timings go to `stats` as `<child>.<field>` when given.
+    """
+    import numpy as np
+    from columnar import generate_columns
+    for child in child_plans:
+        counts = child.sample_counts(len(batch))
+        total = int(counts.sum())
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        inputs = {name: np.repeat(_parent_column(batch, name), counts) for name in child.inputs}
+        # Position of each row within its parent, for child_index fields
+        positions = np.arange(total, dtype=np.int64) - np.repeat(offsets[:-1], counts)
+        for name, start in child.index_fields:
+            inputs[name] = positions + start
+        child_stats = new_shard_stats() if stats is not None else None
+        columns = generate_columns(child.plan, total, {}, inputs, child_stats)
+        if stats is not None:
+            for name, entry in child_stats['fields'].items():
+                add_field_time(stats, f"{child.name}.{name}", *entry)
+        rows = RecordBatch.from_columns(columns, child.field_names, total, plan_categories(child.plan),
+                                        child.plan.formats)
+        batch.set_column(child.name, ChildRows(rows, offsets))
+    return batch
+
+
+def explode_children(batches, writers):
+    """Pass parent batches through, moving the rows of each table child collection to its writer."""
+    for batch in batches:
+        for name, writer in writers.items():
+            writer.write_batch(batch.pop(name).batch)
+        yield batch
@@ -0,0 +1,211 @@
+import time
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from schema_compiler import sort_fields_by_dependency, dependency_option
+from faker_pool import with_pool_config, pool_for_field
+from expressions import compile_formula, bind_columns
+from relationships import lookup_index, column_sampler, with_relation_size
+from instrumentation import add_field_time, generator_type
+from temporal import DAY, field_format, column_datetime_sampler, with_base_format, datetime_formats
+from value_lists import AliasTable, column_source_sampler
+
+# A compiled column: `generate(columns, count, keys)` returns an array of `count` values,
+# drawing primary keys from `keys`, a mapping of field name to KeyAllocator.
+ColumnField = namedtuple('ColumnField', ['name', 'type', 'generate', 'config'])
+# A compiled domain for batch-at-a-time generation; fields are in dependency order. Datetime
+# columns are microseconds since the epoch, written in their `formats`.
+ColumnPlan = namedtuple('ColumnPlan', ['name', 'fields', 'field_names', 'formats'])
+
+
+def _object_array(values):
+    """Build a 1-D object array without numpy trying to broadcast nested values."""
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _list_sampler(values, probabilities, rng):
+    """Compile a value list with optional weights into `sample(count)`, drawing weighted indices from an alias table."""
+    values = _object_array(values)
+    if not len(values):
+        raise ValueError("Cannot sample from an empty list of values.")
+    if probabilities is None:
+        return lambda count: values[rng.integers(0, len(values), count)]
+    if len(probabilities) != len(values):
+        raise ValueError("Number of probabilities does not match number of values.")
+    table = AliasTable.build(probabilities)
+    return lambda count: values[table.draw_array(rng, count)]
+
+
+def _dependency_dtype(options, integer_ranges):
+    """Pick the narrowest array dtype able to hold every parsed (kind, spec) dependency option."""
+    if any(kind in ('list', 'source') for kind, _ in options):
+        return object
+    if integer_ranges and all(
+            isinstance(spec, int) if kind == 'fixed' else all(isinstance(bound, int) for bound in spec)
+            for kind, spec in options):
+        return np.int64
+    return np.float64
+
+
+def _compile_dependency_option(kind, spec, rng, integer_ranges):
+    """Compile one parent value's parsed dependency option into a `sample(count)` callable."""
+    if kind == 'fixed':
+        return lambda count: np.full(count, spec)
+    if kind == 'list':
+        return _list_sampler(*spec, rng)
+    if kind == 'source':
+        return column_source_sampler(spec, rng)
+    low, high = spec
+    if integer_ranges:
+        return lambda count: rng.integers(low, high, count, endpoint=True)
+    return lambda count: np.round(rng.uniform(low, high, count), 2)
+
+
+def _text_columns(columns, names, formats):
+    """Return `columns` with the datetime columns among `names` formatted, as formulas and dependencies read them."""
+    return dict(columns, **{name: formats[name].format_array(columns[name]) for name in names})
+
+
+def _compile_column(field, fake, rng, reference_data, integer_ranges, date_only, known_fields, formats):
+    """Build the column generator for a single field definition."""
+    field_type = field.get('type')
+    field_name = field.get('name')
+
+    if field_type == 'primary_key':
+        return lambda columns, count, keys: keys[field_name].allocate_many(count)
+
+    if field_type == 'predefined_list' and 'values' in field:
+        sample = _list_sampler(field['values'], field.get('probabilities'), rng)
+        return lambda columns, count, keys: sample(count)
+
+    if field_type == 'predefined_list' and 'source' in field:
+        sample = column_source_sampler(field['source'], rng)
+        return lambda columns, count, keys: sample(count)
+
+    if field_type == 'dependency':
+        parent = field['dependency']['field']
+        options = {value: dependency_option(option, field_name)
+                   for value, option in field['dependency']['values'].items()}
+        lookup = {value: _compile_dependency_option(*option, rng, integer_ranges) for value, option in options.items()}
+        dtype = _dependency_dtype(list(options.values()), integer_ranges)
+
+        def generate_dependency(columns, count, keys):
+            if parent not in columns:
+                raise ValueError(f"Dependency field '{parent}' not found in the batch.")
+            if parent in formats:
+                columns = _text_columns(columns, [parent], formats)
+            parent_values, inverse = np.unique(columns[parent], return_inverse=True)
+            result = np.empty(count, dtype=dtype)
+            for code, parent_value in enumerate(parent_values.tolist()):
+                if parent_value not in lookup:
+                    raise ValueError(f"No dependency values for '{parent_value}' in field {field_name}.")
+                positions = np.flatnonzero(inverse == code)
+                result[positions] = lookup[parent_value](len(positions))
+            return result
+        return generate_dependency
+
+    if field_type == 'computed':
+        formula = compile_formula(field['formula'], field_name, known_fields)
+        evaluate = bind_columns(formula, rng)
+        datetimes = [name for name in formula.names if name in formats]
+        if datetimes:
+            return lambda columns, count, keys: evaluate(_text_columns(columns, datetimes, formats), count)
+        return lambda columns, count, keys: evaluate(columns, count)
+
+    # Datetime columns hold int64 microseconds since the epoch, truncated to their format's resolution
+    if field_type == 'datetime' and 'offset' in field:  # A whole number of days after another datetime field
+        base, low, high = field['offset']['field'], field['offset']['min_days'], field['offset']['max_days']
+        resolution = field_format(field, date_only).resolution
+
+        def generate_offset(columns, count, keys):
+            values = columns[base] + rng.integers(low, high, count, endpoint=True) * DAY
+            return values - values % resolution
+        return generate_offset
+
+    if field_type == 'datetime' and 'range' in field:
+        sample = column_datetime_sampler(field, rng, field_format(field, date_only).resolution)
+        return lambda columns, count, keys: sample(count, keys)
+
+    if field_type == 'string' and 'faker' in field:
+        if field.get('pool'):
+            values = _object_array(pool_for_field(field, field['pool']))
+            if field['pool']['unique']:  # Walk a permutation of the pool so values never repeat
+                return lambda columns, count, keys: values[keys[field_name].allocate_many(count)]
+            return lambda columns, count, keys: values[rng.integers(0, len(values), count)]
+        provider = getattr(fake, field['faker'])
+        return lambda columns, count, keys: _object_array([provider() for _ in range(count)])
+
+    if field_type == 'float' and 'range' in field:
+        low, high = field['range']['min'], field['range']['max']
+        return lambda columns, count, keys: rng.uniform(low, high, count)
+
+    if field_type == 'integer' and 'range' in field:
+        low, high = field['range']['min'], field['range']['max']
+        return lambda columns, count, keys: rng.integers(low, high, count, endpoint=True)
+
+    if field_type == 'relationship':
+        index = lookup_index(reference_data, field['relation'], field_name)
+        sample = column_sampler(index, field['relation'], rng, field_name)
+        return lambda columns, count, keys: sample(count, keys)
+
+    logging.warning(f"Unsupported or missing type for field: {field_name}")
+    return lambda columns, count, keys: np.full(count, None, dtype=object)
+
+
+def compile_columns(domain_config, fake=None, rng=None, reference_data=None,
+                    integer_ranges=False, date_only=False, faker_pool=None, parent_fields=(), parent_formats=None,
+                    pool_seed=None):
+    """Compile a domain configuration into a plan that generates whole columns per batch.
+
+    `parent_fields` names columns supplied to `generate_columns` up front, which fields may read;
+    `parent_formats` holds the formats of the datetimes among them.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    known_fields = {field['name'] for field in domain_config['fields']} | set(parent_fields)
+    formats = datetime_formats(domain_config['fields'], date_only)
+    visible_formats = dict(parent_formats or {}, **formats)
+    fields = tuple(
+        ColumnField(
+            name=field['name'],
+            type=field.get('type'),
+            generate=_compile_column(field, fake, rng, reference_data, integer_ranges, date_only, known_fields,
+                                     visible_formats),
+            config=field,
+        )
+        for field in (with_base_format(with_relation_size(with_pool_config(field, faker_pool, pool_seed),
+                                                          reference_data),
+                                       domain_config['fields'], date_only)
+                      for field in sort_fields_by_dependency(domain_config['fields'], parent_fields))
+    )
+    return ColumnPlan(
+        name=domain_config['name'],
+        fields=fields,
+        field_names=tuple(field.name for field in fields),
+        formats=formats,
+    )
+
+
+def generate_columns(plan, count, keys, columns=None, stats=None):
+    """Generate one batch as a mapping of field name to value array, starting from any given `columns`.
+
+    Every field is timed into `stats` (see `instrumentation`) when given; one timer per column is cheap.
+    """
+    columns = dict(columns or {})
+    for field in plan.fields:
+        try:
+            if stats is None:
+                columns[field.name] = field.generate(columns, count, keys)
+                continue
+            started = time.perf_counter()
+            columns[field.name] = field.generate(columns, count, keys)
+            add_field_time(stats, field.name, generator_type(field.config), time.perf_counter() - started,
+                           count, count)
+        except Exception as e:
+            logging.error(f"Error in field '{field.name}' of domain '{plan.name}': {e}")
+            raise
+    return columns
+
@@ -0,0 +1,156 @@
+from bisect import bisect_right
+from itertools import accumulate
+
+from schema_compiler import sort_fields_by_dependency, record_formats
+from key_allocator import KeyAllocator, allocator_seed
+from value_lists import list_values, load_value_list
+
+
+def _option_values(option):
+    """Return the values of a list option — inline, or an external value list — else None."""
+    if isinstance(option, dict) and 'source' in option:
+        return load_value_list(option['source'])
+    return list_values(option)
+
+
+def _is_list_option(option):
+    return isinstance(option, list) or isinstance(option, dict) and ('values' in option or 'source' in option)
+
+
+def combination_fields(domain_config):
+    """Return the names of the fields whose values a domain keeps unique in combination.
+
+    `unique_combinations` may list the fields; `true` takes every predefined_list field plus
+    each list-valued dependency field whose parent is itself a combination field.
+    """
+    setting = domain_config.get('unique_combinations')
+    if isinstance(setting, (list, tuple)):
+        return list(setting)
+    names = []
+    for field in domain_config['fields']:
+        if field.get('type') == 'predefined_list':
+            names.append(field['name'])
+        elif field.get('type') == 'dependency' and field['dependency']['field'] in names \
+                and all(_is_list_option(option) for option in field['dependency']['values'].values()):
+            names.append(field['name'])
+    return names
+
+
+class CombinationSpace:
+    """Index the unique combinations of a set of fields without enumerating them.
+
+    Fields form a forest: a predefined_list field is a root, and a dependency field is the child
+    of the field it depends on, taking the option list for its parent's value. Each index in
+    `range(size)` decodes to one combination by mixed-radix arithmetic: the radix of a subtree
+    depends on the values chosen above it, so every index maps to exactly one distinct record.
+    """
+
+    def __init__(self, domain_config, names=None):
+        names = list(names if names is not None else combination_fields(domain_config))
+        configs = {field['name']: field for field in domain_config['fields']}
+        # Parents before children, whatever order the fields were listed in
+        names = [field['name'] for field in sort_fields_by_dependency(
+            [configs[name] for name in names if name in configs])] + [name for name in names if name not in configs]
+        self.children = {name: [] for name in names}
+        self.options = {}
+        self.roots = []
+        for name in names:
+            field = configs.get(name)
+            if field is None:
+                raise ValueError(f"Unknown field '{name}' in unique_combinations of domain '{domain_config['name']}'.")
+            if field.get('type') == 'predefined_list':
+                self.roots.append(name)
+                self.options[name] = {None: list(field['values']) if 'values' in field
+                                      else load_value_list(field['source'])}
+            elif field.get('type') == 'dependency' and field['dependency']['field'] in self.children \
+                    and all(_is_list_option(option) for option in field['dependency']['values'].values()):
+                self.children[field['dependency']['field']].append(name)
+                self.options[name] = {value: _option_values(option)
+                                      for value, option in field['dependency']['values'].items()}
+            else:
+                raise ValueError(f"Field '{name}' cannot be part of unique_combinations: use a predefined_list, "
+                                 f"or a dependency with list options on an earlier combination field.")
+        self.names = names
+        self._counts = {}
+        self._prefix = {}
+        self.size = 1
+        for root in self.roots:
+            self.size *= self._total(root, None)
+
+    def _count(self, name, value):
+        """Number of combinations of the subtree below `name` once it holds `value`."""
+        key = (name, value)
+        if key not in self._counts:
+            count = 1
+            for child in self.children[name]:
+                count *= self._total(child, value)
+            self._counts[key] = count
+        return self._counts[key]
+
+    def _total(self, name, parent_value):
+        """Number of combinations of the subtree rooted at `name` for its parent's value."""
+        return self._cumulative(name, parent_value)[-1]
+
+    def _cumulative(self, name, parent_value):
+        """Cumulative subtree counts over the option list of `name` for its parent's value."""
+        key = (name, parent_value)
+        if key not in self._prefix:
+            options = self.options[name].get(parent_value)
+            if options is None:
+                raise ValueError(f"No options for field '{name}' when its parent is '{parent_value}'.")
+            self._prefix[key] = [0] + list(accumulate(self._count(name, value) for value in options))
+        return self._prefix[key]
+
+    def _decode(self, name, parent_value, index, record):
+        """Fill `record` with the subtree combination number `index` below `name`."""
+        cumulative = self._cumulative(name, parent_value)
+        position = bisect_right(cumulative, index) - 1
+        value = self.options[name][parent_value][position]
+        record[name] = value
+        index -= cumulative[position]
+        for child in reversed(self.children[name]):  # Mixed radix over the independent child subtrees
+            index, digit = divmod(index, self._total(child, value))
+            self._decode(child, value, digit, record)
+
+    def combination(self, index):
+        """Return combination number `index` as a mapping of field name to value."""
+        if not 0 <= index < self.size:
+            raise IndexError(f"Combination index {index} is out of range 0..{self.size - 1}")
+        record = {}
+        for root in reversed(self.roots):  # The last field varies fastest, as in nested loops
+            index, digit = divmod(index, self._total(root, None))
+            self._decode(root, None, digit, record)
+        return record
+
+
+def combination_sequence(space, domain_name, record_count, seed=None):
+    """Return (count, combination_at): how many records a domain gets and the combination at each position.
+
+    The whole space is enumerated in order when record_count covers it; otherwise record_count
+    combinations are sampled without replacement by walking a seeded permutation of the indexes.
+    """
+    count = min(record_count, space.size)
+    if count < space.size:
+        permutation = KeyAllocator(0, space.size - 1, 'shuffled', allocator_seed(seed, domain_name, 'combinations'))
+        index_at = permutation.index_at
+    else:
+        index_at = int
+    return count, lambda position: space.combination(index_at(position))
+
+
+def generate_combination_columns(plan, keys, combination_at, start, count):
+    """Generate records start..start+count-1 as one list per field, taking combination fields from `combination_at`."""
+    columns = {field.name: [] for field in plan.fields}
+    formats = record_formats(plan)
+    for position in range(start, start + count):
+        combination = combination_at(position)
+        record = {}
+        for field in plan.fields:
+            if field.name in combination:
+                value = record[field.name] = combination[field.name]
+            else:
+                value = record[field.name] = field.generate(record, keys)
+                if field.name in formats:  # Datetimes are read formatted, and kept as microseconds
+                    record[field.name] = formats[field.name].format_value(value)
+            columns[field.name].append(value)
+    return columns
@@ -0,0 +1,80 @@
+import os
+import pickle
+import hashlib
+import logging
+
+# Root of every on-disk cache (parsed configs, domain outputs, value list indexes); kept here
+# so loading a config does not import the generator
+DEFAULT_DIRECTORY = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                                 'mock-data-generator')
+
+CONFIG_CACHE_VERSION = 2  # Configs cached by version 1 were not checked
+CONFIG_DIRECTORY = os.path.join(DEFAULT_DIRECTORY, 'configs')
+MAX_CACHED_CONFIGS = 256
+ROOT_KEY = 'mock_data_generator'  # Every configuration holds its settings and domains under this key
+
+
+def _prune(directory, keep):
+    """Remove the least recently written parsed configs beyond `keep`."""
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.pickle')]
+    if len(paths) <= keep:
+        return
+    paths.sort(key=os.path.getmtime)
+    for path in paths[:len(paths) - keep]:
+        os.remove(path)
+
+
+def _check_config(config, file_path):
+    """Reject a parsed file that is not a generator configuration, naming what it lacks."""
+    if not isinstance(config, dict) or not isinstance(config.get(ROOT_KEY), dict):
+        logging.error(f"{file_path} has no top-level '{ROOT_KEY}' mapping")
+        raise ValueError(f"Configuration file {file_path} has no top-level '{ROOT_KEY}' key "
+                         f"holding its settings and domains.")
+    missing = [key for key in ('settings', 'domains') if key not in config[ROOT_KEY]]
+    if missing:
+        logging.error(f"{file_path} lacks {', '.join(missing)} under '{ROOT_KEY}'")
+        raise ValueError(f"Configuration file {file_path} has no {' or '.join(repr(key) for key in missing)} "
+                         f"under '{ROOT_KEY}'.")
+
+
+def load_config(file_path, directory=CONFIG_DIRECTORY):
+    """Read a YAML configuration, reusing the parsed form of an identical file from an earlier run.
+
+    Parsed configs are pickled in `directory` under the hash of the file's bytes, so an unchanged
+    config skips YAML parsing (and importing yaml) and an edited one can never be served stale.
+    A file without the `mock_data_generator` settings and domains raises ValueError.
+    With `directory=None`, or when it cannot be written, the file is parsed every time.
+    """
+    try:
+        with open(file_path, 'rb') as file:
+            content = file.read()
+    except FileNotFoundError:
+        logging.error(f"YAML configuration file not found: {file_path}")
+        raise
+    digest = hashlib.sha256(f"{CONFIG_CACHE_VERSION}\0".encode('utf-8') + content).hexdigest()
+    path = os.path.join(directory, f"{digest}.pickle") if directory else None
+    if path is not None:
+        try:
+            with open(path, 'rb') as file:
+                return pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+    import yaml
+    try:
+        config = yaml.safe_load(content)
+    except yaml.YAMLError as e:
+        logging.error(f"Error parsing YAML file: {e}")
+        raise
+    _check_config(config, file_path)  # Before caching, so a cached config is always a valid one
+    if path is not None:
+        try:
+            os.makedirs(directory, exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as file:
+                pickle.dump(config, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+            _prune(directory, MAX_CACHED_CONFIGS)
+        except OSError as e:  # A read-only cache only costs the parse
+            logging.debug(f"Could not cache parsed config {file_path}: {e}")
+    return config
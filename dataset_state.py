@@ -0,0 +1,186 @@
+import os
+import json
+import pickle
+import logging
+
+from writers import WRITERS
+from schema_compiler import domain_fields
+from relationships import ColumnIndex
+from checkpoint import config_hash, allocator_states, output_tables, _write_json
+
+STATE_VERSION = 1
+# Settings that change how many records are written or how a run executes, not what is generated
+RUN_SETTINGS = ('record_count', 'seed', 'workers', 'report', 'checkpoint', 'append', 'cache', 'compression_threads')
+
+
+def state_path(file_name):
+    return f"{file_name}.state.json"
+
+
+def generator_fingerprint(domain_config, settings):
+    """Hash everything that decides a domain's records, except how many there are."""
+    return config_hash({
+        'domain': {key: value for key, value in domain_config.items() if key != 'record_count'},
+        'settings': {key: value for key, value in settings.items() if key not in RUN_SETTINGS},
+    })
+
+
+def check_appendable(domain_config, output_format):
+    """Reject a domain an append could not continue: its output format, or a field spread over record_count."""
+    if output_format in WRITERS and WRITERS[output_format].append_mode is None:
+        raise ValueError(f"Appending is not supported for {output_format} output; remove `append`.")
+    # Positions are spread over the whole record_count, which an append raises: later records would jump back
+    increasing = [field['name'] for field in domain_fields(domain_config)
+                  if field.get('type') == 'datetime' and field.get('distribution') == 'increasing']
+    if increasing:
+        logging.error(f"Domain '{domain_config['name']}' has increasing datetimes and cannot be appended to")
+        raise ValueError(f"Field {', '.join(increasing)} of domain '{domain_config['name']}' spreads "
+                         f"`distribution: increasing` over record_count, so appended records would not follow the "
+                         f"existing ones; remove `append` or use another distribution.")
+
+
+class AppendState:
+    """Generator state kept next to a domain's output file, so a later run can append to it.
+
+    Shards are seeded by index and keys come from position-indexed permutations, so the state is
+    small: the seed, the number of records and shards written, the key-allocator positions, the
+    size of every output file, and the parent columns children reference (unless they are
+    primary keys, which are recomputed from their key range). Appended records continue the key
+    permutations and draw from fresh shard seeds with the same distributions.
+    """
+
+    def __init__(self, domain_config, settings, output_format, field_names):
+        self.domain_config = domain_config
+        self.output_format = output_format
+        self.tables = output_tables(domain_config, output_format, field_names, settings.get('compression'))
+        self.path = state_path(self.tables[0][1])
+        self.fingerprint = generator_fingerprint(domain_config, settings)
+        self.state = None
+        check_appendable(domain_config, output_format)
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self.state = json.load(file)
+            if self.state.get('version') != STATE_VERSION:
+                raise ValueError(f"State file {self.path} has unsupported version {self.state.get('version')}.")
+            if self.state['fingerprint'] != self.fingerprint:
+                raise ValueError(f"Domain '{domain_config['name']}' changed since {self.path} was written; "
+                                 f"delete it and its output files to start over.")
+
+    @property
+    def records(self):
+        """Number of records already written, 0 for a new dataset."""
+        return self.state['records'] if self.state else 0
+
+    @property
+    def next_shard(self):
+        return self.state['next_shard'] if self.state else 0
+
+    @property
+    def seed(self):
+        return self.state['seed'] if self.state else None
+
+    def start(self, seed, record_count):
+        """Check an existing dataset can grow to `record_count` records and undo any interrupted append."""
+        if not self.state:
+            return
+        name = self.domain_config['name']
+        if self.state['seed'] != seed:
+            raise ValueError(f"Domain '{name}' was generated with seed {self.state['seed']}, not {seed}.")
+        if record_count < self.state['records']:
+            raise ValueError(f"Domain '{name}' already has {self.state['records']} records; "
+                             f"record_count {record_count} cannot shrink it.")
+        for table, entry in self.state['tables'].items():
+            for file_name, size in entry['files'].items():
+                actual = os.path.getsize(file_name) if os.path.exists(file_name) else -1
+                if actual < size:
+                    raise ValueError(f"{file_name} changed since {self.path} was written; cannot append to it.")
+                if actual > size:  # Left over from an interrupted append
+                    logging.warning(f"Discarding {actual - size} bytes of an interrupted append to {file_name}")
+                    os.truncate(file_name, size)
+
+    def outputs(self):
+        """Return (table, file name, field names, writer options) to write the new records of every table."""
+        outputs = []
+        for table, file_name, names, options in self.tables:
+            if not self.state:
+                outputs.append((table, file_name, names, options))
+                continue
+            entry = self.state['tables'][table]
+            if WRITERS[self.output_format].append_mode == 'new_file':
+                stem, extension = file_name.rsplit('.', 1)
+                file_name = f"{stem}.{len(entry['files'])}.{extension}"
+                outputs.append((table, file_name, names, options))
+            else:
+                outputs.append((table, file_name, names,
+                                dict(options, append=True, part=(False, True, entry['records']))))
+        return outputs
+
+    def load_indexes(self):
+        """Return the referenced parent columns saved by the last run, as ColumnIndex objects."""
+        indexes = {}
+        for field_name, file_name in (self.state or {}).get('indexes', {}).items():
+            with open(os.path.join(os.path.dirname(self.path), file_name), 'rb') as file:
+                indexes[field_name] = pickle.load(file)
+        return indexes
+
+    def save(self, seed, record_count, next_shard, records, written_files, indexes):
+        """Record the dataset after a run: `records` and `written_files` hold each table's new rows and files.
+
+        `indexes` are the referenced columns of the domain; collected ones are saved for the next append.
+        """
+        name = self.domain_config['name']
+        tables = {}
+        for table, _, _, _ in self.tables:
+            entry = (self.state or {}).get('tables', {}).get(table, {'records': 0, 'files': {}})
+            files = dict(entry['files'])
+            files[written_files[table]] = os.path.getsize(written_files[table])
+            tables[table] = {'records': entry['records'] + records[table], 'files': files}
+        index_files = {}
+        for field_name, index in indexes.items():
+            if not isinstance(index, ColumnIndex):  # Key-range indexes are recomputed from record_count
+                continue
+            # Named by record count so the index of the previous state stays valid until the state is replaced
+            file_name = f"{os.path.basename(self.tables[0][1])}.{field_name}.{record_count}.index"
+            path = os.path.join(os.path.dirname(self.path), file_name)
+            with open(f"{path}.tmp", 'wb') as file:
+                pickle.dump(index, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{path}.tmp", path)
+            index_files[field_name] = file_name
+        previous = (self.state or {}).get('indexes', {})
+        self.state = {
+            'version': STATE_VERSION,
+            'fingerprint': self.fingerprint,
+            'domain': name,
+            'seed': seed,
+            'records': record_count,
+            'next_shard': next_shard,
+            'key_allocators': allocator_states(self.domain_config, seed, record_count, record_count),
+            'reference_sizes': {field_name: index.size for field_name, index in indexes.items()},
+            'indexes': index_files,
+            'tables': tables,
+        }
+        _write_json(self.path, self.state)
+        for file_name in set(previous.values()) - set(index_files.values()):
+            os.remove(os.path.join(os.path.dirname(self.path), file_name))
+
+
+def remove_state(domain_config, output_format, field_names, compression=None):
+    """Delete the append state of a domain whose output a plain run is about to overwrite.
+
+    Saved indexes and files written by earlier appends (see `AppendState.outputs`) go with it.
+    """
+    tables = output_tables(domain_config, output_format, field_names, compression)
+    path = state_path(tables[0][1])
+    if not os.path.exists(path):
+        return
+    logging.info(f"Removing {path}; the output is regenerated from scratch")
+    with open(path, 'r', encoding='utf-8') as file:
+        state = json.load(file)
+    outputs = {file_name for _, file_name, _, _ in tables}
+    stale = [file_name for entry in state.get('tables', {}).values() for file_name in entry['files']
+             if file_name not in outputs]
+    stale += [os.path.join(os.path.dirname(path), file_name) for file_name in state.get('indexes', {}).values()]
+    for file_name in stale:
+        if os.path.exists(file_name):
+            os.remove(file_name)
+    os.remove(path)
@@ -0,0 +1,353 @@
+import os
+import re
+import sys
+import json
+import time
+import pickle
+import shutil
+import hashlib
+import logging
+import argparse
+import threading
+from functools import lru_cache
+
+from config_cache import DEFAULT_DIRECTORY
+from checkpoint import config_hash
+from dataset_state import generator_fingerprint
+from value_lists import source_fingerprint, value_list_sources
+from sharding import domain_record_count
+
+CACHE_VERSION = 1
+DEFAULT_MAX_SIZE = 10 << 30
+LINK_MODES = ('copy', 'hardlink')
+SIZE_UNITS = {'': 1, 'B': 1, 'KB': 1 << 10, 'MB': 1 << 20, 'GB': 1 << 30, 'TB': 1 << 40}
+# Libraries whose version changes generated values
+VERSIONED_PACKAGES = ('faker', 'numpy', 'pyarrow', 'zstandard')
+# Modules whose code decides what a domain's output files contain; entry scripts, the benchmark,
+# the servers, scheduling and reporting do not, so editing them keeps the cache
+GENERATOR_MODULES = ('pipeline', 'sharding', 'schema_compiler', 'columnar', 'expressions', 'temporal',
+                     'relationships', 'key_allocator', 'combinations', 'children', 'faker_pool', 'value_lists',
+                     'record_batch', 'writers', 'checkpoint', 'dataset_state')
+
+
+def parse_size(size):
+    """Parse a size such as 500MB or 2GB (binary units) into bytes."""
+    if isinstance(size, int):
+        return size
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?B?)\s*', str(size).upper())
+    if not match:
+        raise ValueError(f"Invalid cache size: {size}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+@lru_cache(maxsize=None)
+def code_fingerprint():
+    """Hash the generator modules and library versions, so a change to generation invalidates the cache."""
+    from importlib import metadata
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in GENERATOR_MODULES:
+        with open(os.path.join(directory, f"{module}.py"), 'rb') as file:
+            digest.update(module.encode('utf-8') + b'\0' + file.read())
+    for package in VERSIONED_PACKAGES:
+        try:
+            version = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            version = None
+        digest.update(f"{package}={version}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def domain_key(domain_config, settings, record_count, seed, parent_keys=()):
+    """Content address of a domain's output: its definition, generation settings, size, seed,
+    the generator code, the external value lists it reads and the keys of the parents it references."""
+    return config_hash({
+        'version': CACHE_VERSION,
+        'code': code_fingerprint(),
+        'generator': generator_fingerprint(domain_config, settings),
+        'sources': [source_fingerprint(source) for source in value_list_sources(domain_config)],
+        'record_count': record_count,
+        'seed': seed,
+        'parents': sorted(parent_keys),
+    })
+
+
+def domain_keys(domains, settings, dependencies, references=None):
+    """Key every domain, parents first, so a changed parent also changes the keys of its children.
+
+    `references` maps the domains of other configuration files to (definition, that file's
+    settings); they are keyed with those settings, so editing such a file re-keys its children.
+    """
+    from scheduler import topological_order, domain_references
+    by_name = {domain['name']: domain for domain in domains}
+    keys = {name: domain_key(domain, reference_settings, domain_record_count(domain, reference_settings),
+                             reference_settings.get('seed'))
+            for name, (domain, reference_settings) in (references or {}).items()}
+    for name in topological_order(dependencies):
+        domain = by_name[name]
+        parents = dependencies[name] | (domain_references(domain) & (references or {}).keys())
+        keys[name] = domain_key(domain, settings, domain_record_count(domain, settings), settings['seed'],
+                                (keys[parent] for parent in parents))
+    return keys
+
+
+def _write_json(path, document):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(document, file, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+class CacheEntry:
+    """A cached domain: its record count and the referenced columns children need from it."""
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.records = manifest['records']
+        self.files = manifest['files']
+        self.size = manifest['size']
+        self._indexes = manifest.get('indexes', {})
+
+    def indexes(self):
+        indexes = {}
+        for field_name, file_name in self._indexes.items():
+            with open(os.path.join(self.path, file_name), 'rb') as file:
+                indexes[field_name] = pickle.load(file)
+        return indexes
+
+
+class DomainCache:
+    """Local content-addressed store of generated domain outputs with LRU eviction.
+
+    Each entry is a directory named by `domain_key` holding the output files and an
+    `entry.json`, whose modification time is the entry's last use. Outputs are copied in and out,
+    or hardlinked with `link: hardlink`; outputs are always replaced rather than truncated, so a
+    linked cache file is never overwritten.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_size=DEFAULT_MAX_SIZE, link='copy'):
+        if link not in LINK_MODES:
+            raise ValueError(f"Unsupported cache link mode '{link}'. Options: {', '.join(LINK_MODES)}")
+        self.directory = directory
+        self.entries = os.path.join(directory, 'entries')
+        self.max_size = parse_size(max_size)
+        self.link = link
+        self._lock = threading.Lock()
+        os.makedirs(self.entries, exist_ok=True)
+
+    def _count(self, **counters):
+        """Add to the persistent hit, miss, store and eviction counters."""
+        path = os.path.join(self.directory, 'stats.json')
+        with self._lock:
+            stats = _read_stats(path)
+            for name, value in counters.items():
+                stats[name] = stats.get(name, 0) + value
+            _write_json(path, stats)
+
+    def _place(self, source, target):
+        """Put a copy or hardlink of `source` at `target` atomically, replacing any existing file."""
+        temp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if self.link == 'hardlink':
+            if os.path.exists(target) and os.path.samefile(source, target):
+                return  # Already linked; renaming a link over itself would leave the temporary link behind
+            try:
+                os.link(source, temp_path)
+                os.replace(temp_path, target)
+                return
+            except OSError:  # E.g. across file systems: fall back to a copy
+                pass
+        shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+
+    def fetch(self, key, file_names):
+        """Restore a cached domain to `file_names` and return its CacheEntry, or None on a miss."""
+        path = os.path.join(self.entries, key)
+        manifest_path = os.path.join(path, 'entry.json')
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as file:
+                entry = CacheEntry(path, json.load(file))
+            if sorted(entry.files) != sorted(os.path.basename(name) for name in file_names):
+                raise ValueError(f"cache entry {key} holds different files")
+            for file_name in file_names:
+                self._place(os.path.join(path, os.path.basename(file_name)), file_name)
+            os.utime(manifest_path)  # Most recently used
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.warning(f"Ignoring cache entry {key}: {e}")
+            self._count(misses=1)
+            return None
+        self._count(hits=1, bytes_restored=entry.size)
+        return entry
+
+    def release(self, file_names):
+        """Unlink outputs that share a file with a cache entry before they are regenerated in place."""
+        for file_name in file_names:
+            if os.path.exists(file_name) and os.stat(file_name).st_nlink > 1:
+                os.remove(file_name)
+
+    def store(self, key, domain_name, records, file_names, indexes=None):
+        """Add a freshly generated domain to the cache, then evict least recently used entries over max_size."""
+        path = os.path.join(self.entries, key)
+        if os.path.exists(path):
+            return
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(temp_path)
+        try:
+            size = 0
+            for file_name in file_names:
+                target = os.path.join(temp_path, os.path.basename(file_name))
+                if self.link == 'hardlink':
+                    try:
+                        os.link(file_name, target)
+                    except OSError:
+                        shutil.copyfile(file_name, target)
+                else:
+                    shutil.copyfile(file_name, target)
+                size += os.path.getsize(target)
+            index_files = {}
+            for field_name, index in (indexes or {}).items():
+                index_files[field_name] = f"{field_name}.index"
+                with open(os.path.join(temp_path, index_files[field_name]), 'wb') as file:
+                    pickle.dump(index, file, protocol=pickle.HIGHEST_PROTOCOL)
+                size += os.path.getsize(os.path.join(temp_path, index_files[field_name]))
+            _write_json(os.path.join(temp_path, 'entry.json'), {
+                'domain': domain_name, 'records': records, 'size': size, 'created': time.time(),
+                'files': [os.path.basename(name) for name in file_names], 'indexes': index_files,
+            })
+            os.rename(temp_path, path)
+        except OSError as e:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            if not os.path.exists(path):  # Another run storing the same key at the same time is fine
+                logging.warning(f"Could not cache domain '{domain_name}': {e}")
+            return
+        self._count(stores=1)
+        self.evict()
+
+    def scan(self):
+        """Return (key, domain, size, last used) for every entry, least recently used first."""
+        entries = []
+        for key in os.listdir(self.entries):
+            if key.endswith('.tmp'):
+                continue
+            manifest_path = os.path.join(self.entries, key, 'entry.json')
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as file:
+                    manifest = json.load(file)
+                entries.append((key, manifest['domain'], manifest['size'], os.path.getmtime(manifest_path)))
+            except (OSError, ValueError):
+                continue  # Being stored or removed by another run
+        entries.sort(key=lambda entry: entry[3])
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_size."""
+        with self._lock:
+            entries = self.scan()
+            total = sum(entry[2] for entry in entries)
+            evicted = 0
+            for key, domain_name, size, _ in entries:
+                if total <= self.max_size:
+                    break
+                shutil.rmtree(os.path.join(self.entries, key), ignore_errors=True)
+                logging.info(f"Evicted cached domain '{domain_name}' ({size} bytes)")
+                total -= size
+                evicted += 1
+        if evicted:
+            self._count(evictions=evicted)
+
+    def stats(self):
+        """Summarize the cache: entries, size against its limit, and hit, miss, store and eviction counters."""
+        entries = self.scan()
+        counters = _read_stats(os.path.join(self.directory, 'stats.json'))
+        lookups = counters.get('hits', 0) + counters.get('misses', 0)
+        domains = {}
+        for _, domain_name, size, _ in entries:
+            domain = domains.setdefault(domain_name, {'entries': 0, 'bytes': 0})
+            domain['entries'] += 1
+            domain['bytes'] += size
+        return {
+            'directory': self.directory,
+            'entries': len(entries),
+            'bytes': sum(entry[2] for entry in entries),
+            'hit_rate': round(counters.get('hits', 0) / lookups, 3) if lookups else None,
+            'counters': counters,
+            'domains': domains,
+        }
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            shutil.rmtree(self.entries, ignore_errors=True)
+            os.makedirs(self.entries, exist_ok=True)
+            stats_path = os.path.join(self.directory, 'stats.json')
+            if os.path.exists(stats_path):
+                os.remove(stats_path)
+
+
+def _read_stats(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def open_cache(settings, references=None):
+    """Create the DomainCache configured by `settings.cache`, or return None when caching is off.
+
+    Caching needs a fixed seed, in the referenced configuration files too; random seeds, shared
+    databases and appends are never cached.
+    """
+    cache_settings = settings.get('cache')
+    if not cache_settings:
+        return None
+    if cache_settings is True:
+        cache_settings = {}
+    if settings.get('seed') is None:
+        logging.warning("settings.cache needs a fixed seed; caching is disabled for this run")
+        return None
+    if any(reference_settings.get('seed') is None for _, reference_settings in (references or {}).values()):
+        logging.warning("settings.cache needs a fixed seed in every referenced configuration; caching is "
+                        "disabled for this run")
+        return None
+    if settings.get('database') or settings.get('append'):
+        logging.warning("settings.cache does not apply to shared databases or appends; caching is disabled")
+        return None
+    return DomainCache(cache_settings.get('directory', DEFAULT_DIRECTORY),
+                       cache_settings.get('max_size', DEFAULT_MAX_SIZE), cache_settings.get('link', 'copy'))
+
+
+def _format_size(size):
+    unit = next(unit for unit in ('TB', 'GB', 'MB', 'KB', 'B') if size >= SIZE_UNITS[unit] or unit == 'B')
+    return f"{size / SIZE_UNITS[unit]:.1f} {unit}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or clear the cache of generated domains.")
+    parser.add_argument('command', choices=('stats', 'clear'))
+    parser.add_argument('--directory', default=DEFAULT_DIRECTORY, help=f"cache directory (default {DEFAULT_DIRECTORY})")
+    parser.add_argument('--json', action='store_true', help="print stats as JSON")
+    args = parser.parse_args(argv)
+    cache = DomainCache(args.directory)
+    if args.command == 'clear':
+        cache.clear()
+        print(f"Cleared {args.directory}")
+        return 0
+    stats = cache.stats()
+    if args.json:
+        print(json.dumps(stats, indent=2))
+        return 0
+    counters = stats['counters']
+    print(f"Cache: {stats['directory']}")
+    print(f"Entries: {stats['entries']}, {_format_size(stats['bytes'])} used")
+    print(f"Hits: {counters.get('hits', 0)}, misses: {counters.get('misses', 0)}, hit rate: "
+          f"{'n/a' if stats['hit_rate'] is None else format(stats['hit_rate'], '.1%')}")
+    print(f"Stored: {counters.get('stores', 0)}, evicted: {counters.get('evictions', 0)}, "
+          f"restored: {_format_size(counters.get('bytes_restored', 0))}")
+    for name, domain in sorted(stats['domains'].items()):
+        print(f"  {name}: {domain['entries']} entries, {_format_size(domain['bytes'])}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
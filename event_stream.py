@@ -0,0 +1,249 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+from datetime import datetime
+
+from config_cache import load_config
+from pipeline import generation_options, load_references
+from sharding import generate_sharded, resolve_seed, shard_seed, domain_record_count, DEFAULT_SHARD_SIZE
+from stream_server import ReferenceIndexes
+from schema_compiler import domain_fields
+from temporal import EPOCH, MICROSECOND, SECOND, compile_format
+
+ARRIVALS = ('uniform', 'poisson', 'diurnal')
+DEFAULT_EVENT_FIELD = 'event_time'
+DEFAULT_EVENT_FORMAT = 'YYYY-MM-DDTHH:mm:ss.SSS'
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def parse_duration(duration):
+    """Parse a duration such as 90s, 15m, 12h or 30d into seconds."""
+    if isinstance(duration, (int, float)):
+        return float(duration)
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*', str(duration).lower())
+    if not match:
+        raise ValueError(f"Invalid duration: {duration}")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+class ArrivalProcess:
+    """Event times in seconds after the start of a stream, increasing, drawn a batch at a time.
+
+    `uniform` spaces events exactly 1/rate apart and `poisson` draws exponential gaps with mean
+    1/rate. `diurnal` is a Poisson process whose rate follows a daily cosine peaking at
+    `peak_hour`, swinging by `amplitude` around `rate`; it is drawn by thinning a Poisson process
+    at the peak rate, so it averages `rate` over a day.
+    """
+
+    def __init__(self, rate, arrival='poisson', seed=None, start_hour=0.0, peak_hour=14.0, amplitude=0.5):
+        import numpy as np
+        if arrival not in ARRIVALS:
+            raise ValueError(f"Unsupported arrival '{arrival}'. Options: {', '.join(ARRIVALS)}")
+        if not rate > 0:
+            raise ValueError(f"Invalid event rate: {rate}")
+        if not 0 <= amplitude <= 1:
+            raise ValueError(f"Diurnal amplitude must be between 0 and 1, not {amplitude}")
+        self.rate = float(rate)
+        self.arrival = arrival
+        self.rng = np.random.default_rng(seed)
+        self.phase = (start_hour - peak_hour) / 24  # Days from the peak at time 0
+        self.amplitude = amplitude
+        self.elapsed = 0.0
+        self.emitted = 0
+
+    def rate_at(self, times):
+        """Instantaneous diurnal rate at an array of event times."""
+        import numpy as np
+        return self.rate * (1 + self.amplitude * np.cos(2 * np.pi * (times / 86400 + self.phase)))
+
+    def next(self, count):
+        """Return the times of the next `count` events as a float64 array, continuing the last batch."""
+        import numpy as np
+        if self.arrival == 'uniform':
+            times = (self.emitted + np.arange(1, count + 1)) / self.rate
+        elif self.arrival == 'poisson':
+            times = self.elapsed + np.cumsum(self.rng.exponential(1 / self.rate, count))
+        else:
+            peak = self.rate * (1 + self.amplitude)
+            kept, start = [], self.elapsed
+            while sum(map(len, kept)) < count:
+                # At least 1 / (1 + amplitude) of the candidates are kept, so two rounds usually suffice
+                candidates = start + np.cumsum(self.rng.exponential(1 / peak, 2 * (count - sum(map(len, kept)))))
+                accepted = candidates[self.rng.random(len(candidates)) * peak < self.rate_at(candidates)]
+                kept.append(accepted[:count - sum(map(len, kept))])
+                # The process is memoryless, so the next round may start from the last event kept
+                start = kept[-1][-1] if len(accepted) > len(kept[-1]) else candidates[-1]
+            times = np.concatenate(kept) if kept else np.empty(0)
+        if count:
+            self.elapsed = float(times[-1])
+            self.emitted += count
+        return times
+
+
+class TokenBucket:
+    """Cap a stream's throughput at `rate` events a second, allowing bursts of up to `capacity` events."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self, count):
+        """Take `count` tokens, sleeping until the bucket has refilled enough to cover them."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - count
+        self.updated = now
+        if self.tokens < 0:
+            time.sleep(-self.tokens / self.rate)
+
+
+def event_settings(domain_config, overrides):
+    """Merge a domain's `events` settings with command-line overrides (None means not given)."""
+    events = dict(domain_config.get('events') or {})
+    events.update((key, value) for key, value in overrides.items() if value is not None)
+    return events
+
+
+class EventStream:
+    """Emit a domain's records as a time-ordered event feed.
+
+    Every record gets an event timestamp in `field` from an `ArrivalProcess` started at `start`
+    (default: now). With `speed` 1 records are released in real time, each once the wall clock
+    reaches its timestamp, so timestamps track wall-clock time; `speed` 60 plays an hour a minute,
+    and `speed` 0 fast-forwards, generating as fast as the CPU allows. `max_rate` caps the
+    throughput with a token bucket whatever the speed. The stream ends after `count` events
+    (default: the domain's record_count, which its key ranges must cover) or `duration` of event
+    time, whichever comes first. Records are those of a file run with the same seed and shard_size.
+    """
+
+    def __init__(self, config, domain_name, events, seed=None, workers=None, references=None):
+        settings = config['mock_data_generator']['settings']
+        domains = {domain['name']: domain for domain in config['mock_data_generator']['domains']}
+        if domain_name not in domains:
+            raise ValueError(f"Unknown domain '{domain_name}'. Options: {', '.join(domains)}")
+        self.domain_config = domain = domains[domain_name]
+        self.settings = settings
+        self.field = events.get('field', DEFAULT_EVENT_FIELD)
+        for field in domain_fields(domain):
+            if (field.get('offset') or {}).get('field') == self.field:
+                raise ValueError(f"Field '{field['name']}' is an offset from '{self.field}', which the event "
+                                 f"stream overwrites; use another event field.")
+        self.format = compile_format(events.get('format', DEFAULT_EVENT_FORMAT))
+        start = events.get('start')
+        self.start = datetime.now() if start in (None, 'now') else datetime.fromisoformat(str(start))
+        self.speed = float(events.get('speed', 1))
+        self.duration = parse_duration(events['duration']) if events.get('duration') is not None else None
+        count = int(events.get('count', domain.get('record_count', settings['record_count'])))
+        self.count = domain_record_count(dict(domain, record_count=count), settings)
+        self.seed = resolve_seed(seed if seed is not None else settings.get('seed'), domain_name)
+        self.workers = workers or settings.get('workers')
+        self.shard_size = int(events.get('batch_size', settings.get('shard_size', DEFAULT_SHARD_SIZE)))
+        start_hour = self.start.hour + self.start.minute / 60 + self.start.second / 3600
+        self.arrivals = ArrivalProcess(float(events.get('rate', 1000)), events.get('arrival', 'poisson'),
+                                       shard_seed(self.seed, domain_name, 'arrivals'), start_hour,
+                                       float(events.get('peak_hour', 14)), float(events.get('amplitude', 0.5)))
+        max_rate = events.get('max_rate')
+        self.bucket = TokenBucket(float(max_rate), max(float(max_rate), 1)) if max_rate else None
+        self.references = ReferenceIndexes(config, self.shard_size, self.workers, references=references)
+
+    def batches(self):
+        """Yield (RecordBatch, event times in seconds) in order until the stream's count or duration ends."""
+        name = self.domain_config['name']
+        batches = generate_sharded(self.domain_config, self.count, self.seed, self.workers, self.shard_size,
+                                   self.settings.get('engine', 'row').lower(),
+                                   self.references.reference_data(name, self.seed),
+                                   **generation_options(self.settings))
+        for batch in batches:
+            times = self.arrivals.next(len(batch))
+            if self.duration is not None and len(times) and times[-1] > self.duration:
+                end = int(times.searchsorted(self.duration, side='right'))
+                yield batch[:end], times[:end]
+                return
+            yield batch, times
+        if self.duration is not None:
+            logging.warning(f"Stream of '{name}' ended after {self.count} events at "
+                            f"{self.arrivals.elapsed:.0f}s of {self.duration:.0f}s; raise count to fill the duration")
+
+    def run(self, write):
+        """Stamp and release every event, calling `write(bytes)` with JSON lines; return the number of events."""
+        encode = json.JSONEncoder().encode
+        start = (self.start - EPOCH) // MICROSECOND
+        started = time.monotonic()
+        sent = 0
+        for batch, times in self.batches():
+            batch.set_column(self.field, self.format.format_array(start + (times * SECOND).astype('int64')))
+            position = 0
+            while position < len(batch):
+                end = len(batch)
+                if self.speed:  # Release only the events whose time has come
+                    now = (time.monotonic() - started) * self.speed
+                    end = int(times.searchsorted(now, side='right'))
+                    if end <= position:
+                        time.sleep(min((times[position] - now) / self.speed, 1.0))
+                        continue
+                if self.bucket is not None:
+                    end = min(end, position + math.ceil(self.bucket.capacity))
+                    self.bucket.take(end - position)
+                write(''.join(f"{encode(record)}\n" for record in batch[position:end].records()).encode('utf-8'))
+                sent += end - position
+                position = end
+        seconds = time.monotonic() - started
+        logging.info(f"Emitted {sent} {self.domain_config['name']} events spanning {self.arrivals.elapsed:.1f}s "
+                     f"of event time in {seconds:.1f}s ({sent / seconds if seconds else 0:.0f} events/s)")
+        return sent
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Emit a domain's records as a rate-controlled, time-ordered event stream.")
+    parser.add_argument('config', help="configuration file, e.g. order.yaml")
+    parser.add_argument('domain', help="domain to stream")
+    parser.add_argument('--rate', type=float, help="mean events per second of event time (default 1000)")
+    parser.add_argument('--arrival', choices=ARRIVALS, help="arrival pattern (default poisson)")
+    parser.add_argument('--peak-hour', type=float, help="hour of the diurnal peak (default 14)")
+    parser.add_argument('--amplitude', type=float, help="diurnal swing around the mean rate, 0 to 1 (default 0.5)")
+    parser.add_argument('--count', type=int, help="events to emit (default the domain's record_count)")
+    parser.add_argument('--duration', help="event time to cover, e.g. 30d; ends the stream early")
+    parser.add_argument('--start', help="timestamp of the first event's clock, ISO format (default now)")
+    parser.add_argument('--speed', type=float, help="event seconds per wall-clock second (default 1)")
+    parser.add_argument('--fast-forward', action='store_true', help="generate as fast as possible (speed 0)")
+    parser.add_argument('--max-rate', type=float, help="cap on events per wall-clock second")
+    parser.add_argument('--seed', type=int, help="seed (default settings.seed, else random)")
+    parser.add_argument('--workers', type=int, help="generator processes (default settings.workers)")
+    parser.add_argument('--output', help="file to write JSON lines to (default stdout)")
+    args = parser.parse_args(argv)
+    try:
+        config = load_config(args.config)
+        domain = next((domain for domain in config['mock_data_generator']['domains']
+                       if domain['name'] == args.domain), {})
+        events = event_settings(domain, {
+            'rate': args.rate, 'arrival': args.arrival, 'peak_hour': args.peak_hour, 'amplitude': args.amplitude,
+            'count': args.count, 'duration': args.duration, 'start': args.start,
+            'speed': 0 if args.fast_forward else args.speed, 'max_rate': args.max_rate})
+        stream = EventStream(config, args.domain, events, args.seed, args.workers,
+                             load_references(config['mock_data_generator'], args.config))
+        output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        try:
+            def write(data):
+                output.write(data)
+                output.flush()  # Consumers see each batch as soon as it is due
+            stream.run(write)
+        finally:
+            if args.output:
+                output.close()
+    except BrokenPipeError:  # The consumer stopped reading; keep the exit flush of stdout from failing again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except Exception as e:
+        logging.critical(f"Program terminated due to an error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,392 @@
+import re
+import ast
+import sys
+import copy
+import random
+import importlib
+from collections import namedtuple
+from datetime import datetime, date, timedelta
+
+# A parsed, validated formula. `names` are the record fields it reads.
+Formula = namedtuple('Formula', ['source', 'tree', 'code', 'names', 'field_name'])
+
+SAFE_BUILTINS = {
+    'abs': abs, 'bool': bool, 'float': float, 'int': int, 'len': len, 'max': max,
+    'min': min, 'round': round, 'str': str, 'sum': sum,
+}
+MODULE_NAMES = frozenset(['random', 'datetime', 'date', 'timedelta'])
+CONSTRUCTORS = frozenset(['datetime', 'date', 'timedelta'])
+INTERNAL_IMPORTS = frozenset(['_strptime', 'time'])  # Imported by datetime.strptime and friends
+RANDOM_FUNCTIONS = frozenset([
+    'betavariate', 'choice', 'expovariate', 'gauss', 'lognormvariate', 'normalvariate',
+    'randint', 'random', 'randrange', 'triangular', 'uniform',
+])
+ALLOWED_ATTRIBUTES = RANDOM_FUNCTIONS | frozenset([
+    # datetime, date and timedelta
+    'now', 'today', 'fromisoformat', 'strptime', 'strftime', 'isoformat', 'date', 'time', 'replace',
+    'year', 'month', 'day', 'hour', 'minute', 'second', 'weekday', 'isoweekday', 'timestamp',
+    'days', 'seconds', 'total_seconds',
+    # str
+    'capitalize', 'count', 'endswith', 'find', 'join', 'ljust', 'lower', 'lstrip', 'replace',
+    'rjust', 'rsplit', 'rstrip', 'split', 'startswith', 'strip', 'title', 'upper', 'zfill',
+])
+PADDING_METHODS = frozenset(['ljust', 'rjust', 'zfill'])
+MAX_INTEGER_BITS = 4096  # Largest integer `**` may produce in a formula
+MAX_SEQUENCE_LENGTH = 1 << 20  # Longest string or list `*` or padding may produce in a formula
+# Width and precision of a printf-style conversion, e.g. `%-08.3f` or `%(name)*d`
+PERCENT_FIELD = re.compile(r'%(?:\([^)]*\))?[#0 +-]*(\*|\d*)(?:\.(\*|\d*))?')
+ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Call,
+    ast.Attribute, ast.Subscript, ast.Slice, ast.Name, ast.Constant, ast.JoinedStr, ast.FormattedValue,
+    ast.Tuple, ast.List, ast.keyword, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub, ast.Not, ast.And, ast.Or,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+)
+
+
+def _checked_pow(base, exponent):
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0 \
+            and exponent * abs(base).bit_length() > MAX_INTEGER_BITS and abs(base) > 1:
+        raise ValueError(f"Formula result {base} ** {exponent} would exceed {MAX_INTEGER_BITS} bits.")
+    return base ** exponent
+
+
+def _checked_mul(left, right):
+    for sequence, times in ((left, right), (right, left)):
+        if isinstance(sequence, (str, bytes, list, tuple)) and isinstance(times, int) \
+                and len(sequence) * times > MAX_SEQUENCE_LENGTH:
+            raise ValueError(f"Formula would repeat a sequence of {len(sequence)} items {times} times.")
+    return left * right
+
+
+def _checked_width(width):
+    if isinstance(width, int) and width > MAX_SEQUENCE_LENGTH:
+        raise ValueError(f"Formula would pad a string to {width} characters.")
+    return width
+
+
+def _checked_spec(spec):
+    """Check the width and precision of an f-string format spec, e.g. `>12` or `,.2f`."""
+    for number in re.findall(r'\d+', spec):
+        _checked_width(int(number))
+    return spec
+
+
+def _checked_mod(left, right):
+    if isinstance(left, str):
+        for width, precision in PERCENT_FIELD.findall(left):
+            if '*' in (width, precision):
+                raise ValueError("Formula cannot take a %-format width or precision from its arguments.")
+            for number in (width, precision):
+                if number:
+                    _checked_width(int(number))
+    return left % right
+
+
+GUARDS = {'_checked_pow': _checked_pow, '_checked_mul': _checked_mul, '_checked_mod': _checked_mod,
+          '_checked_width': _checked_width, '_checked_spec': _checked_spec}
+
+
+class _Guard(ast.NodeTransformer):
+    """Route `**`, `*`, `%` and padding and format widths through the size checks, so a formula
+    cannot exhaust memory."""
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        guard = {ast.Pow: '_checked_pow', ast.Mult: '_checked_mul', ast.Mod: '_checked_mod'}.get(type(node.op))
+        if guard is None:
+            return node
+        return ast.Call(func=ast.Name(id=guard, ctx=ast.Load()), args=[node.left, node.right], keywords=[])
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Attribute) and node.func.attr in PADDING_METHODS and node.args:
+            node.args[0] = ast.Call(func=ast.Name(id='_checked_width', ctx=ast.Load()), args=[node.args[0]],
+                                    keywords=[])
+        return node
+
+    def visit_FormattedValue(self, node):
+        self.generic_visit(node)
+        if node.format_spec is not None:  # The spec may itself hold replacement fields: check it once built
+            spec = ast.Call(func=ast.Name(id='_checked_spec', ctx=ast.Load()), args=[node.format_spec], keywords=[])
+            node.format_spec = ast.JoinedStr(values=[ast.FormattedValue(value=spec, conversion=-1, format_spec=None)])
+        return node
+
+
+def _compile_guarded(node, field_name):
+    """Compile a validated expression node with its size checks, leaving the node itself unchanged."""
+    tree = _Guard().visit(ast.Expression(body=copy.deepcopy(node)))
+    return compile(ast.fix_missing_locations(tree), f"<formula:{field_name}>", 'eval')
+
+
+def formula_names(formula):
+    """Return the identifiers a formula reads, without validating it."""
+    return {node.id for node in ast.walk(ast.parse(formula, mode='eval')) if isinstance(node, ast.Name)}
+
+
+def _validate(tree, field_name, known_fields):
+    """Reject any syntax, name or attribute outside the formula whitelist."""
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise ValueError(f"Unsupported syntax '{type(node).__name__}' in formula for field {field_name}.")
+        if isinstance(node, ast.Attribute) and (node.attr.startswith('_') or node.attr not in ALLOWED_ATTRIBUTES):
+            raise ValueError(f"Attribute '{node.attr}' is not allowed in formula for field {field_name}.")
+        if isinstance(node, ast.Name):
+            if node.id.startswith('_'):
+                raise ValueError(f"Name '{node.id}' is not allowed in formula for field {field_name}.")
+            if known_fields is not None and node.id not in known_fields \
+                    and node.id not in MODULE_NAMES and node.id not in SAFE_BUILTINS:
+                raise ValueError(f"Unknown name '{node.id}' in formula for field {field_name}.")
+        if isinstance(node, ast.Call):
+            func = node.func
+            if isinstance(func, ast.Name) and func.id not in SAFE_BUILTINS and func.id not in CONSTRUCTORS:
+                raise ValueError(f"Function '{func.id}' is not allowed in formula for field {field_name}.")
+            if not isinstance(func, (ast.Name, ast.Attribute)):
+                raise ValueError(f"Unsupported call in formula for field {field_name}.")
+
+
+def compile_formula(formula, field_name, known_fields=None):
+    """Parse and validate a computed-field formula once, returning a reusable Formula."""
+    try:
+        tree = ast.parse(str(formula).strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid formula for field {field_name}: {e}")
+    _validate(tree, field_name, known_fields)
+    names = tuple(sorted({
+        node.id for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and node.id not in MODULE_NAMES and node.id not in SAFE_BUILTINS
+    }))
+    code = _compile_guarded(tree.body, field_name)
+    return Formula(source=formula, tree=tree, code=code, names=names, field_name=field_name)
+
+
+def _internal_import(name, *args, **kwargs):
+    """Serve only the imports datetime performs internally; formulas cannot name this function."""
+    if name not in INTERNAL_IMPORTS:
+        raise ImportError(f"Import of '{name}' is not allowed in formulas.")
+    module = sys.modules.get(name)
+    return module if module is not None else importlib.import_module(name)
+
+
+def formula_globals(rng=random):
+    """Build the restricted global namespace formulas are evaluated in."""
+    return {'__builtins__': {'__import__': _internal_import}, **SAFE_BUILTINS, **GUARDS,
+            'random': rng, 'datetime': datetime, 'date': date, 'timedelta': timedelta}
+
+
+def bind_row(formula, rng=random):
+    """Return `evaluate(record)` for row-at-a-time generation."""
+    code, env, field_name = formula.code, formula_globals(rng), formula.field_name
+
+    def evaluate(record):
+        try:
+            return eval(code, env, record)
+        except NameError as e:
+            raise ValueError(f"Missing field for computed formula in field {field_name}: {e}")
+    return evaluate
+
+
+def _reads_fields(node, fields):
+    """True if the sub-expression reads a record field."""
+    return any(isinstance(child, ast.Name) and child.id in fields for child in ast.walk(node))
+
+
+def _draws_random(node):
+    """True if the sub-expression calls into `random`."""
+    return any(
+        isinstance(child, ast.Attribute) and isinstance(child.value, ast.Name) and child.value.id == 'random'
+        for child in ast.walk(node)
+    )
+
+
+def bind_columns(formula, rng):
+    """Return `evaluate(columns, count)` that computes a formula across a whole batch.
+
+    Arithmetic, comparisons, conditional expressions, constant sub-expressions, `random.*` draws,
+    round/int/float and plain f-strings run as NumPy array operations; any other sub-expression is evaluated
+    row by row over just the columns it reads. `*`, `**` and `%` on anything but numbers are applied
+    element by element with the same size checks as the row engine.
+    """
+    import numpy as np
+
+    fields = set(formula.names)
+    binary_ops = {
+        ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.true_divide,
+        ast.FloorDiv: np.floor_divide, ast.Mod: np.mod, ast.Pow: np.power,
+    }
+    compare_ops = {
+        ast.Eq: np.equal, ast.NotEq: np.not_equal, ast.Lt: np.less,
+        ast.LtE: np.less_equal, ast.Gt: np.greater, ast.GtE: np.greater_equal,
+    }
+
+    def checked(op, guard):
+        """Apply `op` to numbers as an array operation, and `guard` element by element to anything else."""
+        element_wise = np.frompyfunc(guard, 2, 1)
+
+        def is_numeric(value):
+            return value.dtype.kind in 'iufb' if isinstance(value, np.ndarray) \
+                else isinstance(value, (int, float, np.number))
+
+        return lambda left, right: op(left, right) if is_numeric(left) and is_numeric(right) \
+            else element_wise(left, right)
+    binary_ops[ast.Mult] = checked(np.multiply, _checked_mul)
+    binary_ops[ast.Pow] = checked(np.power, _checked_pow)
+    binary_ops[ast.Mod] = checked(np.mod, _checked_mod)
+
+    def to_object(values):
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+
+    def per_row(node):
+        """Fallback: evaluate one sub-expression row by row over the columns it reads."""
+        code = _compile_guarded(node, formula.field_name)
+        names = sorted({child.id for child in ast.walk(node) if isinstance(child, ast.Name) and child.id in fields})
+
+        def evaluate(columns, count, env):
+            inputs = [columns[name].tolist() for name in names]
+            rows = zip(*inputs) if inputs else ((),) * count
+            try:
+                return to_object([eval(code, env, dict(zip(names, row))) for row in rows])
+            except NameError as e:
+                raise ValueError(f"Missing field for computed formula in field {formula.field_name}: {e}")
+        return evaluate
+
+    def constant(node):
+        code = _compile_guarded(node, formula.field_name)
+        return lambda columns, count, env: eval(code, env, {})
+
+    def random_call(node):
+        """Vectorize random.<fn>(...) as one draw per row from the NumPy generator."""
+        if node.keywords:
+            return None
+        args = [vectorize(arg) for arg in node.args]
+        if any(arg is None for arg in args):
+            return None
+        name = node.func.attr
+        draw = {
+            'uniform': lambda count, a, b: rng.uniform(a, b, count) if np.isscalar(a) and np.isscalar(b)
+            else a + (b - a) * rng.random(count),
+            'randint': lambda count, a, b: rng.integers(a, b, count, endpoint=True),
+            'random': lambda count: rng.random(count),
+            'gauss': lambda count, mu, sigma: rng.normal(mu, sigma, count),
+            'normalvariate': lambda count, mu, sigma: rng.normal(mu, sigma, count),
+            'expovariate': lambda count, lambd: rng.exponential(1 / lambd, count),
+            'triangular': lambda count, low=0.0, high=1.0, mode=None: rng.triangular(
+                low, (low + high) / 2 if mode is None else mode, high, count),
+        }.get(name)
+        if draw is None:
+            return None
+        return lambda columns, count, env: draw(count, *(arg(columns, count, env) for arg in args))
+
+    def joined_str(node):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(lambda columns, count, env, text=str(value.value): text)
+            elif value.conversion == -1 and value.format_spec is None:
+                inner = vectorize(value.value)
+                if inner is None:
+                    return None
+                parts.append(lambda columns, count, env, inner=inner: inner(columns, count, env))
+            else:
+                return None
+
+        def evaluate(columns, count, env):
+            result = np.full(count, '', dtype=object)
+            for part in parts:
+                value = part(columns, count, env)
+                if isinstance(value, np.ndarray):
+                    result = result + to_object([str(item) for item in value.tolist()])
+                else:
+                    result = result + str(value)
+            return result
+        return evaluate
+
+    def vectorize(node):
+        """Compile a node into `evaluate(columns, count, env)`, or None if it must run per row."""
+        if not _reads_fields(node, fields) and not _draws_random(node):
+            return constant(node)
+        if isinstance(node, ast.Name):
+            return lambda columns, count, env, name=node.id: columns[name]
+        if isinstance(node, ast.BinOp) and type(node.op) in binary_ops:
+            left, right, op = vectorize(node.left), vectorize(node.right), binary_ops[type(node.op)]
+            if left is None or right is None:
+                return None
+            return lambda columns, count, env: op(left(columns, count, env), right(columns, count, env))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand = vectorize(node.operand)
+            if operand is None:
+                return None
+            sign = -1 if isinstance(node.op, ast.USub) else 1
+            return lambda columns, count, env: sign * operand(columns, count, env)
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in compare_ops:
+            left, right, op = vectorize(node.left), vectorize(node.comparators[0]), compare_ops[type(node.ops[0])]
+            if left is None or right is None:
+                return None
+            return lambda columns, count, env: op(left(columns, count, env), right(columns, count, env))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) \
+                and isinstance(node.func.value, ast.Name) and node.func.value.id == 'random':
+            return random_call(node)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords \
+                and node.func.id in ('round', 'int', 'float') and node.args:
+            args = [vectorize(arg) for arg in node.args]
+            if any(arg is None for arg in args):
+                return None
+            return numeric_call(node.func.id, args, per_row(node))
+        if isinstance(node, ast.JoinedStr):
+            return joined_str(node)
+        if isinstance(node, ast.IfExp):
+            test, body, orelse = vectorize(node.test), vectorize(node.body), vectorize(node.orelse)
+            if test is None or body is None or orelse is None:
+                return None
+            return lambda columns, count, env: if_else(test(columns, count, env), body(columns, count, env),
+                                                       orelse(columns, count, env))
+        return None
+
+    def if_else(test, body, orelse):
+        """Select per row between two evaluated branches, keeping mixed types as objects."""
+        if not isinstance(test, np.ndarray):
+            return body if test else orelse
+        if any(isinstance(branch, np.ndarray) and branch.dtype.kind in 'USO' for branch in (body, orelse)) \
+                or isinstance(body, str) or isinstance(orelse, str):
+            body, orelse = (to_object(branch.tolist()) if isinstance(branch, np.ndarray) else branch
+                            for branch in (body, orelse))
+        return np.where(test, body, orelse)
+
+    def numeric_call(name, args, fallback):
+        def evaluate(columns, count, env):
+            values = args[0](columns, count, env)
+            if not isinstance(values, np.ndarray) or values.dtype.kind not in 'iufb':
+                return fallback(columns, count, env)
+            if name == 'round':
+                digits = args[1](columns, count, env) if len(args) > 1 else None
+                return np.round(values).astype(np.int64) if digits is None else np.round(values, digits)
+            if name == 'int':
+                return np.trunc(values).astype(np.int64)
+            return values.astype(np.float64)
+        return evaluate
+
+    def vectorize_or_fallback(node):
+        """Like vectorize, but fall back to per-row evaluation for unsupported children."""
+        evaluate = vectorize(node)
+        if evaluate is not None:
+            return evaluate
+        # Try to keep the outer operation vectorized by falling back only for the failing operands
+        if isinstance(node, ast.BinOp) and type(node.op) in binary_ops:
+            left, right, op = vectorize_or_fallback(node.left), vectorize_or_fallback(node.right), \
+                binary_ops[type(node.op)]
+            return lambda columns, count, env: op(left(columns, count, env), right(columns, count, env))
+        return per_row(node)
+
+    root = vectorize_or_fallback(formula.tree.body)
+
+    def evaluate(columns, count):
+        # Row-level fallbacks draw from a stdlib generator seeded from the batch generator
+        env = formula_globals(random.Random(int(rng.integers(2 ** 63))))
+        result = root(columns, count, env)
+        if not isinstance(result, np.ndarray):
+            return np.full(count, result, dtype=object)
+        return result
+    return evaluate
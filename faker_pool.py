@@ -0,0 +1,165 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+DEFAULT_POOL_SIZE = 10000
+DEFAULT_CACHE_SIZE = 5000000  # Values kept across all pools
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_fill_lock = threading.Lock()  # Pools share one Faker per locale, so fills never overlap
+_cache_limit = DEFAULT_CACHE_SIZE
+_cached_values = 0
+_fakers = {}
+_unseeded_seed = int.from_bytes(os.urandom(8), 'little')  # Seeds pools requested without any seed
+
+
+def set_cache_limit(max_values):
+    """Bound the number of values kept across all cached pools."""
+    global _cache_limit
+    with _cache_lock:
+        _cache_limit = max_values
+        _evict()
+
+
+def _evict():
+    """Drop least recently used pools until the cache is within its limit."""
+    global _cached_values
+    while _cached_values > _cache_limit and len(_cache) > 1:
+        _, values = _cache.popitem(last=False)
+        _cached_values -= len(values)
+
+
+def resolve_pool_config(field, defaults=None, seed=None):
+    """Merge a faker field's `pool` settings with the run defaults, or return None if unpooled.
+
+    A pool neither sets a seed for is seeded with `seed`, the domain's run seed: an unseeded run
+    gets new values every time, and a resumed or appended one the values it started with. Such
+    pools are not persisted, since no other run draws the same seed.
+    """
+    pool = field.get('pool', defaults is not None)
+    if pool is False or pool is None:
+        return None
+    merged = dict(defaults or {})
+    if isinstance(pool, dict):
+        merged.update(pool)
+    return {
+        'size': int(merged.get('size', DEFAULT_POOL_SIZE)),
+        'unique': bool(merged.get('unique', False)),
+        'locale': field.get('locale', merged.get('locale')),
+        'seed': merged['seed'] if merged.get('seed') is not None else seed,
+        'cache_dir': merged.get('cache_dir') if merged.get('seed') is not None else None,  # Never reused
+    }
+
+
+def with_pool_config(field, defaults=None, seed=None):
+    """Return the field config with its `pool` entry resolved, for faker string fields."""
+    if field.get('type') != 'string' or 'faker' not in field:
+        return field
+    pool_config = resolve_pool_config(field, defaults, seed)
+    return dict(field, pool=pool_config) if pool_config else field
+
+
+def pool_defaults(settings):
+    """Read the run-wide `faker_pool` settings, applying its cache size; None when pooling is off."""
+    if not settings.get('faker_pool'):
+        return None
+    defaults = dict(settings['faker_pool'])
+    if 'cache_size' in defaults:
+        set_cache_limit(int(defaults['cache_size']))
+    defaults.setdefault('seed', settings.get('seed'))
+    return defaults
+
+
+def _pool_key(provider, size, locale, seed, unique):
+    """Identify a pool; identical keys always hold identical values."""
+    return f"{provider}|{size}|{locale or 'default'}|{seed}|{int(unique)}"
+
+
+def _fill_pool(provider, size, locale, seed, unique):
+    """Generate `size` values from a Faker provider with a dedicated seeded instance."""
+    from faker import Faker
+    from faker.exceptions import UniquenessException
+    with _fill_lock:
+        fake = _fakers.get(locale)
+        if fake is None:
+            fake = _fakers[locale] = Faker(locale) if locale else Faker()
+        fake.seed_instance(f"{seed}:{provider}:{size}")
+        fake.unique.clear()
+        method = getattr(fake.unique if unique else fake, provider)
+        try:
+            return tuple(method() for _ in range(size))
+        except UniquenessException:
+            raise ValueError(f"Faker provider '{provider}' cannot produce {size} unique values; lower pool size.")
+
+
+def _load_from_disk(cache_dir, key):
+    """Read a persisted pool, or return None if it is not on disk."""
+    path = os.path.join(cache_dir, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return tuple(json.load(file))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _save_to_disk(cache_dir, key, values):
+    """Persist a pool atomically so concurrent processes never see a partial file."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(list(values), file)
+    os.replace(temp_path, path)
+
+
+def get_pool(provider, size=DEFAULT_POOL_SIZE, locale=None, seed=None, unique=False, cache_dir=None):
+    """Return a tuple of pre-generated values for a Faker provider, building it at most once.
+
+    Without a `seed` the pool is filled from a seed drawn once per process and never persisted,
+    since no later run could reuse it.
+    """
+    global _cached_values
+    if seed is None:
+        seed, cache_dir = f"unseeded-{_unseeded_seed}", None
+    key = _pool_key(provider, size, locale, seed, unique)
+    with _cache_lock:
+        values = _cache.get(key)
+        if values is not None:
+            _cache.move_to_end(key)
+            return values
+
+    values = _load_from_disk(cache_dir, key) if cache_dir else None
+    if values is None:
+        values = _fill_pool(provider, size, locale, seed, unique)
+        logging.debug(f"Filled faker pool '{key}' with {len(values)} values")
+        if cache_dir:
+            _save_to_disk(cache_dir, key, values)
+
+    with _cache_lock:
+        if key not in _cache:
+            _cache[key] = values
+            _cached_values += len(values)
+            _evict()
+    return values
+
+
+def pool_for_field(field, pool_config):
+    """Return the value pool for a pooled faker field."""
+    return get_pool(field['faker'], pool_config['size'], pool_config['locale'], pool_config['seed'],
+                    pool_config['unique'], pool_config['cache_dir'])
+
+
+def warm_pools(domain_config, defaults=None):
+    """Fill every pool a domain uses, so forked worker processes inherit them ready-made.
+
+    Pools without a configured seed take the domain's run seed, which is drawn later; each
+    worker fills those itself.
+    """
+    for field in domain_config['fields']:
+        field = with_pool_config(field, defaults)
+        if field.get('pool') and field['pool']['seed'] is not None:
+            pool_for_field(field, field['pool'])
@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+from collections import defaultdict
+
+DEFAULT_SAMPLE_EVERY = 64  # Row engine: time the fields of one record in this many
+
+
+def generator_type(field_config):
+    """Name the generator a field uses, separating faker providers: e.g. `faker.email`, `computed`."""
+    if field_config.get('type') == 'string' and 'faker' in field_config:
+        pooled = '.pool' if field_config.get('pool') else ''
+        return f"faker.{field_config['faker']}{pooled}"
+    return field_config.get('type') or 'unknown'
+
+
+def new_shard_stats():
+    """Per-shard counters, returned from worker processes and merged by RunMetrics."""
+    return {'stages': defaultdict(float), 'fields': {}, 'records': 0}
+
+
+def add_field_time(stats, name, field_type, seconds, timed, values=0):
+    """Add `seconds` spent generating `timed` values of one field, out of `values` it generated."""
+    entry = stats['fields'].get(name)
+    if entry is None:
+        entry = stats['fields'][name] = [field_type, 0.0, 0, 0]
+    entry[1] += seconds
+    entry[2] += timed
+    entry[3] += values
+
+
+def count_values(stats, plan, count, prefix=''):
+    """Record that every field of a compiled plan generated `count` values, timed or not."""
+    for field in plan.fields:
+        add_field_time(stats, prefix + field.name, generator_type(field.config), 0.0, 0, count)
+
+
+def merge_shard_stats(stats, other):
+    """Add the counters of `other` to `stats`."""
+    for stage, seconds in other['stages'].items():
+        stats['stages'][stage] += seconds
+    for name, entry in other['fields'].items():
+        add_field_time(stats, name, *entry)
+    stats['records'] += other['records']
+
+
+def _peak_rss_bytes(who):
+    """Peak resident set size of this process or of its finished children, in bytes."""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # ru_maxrss is in KB on Linux
+
+
+class RunMetrics:
+    """Aggregate per-domain stage times, per-field generation time and record counts for one run.
+
+    Shards report their own counters (see `new_shard_stats`), so the cost per record is only a
+    counter check; field times in the row engine are sampled and scaled up to all values.
+    """
+
+    def __init__(self, sample_every=DEFAULT_SAMPLE_EVERY):
+        self.sample_every = max(1, int(sample_every))
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.domains = {}
+
+    def _domain(self, name):
+        domain = self.domains.get(name)
+        if domain is None:
+            domain = self.domains[name] = {
+                'stages': defaultdict(float), 'fields': {}, 'records': 0, 'written': 0,
+            }
+        return domain
+
+    def add_stage(self, domain_name, stage, seconds):
+        with self._lock:
+            self._domain(domain_name)['stages'][stage] += seconds
+
+    def add_shard(self, domain_name, stats):
+        """Merge the counters a shard returned."""
+        with self._lock:
+            merge_shard_stats(self._domain(domain_name), stats)
+
+    def add_written(self, domain_name, records):
+        with self._lock:
+            self._domain(domain_name)['written'] += records
+
+    def report(self):
+        """Build the run report: stages, slowest fields first and totals per generator type."""
+        domains, generator_types = {}, defaultdict(float)
+        with self._lock:
+            for name, domain in self.domains.items():
+                fields = []
+                for field_name, (field_type, seconds, timed, values) in domain['fields'].items():
+                    # Sampled timings are scaled up to every value the field generated
+                    estimate = seconds * values / timed if timed else 0.0
+                    fields.append({'field': field_name, 'type': field_type, 'seconds': round(estimate, 6),
+                                   'us_per_value': round(seconds / timed * 1e6, 3) if timed else None})
+                    generator_types[field_type] += estimate
+                fields.sort(key=lambda entry: entry['seconds'], reverse=True)
+                domains[name] = {
+                    'records': domain['records'],
+                    'written': domain['written'],
+                    'stages': {stage: round(seconds, 6) for stage, seconds in domain['stages'].items()},
+                    'fields': fields,
+                }
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'duration_seconds': round(time.perf_counter() - self._start, 3),
+            'sample_every': self.sample_every,
+            'peak_rss_bytes': {'main': _peak_rss_bytes(resource.RUSAGE_SELF),
+                               'workers': _peak_rss_bytes(resource.RUSAGE_CHILDREN)},
+            'generator_types': {name: round(seconds, 6) for name, seconds
+                                in sorted(generator_types.items(), key=lambda item: item[1], reverse=True)},
+            'domains': domains,
+        }
+
+    def write(self, json_path=None, prometheus_path=None):
+        """Write the report as JSON and/or Prometheus text exposition format."""
+        report = self.report()
+        if json_path:
+            _write_atomic(json_path, json.dumps(report, indent=2))
+            logging.info(f"Run report written to {json_path}")
+        if prometheus_path:
+            _write_atomic(prometheus_path, prometheus_text(report))
+            logging.info(f"Prometheus metrics written to {prometheus_path}")
+        return report
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(report):
+    """Render a run report in the Prometheus text exposition format."""
+    lines = []
+
+    def metric(name, help_text, samples, metric_type='gauge'):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{_label(label)}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    domains = report['domains']
+    metric('mockgen_run_duration_seconds', 'Wall-clock duration of the run.', [({}, report['duration_seconds'])])
+    metric('mockgen_peak_rss_bytes', 'Peak resident set size.',
+           [({'process': process}, value) for process, value in report['peak_rss_bytes'].items()])
+    metric('mockgen_records_generated_total', 'Records generated per domain.',
+           [({'domain': name}, domain['records']) for name, domain in domains.items()], 'counter')
+    metric('mockgen_stage_seconds', 'Time spent per domain and stage.',
+           [({'domain': name, 'stage': stage}, seconds) for name, domain in domains.items()
+            for stage, seconds in domain['stages'].items()])
+    metric('mockgen_field_seconds', 'Estimated time spent generating each field.',
+           [({'domain': name, 'field': field['field'], 'type': field['type']}, field['seconds'])
+            for name, domain in domains.items() for field in domain['fields']])
+    metric('mockgen_generator_type_seconds', 'Estimated time spent per generator type.',
+           [({'type': name}, seconds) for name, seconds in report['generator_types'].items()])
+    return '\n'.join(lines) + '\n'
+
+
+def _write_atomic(path, text):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(temp_path, path)
+
+
+def run_metrics(settings):
+    """Create RunMetrics from the `report` settings, or return None when no report is configured."""
+    report = settings.get('report')
+    if not report:
+        return None
+    return RunMetrics(report.get('sample_every', DEFAULT_SAMPLE_EVERY))
+
+
+def write_report(metrics, settings):
+    """Write the configured run report files."""
+    if metrics is not None:
+        report = settings['report']
+        metrics.write(report.get('path', 'run_report.json'), report.get('prometheus'))
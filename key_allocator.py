@@ -0,0 +1,228 @@
+import os
+import random
+import logging
+import threading
+from math import gcd
+from collections import namedtuple
+
+MASK64 = (1 << 64) - 1
+FEISTEL_ROUNDS = 4
+KEY_MODES = ('shuffled', 'sequential', 'strided')
+
+_ConfigField = namedtuple('_ConfigField', 'name type config')  # A field config seen as a compiled field
+
+
+def _mix(value, round_key):
+    """64-bit avalanche mix used as the Feistel round function."""
+    value = (value + round_key) & MASK64
+    value ^= value >> 33
+    value = (value * 0xff51afd7ed558ccd) & MASK64
+    value ^= value >> 33
+    value = (value * 0xc4ceb9fe1a85ec53) & MASK64
+    value ^= value >> 33
+    return value
+
+
+def _coprime_stride(size, rng):
+    """Pick a stride near size / golden ratio that is coprime with size."""
+    if size <= 2:
+        return 1
+    stride = max(1, int(size * 0.6180339887) + rng.randrange(size // 8 + 1))
+    while gcd(stride, size) != 1:
+        stride += 1
+    return stride % size or 1
+
+
+class KeyAllocator:
+    """Hand out unique keys from [start, end] by walking a keyed permutation of the range.
+
+    The key at position i is a pure function of (seed, mode, i), so allocation costs
+    O(1) time and memory per key and any slice of positions can be handed to a worker.
+    """
+
+    def __init__(self, start, end, mode='shuffled', seed=None, position=0):
+        if mode not in KEY_MODES:
+            raise ValueError(f"Unsupported primary key mode '{mode}'. Options: {', '.join(KEY_MODES)}")
+        if end < start:
+            raise ValueError(f"Invalid primary key range {start}..{end}.")
+        self.start = start
+        self.end = end
+        self.size = end - start + 1
+        self.mode = mode
+        self.seed = seed if seed is not None else int.from_bytes(os.urandom(8), 'little')
+        self.position = position
+        self._lock = threading.Lock()
+
+        rng = random.Random(f"{self.seed}:{start}:{end}")
+        half_bits = max(1, ((self.size - 1).bit_length() + 1) // 2)
+        self._half_bits = half_bits
+        self._half_mask = (1 << half_bits) - 1
+        self._round_keys = [rng.getrandbits(64) for _ in range(FEISTEL_ROUNDS)]
+        self._stride = _coprime_stride(self.size, rng)
+        self._offset = rng.randrange(self.size)
+
+    def _feistel(self, value):
+        """Encrypt a 2*half_bits wide value with a balanced Feistel network."""
+        left, right = value >> self._half_bits, value & self._half_mask
+        for round_key in self._round_keys:
+            left, right = right, left ^ (_mix(right, round_key) & self._half_mask)
+        return (left << self._half_bits) | right
+
+    def index_at(self, position):
+        """Map a position in [0, size) to its offset within the key range."""
+        if self.mode == 'sequential':
+            return position
+        if self.mode == 'strided':
+            return (self._offset + position * self._stride) % self.size
+        value = self._feistel(position)
+        while value >= self.size:  # Cycle-walk back into the range
+            value = self._feistel(value)
+        return value
+
+    def key_at(self, position):
+        """Return the key handed out at a given allocation position."""
+        if not 0 <= position < self.size:
+            raise ValueError(f"Primary key range {self.start}..{self.end} exhausted after {self.size} keys.")
+        return self.start + self.index_at(position)
+
+    def remaining(self):
+        """Return how many keys can still be allocated."""
+        return self.size - self.position
+
+    def reserve(self, count):
+        """Claim the next `count` positions and return the first one."""
+        with self._lock:
+            if count > self.size - self.position:
+                raise ValueError(
+                    f"Primary key range {self.start}..{self.end} exhausted after {self.position} keys.")
+            first = self.position
+            self.position += count
+        return first
+
+    def allocate(self):
+        """Allocate the next unique key."""
+        return self.start + self.index_at(self.reserve(1))
+
+    def allocate_many(self, count):
+        """Allocate the next `count` unique keys as a NumPy int64 array."""
+        import numpy as np
+        first = self.reserve(count)
+        positions = np.arange(first, first + count, dtype=np.uint64)
+        return self.start + self.index_array(positions).astype(np.int64)
+
+    def index_array(self, positions):
+        """Vectorized index_at over a uint64 NumPy array of positions."""
+        import numpy as np
+        size = np.uint64(self.size)
+        if self.mode == 'sequential':
+            return positions
+        if self.mode == 'strided':
+            if self.size * self._stride >= 1 << 64:  # position * stride would overflow uint64
+                return np.array([self.index_at(int(p)) for p in positions], dtype=np.uint64)
+            return (np.uint64(self._offset) + positions * np.uint64(self._stride)) % size
+        values = self._feistel_array(positions)
+        outside = np.flatnonzero(values >= size)
+        while len(outside):
+            values[outside] = self._feistel_array(values[outside])
+            outside = outside[values[outside] >= size]
+        return values
+
+    def _feistel_array(self, values):
+        """Vectorized _feistel over a uint64 NumPy array."""
+        import numpy as np
+        half_bits = np.uint64(self._half_bits)
+        half_mask = np.uint64(self._half_mask)
+        left, right = values >> half_bits, values & half_mask
+        with np.errstate(over='ignore'):
+            for round_key in self._round_keys:
+                mixed = right + np.uint64(round_key)
+                mixed ^= mixed >> np.uint64(33)
+                mixed *= np.uint64(0xff51afd7ed558ccd)
+                mixed ^= mixed >> np.uint64(33)
+                mixed *= np.uint64(0xc4ceb9fe1a85ec53)
+                mixed ^= mixed >> np.uint64(33)
+                left, right = right, left ^ (mixed & half_mask)
+        return (left << half_bits) | right
+
+    def state(self):
+        """Return a JSON-serializable description of the allocator and its position."""
+        return {
+            'start': self.start,
+            'end': self.end,
+            'mode': self.mode,
+            'seed': self.seed,
+            'position': self.position,
+        }
+
+
+def allocator_seed(seed, domain_name, field_name):
+    """Derive the permutation seed for one field of a domain from the run seed."""
+    return None if seed is None else f"{seed}:{domain_name}:{field_name}"
+
+
+def _key_range(field, record_count=1):
+    """Return (start, end, mode, strict) for fields that need unique positions, else None.
+
+    Strict ranges must hold record_count values; non-strict ones are walked once and then exhausted.
+    """
+    if field.type == 'primary_key':
+        key_range = field.config['range']
+        return key_range['start'], key_range['end'], field.config.get('mode', 'shuffled'), True
+    pool = field.config.get('pool')
+    if field.type == 'string' and isinstance(pool, dict) and pool.get('unique'):
+        return 0, pool['size'] - 1, 'shuffled', True  # Indices into a unique faker value pool
+    relation = field.config.get('relation') or {}
+    if field.type == 'relationship' and relation.get('distribution') == 'every_parent':
+        return 0, relation['parent_count'] - 1, 'shuffled', False  # Parents not yet referenced
+    if field.type == 'datetime' and field.config.get('distribution') == 'increasing':
+        return 0, max(record_count, 1) - 1, 'sequential', True  # Record positions, spread over the range
+    return None
+
+
+def needs_allocator(field):
+    """True if a compiled field draws unique positions from a KeyAllocator."""
+    return _key_range(field) is not None
+
+
+def _range_error(domain_name, field_name, start, end, record_count):
+    return ValueError(f"Field '{field_name}' of domain '{domain_name}' has {end - start + 1} unique values in "
+                      f"range {start}..{end} but record_count is {record_count}.")
+
+
+def check_key_ranges(domain_config, record_count, pool_defaults=None):
+    """Fail if a field's unique range holds fewer than `record_count` values, from the domain config alone.
+
+    A run checks every domain this way before opening any output or starting any shard, so a
+    range that is too small never leaves a truncated file behind.
+    """
+    from faker_pool import with_pool_config
+    for field in domain_config['fields']:
+        if field.get('type') == 'relationship':
+            continue  # every_parent walks its parents once and then repeats them: never too small
+        field = with_pool_config(field, pool_defaults)
+        key_range = _key_range(_ConfigField(field['name'], field.get('type'), field), record_count)
+        if key_range is not None and key_range[3] and record_count > key_range[1] - key_range[0] + 1:
+            logging.error(f"Key range of field '{field['name']}' in domain '{domain_config['name']}' is too small")
+            raise _range_error(domain_config['name'], field['name'], key_range[0], key_range[1], record_count)
+
+
+def create_key_allocators(plan, record_count, seed=None, position=0):
+    """Create one allocator per field that needs unique positions, failing early if a range is too small.
+
+    `position` starts the allocators part-way through the permutation, which gives each
+    shard of a run its own disjoint slice of the key space.
+    """
+    allocators = {}
+    for field in plan.fields:
+        key_range = _key_range(field, record_count)
+        if key_range is None:
+            continue
+        start, end, mode, strict = key_range
+        allocator = KeyAllocator(start, end, mode, allocator_seed(seed, plan.name, field.name), position)
+        if strict and record_count > allocator.size:
+            raise _range_error(plan.name, field.name, allocator.start, allocator.end, record_count)
+        if not strict and position == 0 and record_count < allocator.size:
+            logging.warning(f"Field '{field.name}' of domain '{plan.name}' can reference only "
+                            f"{record_count} of {allocator.size} parents.")
+        allocators[field.name] = allocator
+    return allocators
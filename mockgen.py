@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+import sys
+
+from pipeline import main
+
+# One entry point for every configuration: `python mockgen.py CONFIG [--resume] [--append]`.
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,378 @@
+import os
+import sys
+import time
+import logging
+import argparse
+from contextlib import ExitStack
+
+from config_cache import load_config
+from schema_compiler import referenced_columns
+from combinations import CombinationSpace
+from sharding import (generate_sharded, resolve_seed, open_executor, plan_shards, domain_record_count,
+                      DEFAULT_SHARD_SIZE)
+from relationships import ColumnCollector, ColumnIndex, key_range_index
+from key_allocator import check_key_ranges
+from scheduler import run_domains, domain_dependencies, domain_references
+from writers import WRITERS, write_output, open_writer, output_files
+from children import output_field_names, child_tables, explode_children, check_output_format
+from faker_pool import pool_defaults, warm_pools
+from value_lists import warm_value_lists
+from instrumentation import run_metrics, write_report
+from checkpoint import Checkpoint, write_shard_parts, merge_domain, remove_checkpoint, output_tables
+from dataset_state import AppendState, remove_state, check_appendable
+
+# Initialize Logger; each generation shard creates its own seeded Faker, and only if the schema uses one
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[logging.StreamHandler()]
+)
+
+
+class SilentProgress:
+    """Stand-in for a progress bar when stderr is not a terminal."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def update(self, count):
+        pass
+
+
+def progress_bar(total, initial, desc):
+    """Return a tqdm bar on a terminal; runs from scripts and fixtures skip importing tqdm altogether."""
+    if not sys.stderr.isatty():
+        return SilentProgress()
+    from tqdm import tqdm
+    return tqdm(total=total, initial=initial, desc=desc, unit="record")
+
+
+def generation_options(settings):
+    """Return the compile options every domain of a run is generated with.
+
+    `integer_ranges` (default false) draws range dependencies as whole numbers instead of
+    2-decimal floats; `date_only` (default true) writes datetimes without a `format` as dates.
+    """
+    return dict(integer_ranges=bool(settings.get('integer_ranges', False)),
+                date_only=bool(settings.get('date_only', True)), faker_pool=pool_defaults(settings))
+
+
+def writer_settings(settings):
+    """Return the writer options shared by every output file."""
+    return dict(indent=settings.get('indent'), compression=settings.get('compression'),
+                compression_level=settings.get('compression_level'),
+                compression_threads=settings.get('compression_threads'), database=settings.get('database'))
+
+
+def load_references(config, config_file):
+    """Load the domains of other configuration files listed in `references`, keyed by domain name.
+
+    Each maps to (domain definition, that file's settings); paths are relative to `config_file`.
+    """
+    names = {domain['name'] for domain in config['domains']}
+    references = {}
+    for reference in config.get('references') or ():
+        path = os.path.join(os.path.dirname(config_file), reference['config'])
+        external = load_config(path)['mock_data_generator']
+        domain = next((domain for domain in external['domains'] if domain['name'] == reference['domain']), None)
+        if domain is None or domain['name'] in names:
+            logging.error(f"Cannot reference domain '{reference['domain']}' of {path}")
+            raise ValueError(f"Domain '{reference['domain']}' is not defined in {path}, or is also defined "
+                             f"in {config_file}.")
+        references[domain['name']] = (domain, external['settings'])
+    return references
+
+
+def reference_indexes(references, referenced, executor=None):
+    """Index the columns relationships reference in domains of other configuration files.
+
+    The values match what those files generate: primary keys come from their key range and
+    the file's seed, and other columns are generated with the file's settings without writing them.
+    """
+    reference_data = {}
+    for name, (domain, settings) in references.items():
+        record_count = domain_record_count(domain, settings)
+        if settings.get('seed') is None:
+            logging.warning(f"Referenced domain '{name}' has no fixed seed; its shuffled keys and generated "
+                            f"columns will not match the file its configuration writes")
+        seed = resolve_seed(settings.get('seed'), name)
+        indexes = {column: key_range_index(domain, column, record_count, seed) for column in referenced.get(name, ())}
+        collectors = {column: ColumnCollector() for column, index in indexes.items() if index is None}
+        if collectors:
+            if domain_references(domain):
+                logging.error(f"Referenced domain '{name}' has relationship fields")
+                raise ValueError(f"Only primary keys can be referenced in domain '{name}', which has "
+                                 f"relationship fields of its own.")
+            logging.info(f"Generating referenced domain '{name}' for the columns {', '.join(collectors)}")
+            for batch in generate_sharded(domain, record_count, seed, settings.get('workers'),
+                                          settings.get('shard_size', DEFAULT_SHARD_SIZE),
+                                          settings.get('engine', 'row').lower(), None, executor,
+                                          **generation_options(settings)):
+                for column, collector in collectors.items():
+                    collector.extend(batch.column(column))
+            indexes.update((column, collector.finish()) for column, collector in collectors.items())
+        reference_data[name] = indexes
+    return reference_data
+
+
+def collect_reference_columns(batches, collectors, indexes, publish, pbar):
+    """Pass batches through while keeping only the columns child domains reference, publishing them once complete."""
+    for batch in batches:
+        for name, collector in collectors.items():
+            collector.extend(batch.column(name))
+        pbar.update(len(batch))
+        yield batch
+    if collectors:  # Children can start while this domain's file is still being finished
+        indexes.update((name, collector.finish()) for name, collector in collectors.items())
+        publish(indexes)
+
+
+def generate_checkpointed(domain, settings, checkpoint, seed, record_count, indexes, collectors, publish, shards):
+    """Write one domain shard by shard into the checkpoint, skipping shards a resumed run already wrote."""
+    domain_name = domain['name']
+    output_format = settings['output_format'].lower()
+    writer_options = writer_settings(settings)
+    shard_size = settings.get('shard_size', DEFAULT_SHARD_SIZE)
+    done = checkpoint.start_domain(domain, seed, record_count, shard_size,
+                                   [domain_name, *(child['name'] for child, _ in child_tables(domain))])
+    entry = checkpoint.domain(domain_name)
+    if collectors and entry['indexes']:  # Saved once every shard was written
+        indexes.update(checkpoint.load_indexes(domain_name))
+        collectors.clear()
+    if entry['merged']:
+        publish(indexes)
+        logging.info(f"Domain '{domain_name}' is already complete in checkpoint {checkpoint.directory}")
+        return entry['records'][domain_name]
+    if not collectors:
+        publish(indexes)
+    # Shards already written are regenerated only when children still need their referenced columns
+    first_shard = 0 if collectors else done
+    if done:
+        logging.info(f"Resuming domain '{domain_name}' at shard {done} of {entry['shards']}")
+    with progress_bar(record_count, min(first_shard * shard_size, record_count),
+                      f"Generating {domain_name} data") as pbar:
+        write_shard_parts(checkpoint, domain, collect_reference_columns(shards(first_shard), collectors, indexes,
+                                                                        publish, pbar),
+                          first_shard, output_format, output_field_names(domain), writer_options, skip_before=done)
+    if collectors:
+        checkpoint.save_indexes(domain_name, {name: indexes[name] for name in collectors})
+    return merge_domain(checkpoint, domain, output_format, output_field_names(domain), writer_options)
+
+
+def generate_domain(domain, settings, referenced, executor, reference_data, publish, metrics=None, checkpoint=None,
+                    append=False):
+    """Generate and write one domain, publishing the indexes of the columns its children reference."""
+    domain_name = domain['name']
+    record_count = domain_record_count(domain, settings)
+    output_format = settings['output_format'].lower()
+    logging.info(f"Generating data for domain: {domain_name}")
+    check_output_format(domain, output_format)
+    # Appending continues the dataset described by the state file next to the output
+    state = AppendState(domain, settings, output_format, output_field_names(domain)) if append else None
+    if state is None:
+        remove_state(domain, output_format, output_field_names(domain), settings.get('compression'))
+    # A resumed or appended run reuses the seed it started with, even one drawn at random
+    seed = settings.get('seed')
+    if seed is None and checkpoint is not None:
+        seed = checkpoint.seed(domain_name)
+    if seed is None and state is not None:
+        seed = state.seed
+    seed = resolve_seed(seed, domain_name)
+    first_record = 0
+    if state is not None:
+        state.start(seed, record_count)
+        first_record = state.records
+        if domain.get('unique_combinations') and 0 < first_record < record_count == CombinationSpace(domain).size:
+            # A sample of the combinations is a permutation walk, while all of them are written in order
+            raise ValueError(f"Domain '{domain_name}' holds {first_record} sampled combinations; growing it to all "
+                             f"{record_count} reorders them, so regenerate it instead of appending.")
+    # Referenced primary keys are recomputed from their key range; other columns are collected
+    indexes = {name: key_range_index(domain, name, record_count, seed) for name in referenced.get(domain_name, ())}
+    saved = state.load_indexes() if state is not None else {}
+    collectors = {name: ColumnCollector(saved.get(name)) for name, index in indexes.items() if index is None}
+    shard_size = settings.get('shard_size', DEFAULT_SHARD_SIZE)
+    first_index = state.next_shard if state is not None else None
+
+    def shards(first_shard=0):
+        return generate_sharded(domain, record_count, seed, settings.get('workers'), shard_size,
+                                settings.get('engine', 'row').lower(),  # Options: row or columnar
+                                reference_data, executor, metrics, first_shard, first_record, first_index,
+                                **generation_options(settings))
+    if checkpoint is not None:
+        total = generate_checkpointed(domain, settings, checkpoint, seed, record_count, indexes, collectors,
+                                      publish, shards)
+        if metrics is not None:
+            metrics.add_written(domain_name, total)
+        return total
+    if not collectors:
+        publish(indexes)  # Key ranges are known up front, so children need not wait at all
+    if state is not None and state.state and first_record == record_count:
+        if collectors:
+            indexes.update((name, collector.finish()) for name, collector in collectors.items())
+            publish(indexes)
+        logging.info(f"Domain '{domain_name}' already has {record_count} records; nothing to append")
+        return 0
+    writer_options = writer_settings(settings)
+    timings = {} if metrics is not None else None  # Serialize and write seconds of every file of the domain
+    tables = state.outputs() if state is not None else output_tables(domain, output_format, output_field_names(domain),
+                                                                      settings.get('compression'))
+    (_, file_name, field_names, options), child_outputs = tables[0], tables[1:]
+    with ExitStack() as stack:
+        # Child collections with `output: table` stream to their own file as parents are generated
+        child_writers = {
+            table: stack.enter_context(open_writer(child_file, output_format, names, timed=metrics is not None,
+                                                   **child_options, **writer_options))
+            for table, child_file, names, child_options in child_outputs
+        }
+        with progress_bar(record_count, first_record, f"Generating {domain_name} data") as pbar:
+            total = write_output(file_name,
+                                 explode_children(collect_reference_columns(shards(), collectors, indexes, publish, pbar),
+                                                  child_writers),
+                                 output_format, field_names, timings, **options, **writer_options)
+    if state is not None:
+        records = {name: writer.record_count for name, writer in child_writers.items()}
+        files = {table: output_file for table, output_file, _, _ in tables}
+        state.save(seed, record_count, (first_index or 0) + len(plan_shards(record_count, shard_size, first_record)),
+                   dict(records, **{domain_name: total}), files, indexes)
+    for name, writer in child_writers.items():
+        logging.info(f"{writer.record_count} {name} records successfully written to {writer.file_name}")
+    if metrics is not None:
+        for writer in child_writers.values():
+            for stage, seconds in writer.timings().items():
+                timings[stage] += seconds
+        for stage, seconds in timings.items():
+            metrics.add_stage(domain_name, stage, seconds)
+        metrics.add_written(domain_name, total)
+    return total
+
+
+def generate_cached(domain, settings, referenced, cache, key, publish, generate, metrics=None):
+    """Restore a domain from the cache when its key is stored, else generate it with `generate(publish)` and store it."""
+    domain_name = domain['name']
+    output_format = settings['output_format'].lower()
+    files = [name for _, file_name, _, _ in output_tables(domain, output_format, output_field_names(domain),
+                                                          settings.get('compression'))
+             for name in output_files(file_name, output_format)]
+    started = time.perf_counter()
+    entry = cache.fetch(key, files)
+    if entry is not None:
+        record_count = domain_record_count(domain, settings)
+        indexes = {name: key_range_index(domain, name, record_count, settings['seed'])
+                   for name in referenced.get(domain_name, ())}
+        indexes.update(entry.indexes())  # Collected columns are stored with the entry
+        publish(indexes)
+        logging.info(f"Domain '{domain_name}' restored from cache ({entry.records} records)")
+        if metrics is not None:
+            metrics.add_stage(domain_name, 'cache', time.perf_counter() - started)
+            metrics.add_written(domain_name, entry.records)
+        return entry.records
+    published = {}
+
+    def publish_and_keep(indexes):
+        published.update(indexes)
+        publish(indexes)
+    cache.release(files)
+    total = generate(publish_and_keep)
+    cache.store(key, domain_name, total, files,
+                {name: index for name, index in published.items() if isinstance(index, ColumnIndex)})
+    return total
+
+
+def run(config_file, resume=False, append=False):
+    """Generate every domain of a configuration file; errors propagate to the caller."""
+    config = load_config(config_file)
+    settings = config['mock_data_generator']['settings']
+    domains = config['mock_data_generator']['domains']
+    referenced = referenced_columns(domains)
+    # Domains written by other configuration files, which relationships here may reference
+    references = load_references(config['mock_data_generator'], config_file)
+    for domain in domains:  # Before any output is opened: a key range that is too small fails here
+        check_key_ranges(domain, domain_record_count(domain, settings), pool_defaults(settings))
+    metrics = run_metrics(settings)  # Only when settings.report is configured
+    # With settings.checkpoint, shards are written as parts and recorded in a manifest as they finish
+    checkpoint_settings = settings.get('checkpoint')
+    if checkpoint_settings is True or (checkpoint_settings is None and resume):
+        checkpoint_settings = {}
+    checkpoint = None
+    # With settings.append, outputs keep a state file and later runs only add the missing records
+    append = bool(settings.get('append') or append)
+    if append and checkpoint_settings is not None:
+        logging.error("Checkpoints and append cannot be combined")
+        raise ValueError("Checkpoints and append cannot be combined; remove `checkpoint` or `append`.")
+    for domain in domains if append else ():  # Also before any output is opened
+        check_appendable(domain, settings['output_format'].lower())
+    if checkpoint_settings is not None:
+        output_format = settings['output_format'].lower()
+        if output_format in WRITERS and not WRITERS[output_format].resumable:
+            logging.error(f"Checkpoints are not supported for {output_format} output")
+            raise ValueError(f"Checkpoints are not supported for {output_format} output; remove `checkpoint`.")
+        directory = checkpoint_settings.get('directory', f"{config_file.rsplit('.', 1)[0]}_checkpoint")
+        # Referenced domains are part of what the run generates, so their definitions are hashed too
+        checkpoint = Checkpoint(directory, dict(config['mock_data_generator'], references=references)
+                                if references else config['mock_data_generator'], resume)
+    # With settings.cache, domains whose definition, seed and parents are unchanged are restored, not generated
+    cache, keys = None, {}
+    if settings.get('cache') and not append:
+        from domain_cache import open_cache, domain_keys
+        cache = open_cache(settings, references)
+        keys = domain_keys(domains, settings, domain_dependencies(domains, references), references) \
+            if cache is not None else {}
+
+    def run_domain(domain, reference_data, publish):
+        reference_data = dict(reference_data, **{name: external_data[name] for name in domain_references(domain)
+                                                 if name in external_data})
+
+        def generate(publish):
+            return generate_domain(domain, settings, referenced, executor, reference_data, publish, metrics,
+                                   checkpoint, append)
+        if cache is None:
+            return generate(publish)
+        return generate_cached(domain, settings, referenced, cache, keys[domain['name']], publish, generate,
+                               metrics)
+    for domain in domains:
+        warm_pools(domain, pool_defaults(settings))
+        warm_value_lists(domain)
+    for domain, reference_settings in references.values():
+        warm_pools(domain, pool_defaults(reference_settings))
+        warm_value_lists(domain)
+    # One process pool (workers defaults to one per CPU) serves every domain; independent
+    # domains run concurrently and children start as soon as their parents are indexed.
+    # A run of a few shards stays in-process: starting the pool would cost more than it saves
+    shard_size = settings.get('shard_size', DEFAULT_SHARD_SIZE)
+    shards = sum(len(plan_shards(domain_record_count(domain, settings), shard_size)) for domain in domains)
+    executor = open_executor(min(settings.get('workers') or os.cpu_count() or 1, max(shards, 1)))
+    try:
+        external_data = reference_indexes(references, referenced, executor)
+        run_domains(domains, run_domain, references)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    if checkpoint is not None:
+        remove_checkpoint(checkpoint)  # Every domain is merged into its output files
+    write_report(metrics, settings)
+
+
+def main(config_file=None, argv=None):
+    """Command-line entry point, taking the config path as an argument unless `config_file` is given.
+
+    Returns the process exit status.
+    """
+    if config_file is None:
+        parser = argparse.ArgumentParser(prog='mockgen', description="Generate the domains of a YAML configuration.")
+        parser.add_argument('config', help="configuration file, e.g. customer.yaml")
+    else:
+        parser = argparse.ArgumentParser(description=f"Generate the domains of {config_file}.")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue the checkpointed run in settings.checkpoint, regenerating only missing shards")
+    parser.add_argument('--append', action='store_true',
+                        help="grow the existing output to record_count records instead of regenerating it")
+    args = parser.parse_args(argv)
+    try:
+        run(config_file or args.config, args.resume, args.append)
+    except Exception as e:
+        logging.critical(f"Program terminated due to an error: {e}")
+        return 1
+    return 0
@@ -0,0 +1,237 @@
+import sys
+from array import array
+
+from value_lists import list_values
+from temporal import compile_format
+
+
+def field_categories(field):
+    """Return every value a categorical field can take, in a fixed order, or None if it is not categorical.
+
+    Predefined lists and dependencies whose options are all inline lists draw from a fixed set of
+    values; external value lists are too large to encode and stay plain columns.
+    """
+    if field.get('type') == 'predefined_list' and 'values' in field:
+        return list(field['values'])
+    if field.get('type') == 'dependency':
+        options = [list_values(option) for option in field['dependency']['values'].values()]
+        if all(option is not None for option in options):
+            return [value for option in options for value in option]
+    return None
+
+
+def plan_categories(plan):
+    """Map each categorical field of a compiled plan to its values, for dictionary-encoding its column."""
+    categories = {}
+    for field in plan.fields:
+        values = field_categories(field.config)
+        if values is not None:
+            categories[field.name] = values
+    return categories
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class Categorical:
+    """A dictionary-encoded column: one small integer code per record into a tuple of `categories`.
+
+    String categories are interned, so every shard's values share one object per distinct
+    string once decoded, in the worker and again after unpickling in the parent.
+    """
+
+    __slots__ = ('codes', 'categories')
+
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = tuple(map(_intern, categories))
+
+    @classmethod
+    def encode(cls, values, categories):
+        """Encode a list or array of values, or return None if one of them is not a category."""
+        lookup = {}
+        for code, value in enumerate(categories):
+            try:
+                lookup.setdefault(value, code)
+            except TypeError:  # Unhashable values cannot be encoded
+                return None
+        if hasattr(values, 'tolist'):
+            values = values.tolist()
+        try:
+            codes = list(map(lookup.__getitem__, values))
+        except (KeyError, TypeError):
+            return None
+        typecode = 'B' if len(categories) <= 1 << 8 else 'H' if len(categories) <= 1 << 16 else 'I'
+        return cls(array(typecode, codes), categories)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return Categorical(self.codes[index], self.categories)
+
+    def __reduce__(self):
+        return Categorical, (self.codes, self.categories)
+
+    def code_array(self):
+        """The codes as a NumPy array, without copying."""
+        import numpy as np
+        return np.frombuffer(self.codes, dtype=np.dtype(self.codes.typecode))
+
+    def tolist(self):
+        return list(map(self.categories.__getitem__, self.codes))
+
+
+class Timestamps:
+    """A datetime column held as microseconds since the epoch, formatted only when read as values.
+
+    `micros` is a list (row engine) or int64 array (columnar engine), already truncated to the
+    resolution of `pattern`. Text formats read the formatted strings through `tolist`; Arrow and
+    PostgreSQL binary writers take `micros` as they are, without formatting and parsing them back.
+    """
+
+    __slots__ = ('micros', 'pattern')
+
+    def __init__(self, micros, pattern):
+        self.micros = micros
+        self.pattern = pattern
+
+    def __len__(self):
+        return len(self.micros)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Timestamps(self.micros[index], self.pattern)
+        return compile_format(self.pattern).format_value(int(self.micros[index]))
+
+    def __reduce__(self):
+        return Timestamps, (self.micros, self.pattern)
+
+    def tolist(self):
+        datetime_format = compile_format(self.pattern)
+        if isinstance(self.micros, list):
+            return [datetime_format.format_value(value) for value in self.micros]
+        return datetime_format.format_array(self.micros).tolist()
+
+
+class ChildRows:
+    """A child collection of a batch: all child rows as one RecordBatch, with the rows of parent i
+    at offsets[i]:offsets[i + 1]."""
+
+    __slots__ = ('batch', 'offsets')
+
+    def __init__(self, batch, offsets):
+        self.batch = batch
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        start, stop, _ = index.indices(len(self))
+        offsets = self.offsets[start:max(start, stop) + 1]
+        return ChildRows(self.batch[int(offsets[0]):int(offsets[-1])], offsets - offsets[0])
+
+    def __reduce__(self):
+        return ChildRows, (self.batch, self.offsets)
+
+    def tolist(self):
+        """One list of row dicts per parent, as nested output holds them."""
+        rows = list(self.batch.records())
+        offsets = self.offsets.tolist()
+        return [rows[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+class RecordBatch:
+    """A batch of records held column by column, the form shards are generated, shipped and written in.
+
+    `columns` maps each field name, in generation order, to its values: a list, a NumPy array
+    (columnar engine), a `Categorical` for fields drawn from a fixed value list, `Timestamps` for
+    datetime fields, or `ChildRows` for a child collection. Writers read whole columns (`column`)
+    or tuples of them (`rows`); row dicts are only built by `records` for formats that need
+    them, such as JSON.
+    """
+
+    __slots__ = ('columns', 'count')
+
+    def __init__(self, columns, count):
+        self.columns = columns
+        self.count = count
+
+    @classmethod
+    def from_columns(cls, columns, field_names, count, categories=None, formats=None):
+        """Take `field_names` from a mapping of columns, dictionary-encoding those listed in `categories`.
+
+        Datetime columns listed in `formats` hold microseconds and become `Timestamps` in that format.
+        """
+        batch = {}
+        for name in field_names:
+            values = columns[name]
+            if categories and name in categories:
+                values = Categorical.encode(values, categories[name]) or values
+            elif formats and name in formats:
+                values = Timestamps(values, formats[name].pattern)
+            batch[name] = values
+        return cls(batch, count)
+
+    @classmethod
+    def from_records(cls, records, field_names=None):
+        """Build a batch from row dicts, with the keys of the first record unless `field_names` are given."""
+        records = records if isinstance(records, list) else list(records)
+        field_names = list(field_names or (records[0] if records else ()))
+        return cls({name: [record[name] for record in records] for name in field_names}, len(records))
+
+    @property
+    def field_names(self):
+        return tuple(self.columns)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        """Slice the batch, e.g. `batch[:end]`; the columns share their storage where they can."""
+        if not isinstance(index, slice) or index.step not in (None, 1):
+            raise TypeError("RecordBatch only supports contiguous slices")
+        start, stop, _ = index.indices(self.count)
+        return RecordBatch({name: values[index] for name, values in self.columns.items()}, max(0, stop - start))
+
+    def __iter__(self):
+        return self.records()
+
+    def column(self, name):
+        """Return one column as a list of native Python values."""
+        values = self.columns[name]
+        return values if isinstance(values, list) else values.tolist()
+
+    def array(self, name):
+        """Return one column as a list or NumPy array, decoding only categorical, datetime and child columns."""
+        values = self.columns[name]
+        return values.tolist() if isinstance(values, (Categorical, Timestamps, ChildRows)) else values
+
+    def categorical(self, name):
+        """Return a column's `Categorical`, or None if it is not dictionary-encoded."""
+        values = self.columns[name]
+        return values if isinstance(values, Categorical) else None
+
+    def timestamps(self, name):
+        """Return a datetime column's `Timestamps`, or None if it holds plain values."""
+        values = self.columns[name]
+        return values if isinstance(values, Timestamps) else None
+
+    def set_column(self, name, values):
+        """Add or replace a column."""
+        self.columns[name] = values
+
+    def pop(self, name):
+        """Remove a column and return its storage, e.g. the `ChildRows` of a child table."""
+        return self.columns.pop(name)
+
+    def rows(self, field_names=None):
+        """Iterate over tuples of values in `field_names` order (default: every column)."""
+        return zip(*(self.column(name) for name in (field_names or self.columns)))
+
+    def records(self):
+        """Materialize one dict per record, keys in column order."""
+        names = tuple(self.columns)
+        return (dict(zip(names, row)) for row in self.rows(names))
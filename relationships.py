@@ -0,0 +1,188 @@
+import math
+from array import array
+
+from key_allocator import KeyAllocator, allocator_seed
+
+RELATION_DISTRIBUTIONS = ('uniform', 'zipf', 'every_parent')
+
+
+class KeyRangeIndex:
+    """Reference a parent's primary key through its key-range permutation; no parent values are stored."""
+
+    def __init__(self, start, end, mode, seed, count):
+        self.start, self.end, self.mode, self.seed = start, end, mode, seed
+        self.size = count
+        self._allocator = None
+
+    @property
+    def allocator(self):
+        if self._allocator is None:
+            self._allocator = KeyAllocator(self.start, self.end, self.mode, self.seed)
+        return self._allocator
+
+    def value_at(self, index):
+        return self.start + self.allocator.index_at(index)
+
+    def values_at(self, indices):
+        import numpy as np
+        return self.start + self.allocator.index_array(indices.astype(np.uint64)).astype(np.int64)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_allocator'] = None  # Rebuilt on first use in the worker process
+        return state
+
+
+class ColumnIndex:
+    """A parent column kept as a compact typed array: int64, float64 or dictionary-encoded values."""
+
+    def __init__(self, kind, values, categories=None):
+        self.kind = kind
+        self.values = values
+        self.categories = categories
+        self.size = len(values)
+
+    def value_at(self, index):
+        value = self.values[index]
+        return self.categories[value] if self.kind == 'dictionary' else value
+
+    def values_at(self, indices):
+        import numpy as np
+        if self.kind == 'int':
+            return np.frombuffer(self.values, dtype=np.int64)[indices]
+        if self.kind == 'float':
+            return np.frombuffer(self.values, dtype=np.float64)[indices]
+        categories = np.empty(len(self.categories), dtype=object)
+        categories[:] = self.categories
+        return categories[np.frombuffer(self.values, dtype=np.uint32)[indices]]
+
+
+class ColumnCollector:
+    """Accumulate a referenced parent column as it streams past, choosing a compact storage type.
+
+    Given the ColumnIndex of an earlier run, collection continues after its values.
+    """
+
+    def __init__(self, index=None):
+        self.kind = None
+        self.values = None
+        self.codes = {}
+        if index is not None and index.size:
+            self.kind = index.kind
+            self.values = array(index.values.typecode, index.values)
+            self.codes = {value: code for code, value in enumerate(index.categories or ())}
+
+    def extend(self, values):
+        for value in values:
+            if self.kind is None:
+                self.kind = 'int' if isinstance(value, int) and not isinstance(value, bool) \
+                    else 'float' if isinstance(value, float) else 'dictionary'
+                self.values = array('q' if self.kind == 'int' else 'd' if self.kind == 'float' else 'I')
+            if self.kind != 'dictionary':
+                try:
+                    self.values.append(value)
+                    continue
+                except TypeError:
+                    self._to_dictionary()  # Mixed value types: fall back to dictionary encoding
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.codes)
+            self.values.append(code)
+
+    def _to_dictionary(self):
+        """Re-encode the values collected so far as dictionary codes."""
+        values, self.values, self.kind = self.values, array('I'), 'dictionary'
+        self.extend(values.tolist())
+
+    def finish(self):
+        if self.kind is None:
+            return ColumnIndex('int', array('q'))
+        categories = list(self.codes) if self.kind == 'dictionary' else None
+        return ColumnIndex(self.kind, self.values, categories)
+
+
+def key_range_index(domain_config, field_name, record_count, seed):
+    """Describe a domain's primary key column without generating it, or None if it is not a primary key."""
+    for field in domain_config['fields']:
+        if field['name'] == field_name and field.get('type') == 'primary_key':
+            key_range = field['range']
+            return KeyRangeIndex(key_range['start'], key_range['end'], field.get('mode', 'shuffled'),
+                                 allocator_seed(seed, domain_config['name'], field_name), record_count)
+    return None
+
+
+def lookup_index(reference_data, relation, field_name):
+    """Find the parent index a relationship field samples from."""
+    index = (reference_data or {}).get(relation['domain'], {}).get(relation['field'])
+    if index is None or not index.size:
+        raise ValueError(f"No reference data for domain '{relation['domain']}' required by field {field_name}.")
+    distribution = relation.get('distribution', 'uniform')
+    if distribution not in RELATION_DISTRIBUTIONS:
+        raise ValueError(f"Unsupported relationship distribution '{distribution}' for field {field_name}. "
+                         f"Options: {', '.join(RELATION_DISTRIBUTIONS)}")
+    return index
+
+
+def _zipf_rank(u, size, skew):
+    """Inverse CDF of a bounded continuous power law over ranks 1..size, returned as a 0-based index."""
+    if abs(skew - 1.0) < 1e-9:
+        rank = size ** u
+    else:
+        rank = ((size ** (1 - skew) - 1) * u + 1) ** (1 / (1 - skew))
+    return min(int(rank) - 1, size - 1)
+
+
+def row_sampler(index, relation, rng, field_name):
+    """Return `sample(keys)` drawing one parent value for row-at-a-time generation."""
+    size = index.size
+    distribution = relation.get('distribution', 'uniform')
+    if distribution == 'zipf':
+        skew = float(relation.get('skew', 1.0))
+        return lambda keys: index.value_at(_zipf_rank(rng.random(), size, skew))
+    if distribution == 'every_parent':
+        def sample_covering(keys):
+            cover = keys[field_name]
+            if cover.remaining() > 0:  # First pass walks every parent once in shuffled order
+                return index.value_at(cover.allocate())
+            return index.value_at(rng.randrange(size))
+        return sample_covering
+    return lambda keys: index.value_at(rng.randrange(size))
+
+
+def column_sampler(index, relation, rng, field_name):
+    """Return `sample(count, keys)` drawing parent values for a whole batch."""
+    import numpy as np
+    size = index.size
+    distribution = relation.get('distribution', 'uniform')
+    if distribution == 'zipf':
+        skew = float(relation.get('skew', 1.0))
+        log_size = math.log(size)
+
+        def sample_zipf(count, keys):
+            u = rng.random(count)
+            if abs(skew - 1.0) < 1e-9:
+                ranks = np.exp(u * log_size)
+            else:
+                ranks = ((size ** (1 - skew) - 1) * u + 1) ** (1 / (1 - skew))
+            return index.values_at(np.minimum(ranks.astype(np.int64) - 1, size - 1))
+        return sample_zipf
+    if distribution == 'every_parent':
+        def sample_covering(count, keys):
+            cover = keys[field_name]
+            covered = max(0, min(count, cover.remaining()))
+            indices = rng.integers(0, size, count)
+            if covered:
+                indices[:covered] = cover.allocate_many(covered)
+            return index.values_at(indices)
+        return sample_covering
+    return lambda count, keys: index.values_at(rng.integers(0, size, count))
+
+
+def with_relation_size(field, reference_data):
+    """Record the parent size on an every_parent relationship so its coverage allocator can be built."""
+    relation = field.get('relation', {})
+    if field.get('type') != 'relationship' or relation.get('distribution') != 'every_parent':
+        return field
+    index = lookup_index(reference_data, relation, field['name'])
+    return dict(field, relation=dict(relation, parent_count=index.size))
+
@@ -0,0 +1,126 @@
+import time
+import queue
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from schema_compiler import domain_fields
+
+
+def domain_references(domain):
+    """Return the names of the domains a domain's relationship fields reference."""
+    return {field['relation']['domain'] for field in domain_fields(domain) if field.get('type') == 'relationship'}
+
+
+def domain_dependencies(domains, external=()):
+    """Map each domain name to the set of domains its relationship fields reference.
+
+    Domains named in `external` are defined by other configuration files (see `references`);
+    they may be referenced but are never scheduled, so they are left out of the sets.
+    """
+    names = {domain['name'] for domain in domains}
+    dependencies = {}
+    for domain in domains:
+        parents = set()
+        for field in domain_fields(domain):
+            if field.get('type') != 'relationship':
+                continue
+            parent = field['relation']['domain']
+            if parent in external and parent not in names:
+                continue
+            if parent not in names or parent == domain['name']:
+                raise ValueError(f"Field '{field['name']}' of domain '{domain['name']}' references "
+                                 f"unknown domain '{parent}'.")
+            parents.add(parent)
+        dependencies[domain['name']] = parents
+    topological_order(dependencies)
+    return dependencies
+
+
+def topological_order(dependencies):
+    """Order domain names so every parent precedes its children, keeping config order otherwise."""
+    ordered, placed = [], set()
+    remaining = list(dependencies)
+    while remaining:
+        ready = [name for name in remaining if dependencies[name] <= placed]
+        if not ready:
+            raise ValueError(f"Circular relationship between domains: {', '.join(remaining)}")
+        ordered.extend(ready)
+        placed.update(ready)
+        remaining = [name for name in remaining if name not in placed]
+    return ordered
+
+
+def critical_path(dependencies, timings):
+    """Return (path, seconds) for the chain of domains that bounds the run's wall-clock time.
+
+    A child can start once every parent has published its key index, so each hop costs the
+    parent's time-to-index and the last domain costs its full generation time.
+    """
+    ready_at, finish_at, gate = {}, {}, {}
+    for name in topological_order(dependencies):
+        start = max((ready_at[parent] for parent in dependencies[name]), default=0.0)
+        gate[name] = max(dependencies[name], key=ready_at.get, default=None)
+        timing = timings[name]
+        ready_at[name] = start + timing['ready'] - timing['start']
+        finish_at[name] = start + timing['end'] - timing['start']
+    name = max(finish_at, key=finish_at.get)
+    seconds, path = finish_at[name], []
+    while name is not None:
+        path.append(name)
+        name = gate[name]
+    return path[::-1], seconds
+
+
+def run_domains(domains, run_domain, external=()):
+    """Run domain pipelines concurrently, starting each one as soon as all of its parents are indexed.
+
+    `run_domain(domain, reference_data, publish)` generates and writes one domain and calls
+    `publish(indexes)` once the columns its children reference are ready, which may be well
+    before its own output is finished. Domains named in `external` are indexed before the run
+    and passed in by `run_domain` itself. Returns the per-domain timings.
+    """
+    dependencies = domain_dependencies(domains, external)
+    configs = {domain['name']: domain for domain in domains}
+    events = queue.Queue()
+    reference_data, timings, failures = {}, {}, []
+    waiting = topological_order(dependencies)
+    running = 0
+    run_start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=len(domains) or 1, thread_name_prefix='domain') as executor:
+        def launch(name):
+            timings[name] = {'start': time.perf_counter()}
+            parents = {parent: reference_data[parent] for parent in dependencies[name]}
+
+            def publish(indexes):
+                events.put(('ready', name, indexes))
+            future = executor.submit(run_domain, configs[name], parents, publish)
+            future.add_done_callback(lambda future: events.put(('done', name, future)))
+
+        while waiting or running:
+            if not failures:
+                for name in [name for name in waiting if dependencies[name] <= reference_data.keys()]:
+                    waiting.remove(name)
+                    launch(name)
+                    running += 1
+            if not running:
+                break
+            event, name, payload = events.get()
+            if event == 'ready':
+                timings[name]['ready'] = time.perf_counter()
+                reference_data[name] = payload
+                continue
+            running -= 1
+            timings[name]['end'] = time.perf_counter()
+            timings[name].setdefault('ready', timings[name]['end'])
+            reference_data.setdefault(name, {})
+            if payload.exception() is not None:
+                logging.error(f"Domain '{name}' failed: {payload.exception()}")
+                failures.append(payload.exception())
+
+    if failures:
+        raise failures[0]
+    path, seconds = critical_path(dependencies, timings)
+    logging.info(f"Critical path: {' -> '.join(path)} ({seconds:.1f}s of "
+                 f"{time.perf_counter() - run_start:.1f}s wall clock)")
+    return timings
@@ -0,0 +1,241 @@
+import random
+import logging
+from collections import namedtuple
+
+from faker_pool import with_pool_config, pool_for_field
+from expressions import compile_formula, formula_names, bind_row
+from relationships import lookup_index, row_sampler, with_relation_size
+from temporal import DAY, field_format, offset_base_format, row_datetime_sampler, with_base_format, datetime_formats
+from value_lists import AliasTable, row_source_sampler
+
+# A compiled field: `generate(record, keys)` returns the next value for the field,
+# drawing primary keys from `keys`, a mapping of field name to KeyAllocator.
+CompiledField = namedtuple('CompiledField', ['name', 'type', 'generate', 'config'])
+# A compiled domain: fields are topologically ordered and ready to run per record. Datetime
+# fields generate microseconds since the epoch, written in their `formats`.
+GenerationPlan = namedtuple('GenerationPlan', ['name', 'fields', 'field_names', 'formats'])
+
+
+def field_dependencies(field, field_names):
+    """Return the other fields a field must be generated after."""
+    if field['type'] == 'dependency':
+        return {field['dependency']['field']}
+    if field['type'] == 'datetime' and 'offset' in field:
+        return {field['offset']['field']}
+    if field['type'] == 'computed':
+        try:
+            return (formula_names(field['formula']) & field_names) - {field['name']}
+        except SyntaxError:
+            return set()  # Reported with a clear message when the formula is compiled
+    return set()
+
+
+def sort_fields_by_dependency(fields, available=()):
+    """Sort fields to ensure dependencies (including formula inputs) are resolved before generation.
+
+    `available` names values that exist before any field runs, such as a child collection's parent fields.
+    """
+    pending = list(fields)  # Work on a copy so the domain config is left intact
+    field_names = {field['name'] for field in pending}
+    dependencies = {field['name']: field_dependencies(field, field_names) for field in pending}
+    sorted_fields = []
+    resolved_fields = set(available)
+
+    while pending:
+        unresolved = len(pending)
+        for field in pending[:]:
+            if dependencies[field['name']] <= resolved_fields:
+                sorted_fields.append(field)
+                resolved_fields.add(field['name'])
+                pending.remove(field)
+        if unresolved == len(pending):  # No progress, circular dependency detected
+            logging.error("Circular dependency detected in fields.")
+            raise ValueError("Circular dependency detected in fields.")
+    return sorted_fields
+
+
+def schema_field_names(domain_config):
+    """Return a domain's field names in generation (and output) order."""
+    return tuple(field['name'] for field in sort_fields_by_dependency(domain_config['fields']))
+
+
+def domain_fields(domain_config):
+    """Yield a domain's fields followed by the fields of its child collections."""
+    yield from domain_config['fields']
+    for child in domain_config.get('children') or ():
+        yield from child['fields']
+
+
+def referenced_columns(domains):
+    """Map each domain name to the set of its fields that relationship fields sample from."""
+    referenced = {}
+    for domain in domains:
+        for field in domain_fields(domain):
+            if field.get('type') == 'relationship':
+                relation = field['relation']
+                referenced.setdefault(relation['domain'], set()).add(relation['field'])
+    return referenced
+
+
+def build_weighted_sampler(values, probabilities=None, rng=random):
+    """Precompute an alias table for the weights and return a zero-argument sampler drawing in O(1)."""
+    values = list(values)
+    if not values:
+        raise ValueError("Cannot sample from an empty list of values.")
+    if probabilities is None:
+        return lambda: rng.choice(values)
+    if len(probabilities) != len(values):
+        raise ValueError("Number of probabilities does not match number of values.")
+    draw = AliasTable.build(probabilities).draw
+    return lambda: values[draw(rng)]
+
+
+def dependency_option(option, field_name):
+    """Parse one parent value's dependency option into (kind, spec), shared by both engines.
+
+    Kinds: 'fixed' (spec is the value), 'list' (spec is (values, probabilities or None)),
+    'source' (spec is an external value list source) and 'range' (spec is (min, max)).
+    """
+    if isinstance(option, bool):
+        raise ValueError(f"Invalid dependency format for field {field_name}.")
+    if isinstance(option, (int, float)):  # Fixed value dependency
+        return 'fixed', option
+    if isinstance(option, list):  # List-based dependency
+        if not option:
+            raise ValueError(f"Empty dependency list for field {field_name}.")
+        return 'list', (option, None)
+    if isinstance(option, dict) and 'values' in option:  # Weighted list-based dependency
+        return 'list', (option['values'], option.get('probabilities'))
+    if isinstance(option, dict) and 'source' in option:  # External value list
+        return 'source', option['source']
+    if isinstance(option, dict) and 'min' in option and 'max' in option:  # Range-based dependency
+        return 'range', (option['min'], option['max'])
+    raise ValueError(f"Invalid dependency format for field {field_name}.")
+
+
+def _compile_dependency_option(option, field_name, rng, integer_ranges):
+    """Compile one parent value's dependency option into a zero-argument sampler."""
+    kind, spec = dependency_option(option, field_name)
+    if kind == 'fixed':
+        return lambda: spec
+    if kind == 'list':
+        return build_weighted_sampler(*spec, rng)
+    if kind == 'source':
+        return row_source_sampler(spec, rng)
+    low, high = spec
+    if integer_ranges:
+        return lambda: rng.randint(low, high)
+    return lambda: round(rng.uniform(low, high), 2)
+
+
+def _compile_generator(field, fake, rng, reference_data, integer_ranges, date_only, known_fields):
+    """Build the generator callable for a single field definition."""
+    field_type = field.get('type')
+    field_name = field.get('name')
+
+    if field_type == 'primary_key':
+        return lambda record, keys: keys[field_name].allocate()
+
+    if field_type == 'predefined_list' and 'values' in field:
+        sample = build_weighted_sampler(field['values'], field.get('probabilities'), rng)
+        return lambda record, keys: sample()
+
+    if field_type == 'predefined_list' and 'source' in field:
+        sample = row_source_sampler(field['source'], rng)
+        return lambda record, keys: sample()
+
+    if field_type == 'dependency':
+        parent = field['dependency']['field']
+        lookup = {
+            value: _compile_dependency_option(option, field_name, rng, integer_ranges)
+            for value, option in field['dependency']['values'].items()
+        }
+
+        def generate_dependency(record, keys):
+            if parent not in record:
+                raise ValueError(f"Dependency field '{parent}' not found in the record.")
+            return lookup[record[parent]]()
+        return generate_dependency
+
+    if field_type == 'computed':
+        evaluate = bind_row(compile_formula(field['formula'], field_name, known_fields), rng)
+        return lambda record, keys: evaluate(record)
+
+    if field_type == 'datetime' and 'offset' in field:  # A whole number of days after another datetime field
+        base, low, high = field['offset']['field'], field['offset']['min_days'], field['offset']['max_days']
+        base_format, resolution = offset_base_format(field, date_only), field_format(field, date_only).resolution
+
+        def generate_offset(record, keys):
+            value = base_format.parse_value(record[base]) + rng.randint(low, high) * DAY
+            return value - value % resolution
+        return generate_offset
+
+    if field_type == 'datetime' and 'range' in field:
+        sample = row_datetime_sampler(field, rng, field_format(field, date_only).resolution)
+        return lambda record, keys: sample(keys)
+
+    if field_type == 'string' and 'faker' in field:
+        if field.get('pool'):
+            values = pool_for_field(field, field['pool'])
+            if field['pool']['unique']:  # Walk a permutation of the pool so values never repeat
+                return lambda record, keys: values[keys[field_name].allocate()]
+            return lambda record, keys: rng.choice(values)
+        provider = getattr(fake, field['faker'])
+        return lambda record, keys: provider()
+
+    if field_type == 'float' and 'range' in field:
+        low, high = field['range']['min'], field['range']['max']
+        return lambda record, keys: rng.uniform(low, high)
+
+    if field_type == 'integer' and 'range' in field:
+        low, high = field['range']['min'], field['range']['max']
+        return lambda record, keys: rng.randint(low, high)
+
+    if field_type == 'relationship':
+        index = lookup_index(reference_data, field['relation'], field_name)
+        sample = row_sampler(index, field['relation'], rng, field_name)
+        return lambda record, keys: sample(keys)
+
+    logging.warning(f"Unsupported or missing type for field: {field_name}")
+    return lambda record, keys: None
+
+
+def compile_domain(domain_config, fake=None, rng=random, reference_data=None,
+                   integer_ranges=False, date_only=False, faker_pool=None, pool_seed=None):
+    """Compile a domain configuration into an immutable generation plan.
+
+    `reference_data` maps a parent domain name to its referenced columns, each an index from `relationships`.
+    `faker_pool` holds run-wide defaults for pre-generated faker value pools, and `pool_seed`
+    seeds the pools neither sets a seed for.
+    """
+    known_fields = {field['name'] for field in domain_config['fields']}
+    fields = tuple(
+        CompiledField(
+            name=field['name'],
+            type=field.get('type'),
+            generate=_compile_generator(field, fake, rng, reference_data, integer_ranges, date_only, known_fields),
+            config=field,
+        )
+        for field in (with_base_format(with_relation_size(with_pool_config(field, faker_pool, pool_seed),
+                                                          reference_data),
+                                       domain_config['fields'], date_only)
+                      for field in sort_fields_by_dependency(domain_config['fields']))
+    )
+    logging.debug(f"Compiled {len(fields)} fields for domain '{domain_config['name']}'")
+    return GenerationPlan(
+        name=domain_config['name'],
+        fields=fields,
+        field_names=tuple(field.name for field in fields),
+        formats=datetime_formats(domain_config['fields'], date_only),
+    )
+
+
+def record_formats(plan):
+    """Map the datetime fields that other fields read to their format.
+
+    The row engine keeps a datetime's microseconds in its column, and formats it into the
+    record only when a formula, dependency or offset reads it.
+    """
+    names = set(plan.field_names)
+    read = set().union(*(field_dependencies(field.config, names) for field in plan.fields))
+    return {name: datetime_format for name, datetime_format in plan.formats.items() if name in read}
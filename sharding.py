@@ -0,0 +1,302 @@
+import os
+import time
+import pickle
+import random
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import deque, namedtuple, OrderedDict
+
+from schema_compiler import compile_domain, domain_fields, record_formats
+from key_allocator import create_key_allocators
+from faker_pool import warm_pools
+from value_lists import warm_value_lists
+from combinations import combination_sequence, CombinationSpace, generate_combination_columns
+from instrumentation import new_shard_stats, add_field_time, count_values, generator_type
+from record_batch import RecordBatch, plan_categories
+
+DEFAULT_SHARD_SIZE = 10000
+INLINE_REFERENCE_BYTES = 64 << 10  # Smaller reference data is cheaper to send with every shard than to share
+WORKER_REFERENCE_CACHE = 8  # Shared reference data each worker keeps loaded, most recently used first
+
+# Per-process state, set up once by the pool initializer; Faker is per thread since
+# independent domains may generate concurrently in one process
+_worker_fakes = threading.local()
+_worker_reference_data = None
+_worker_references = OrderedDict()  # SharedReferences key -> reference data loaded by this process
+_worker_references_lock = threading.Lock()
+
+# Reference data pickled once to `path`, which worker processes load once per `key` and keep
+SharedReferences = namedtuple('SharedReferences', ['key', 'path'])
+
+
+def shard_seed(seed, domain_name, shard_index):
+    """Derive a stable 64-bit seed for one shard of a domain."""
+    digest = hashlib.sha256(f"{seed}:{domain_name}:{shard_index}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+
+def resolve_seed(seed, domain_name):
+    """Return the run seed, drawing and logging a random one when none is configured."""
+    if seed is None:
+        seed = random.randrange(2 ** 63)
+        logging.info(f"No seed configured for domain '{domain_name}'; using {seed}")
+    return seed
+
+
+def domain_record_count(domain, settings):
+    """Return a domain's record_count (or the default), capped at its number of unique combinations."""
+    record_count = domain.get('record_count', settings['record_count'])  # Domains may override the default
+    if domain.get('unique_combinations'):
+        size = CombinationSpace(domain).size
+        if record_count > size:
+            logging.info(f"Domain '{domain['name']}' has {size} unique combinations; generating {size} records")
+            record_count = size
+    return record_count
+
+
+def plan_shards(record_count, shard_size=DEFAULT_SHARD_SIZE, first_record=0, first_index=None):
+    """Split records first_record..record_count-1 into (shard_index, start, count) tuples of a fixed size.
+
+    An appended run starts at `first_record` and numbers its shards from `first_index`, so no
+    seed of an earlier run is reused; by default shards are numbered as in one run of record_count.
+    """
+    if shard_size < 1:
+        raise ValueError(f"Invalid shard_size: {shard_size}")
+    if first_index is None:
+        first_index = -(-first_record // shard_size)
+    return [
+        (index, start, min(shard_size, record_count - start))
+        for index, start in enumerate(range(first_record, record_count, shard_size), start=first_index)
+    ]
+
+
+def _init_worker(reference_data):
+    """Pool initializer: keep reference data in the worker instead of pickling it per shard."""
+    global _worker_reference_data
+    _worker_reference_data = reference_data
+
+
+def share_references(reference_data, domain_name, seed):
+    """Prepare a domain's reference data for the shards of a shared pool, pickling it once.
+
+    Large data is written to a temporary file and each shard carries only its `SharedReferences`
+    handle, so every worker loads it once instead of receiving it with every shard; remove the
+    file with `release_references` once the domain's shards are done. Small data is returned as it is.
+    """
+    if not reference_data:
+        return {}
+    data = pickle.dumps(reference_data, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) <= INLINE_REFERENCE_BYTES:
+        return reference_data
+    descriptor, path = tempfile.mkstemp(prefix=f"mockgen-{domain_name}-references-", suffix='.pickle')
+    with os.fdopen(descriptor, 'wb') as file:
+        file.write(data)
+    return SharedReferences((domain_name, seed, path), path)
+
+
+def release_references(references):
+    """Remove the file of reference data shared by `share_references`, if any."""
+    if isinstance(references, SharedReferences):
+        try:
+            os.remove(references.path)
+        except FileNotFoundError:
+            pass
+
+
+def _load_references(references):
+    """Return shared reference data, reading its file only the first time this process sees it."""
+    with _worker_references_lock:
+        if references.key in _worker_references:
+            _worker_references.move_to_end(references.key)
+            return _worker_references[references.key]
+        with open(references.path, 'rb') as file:
+            reference_data = _worker_references[references.key] = pickle.load(file)
+        while len(_worker_references) > WORKER_REFERENCE_CACHE:
+            _worker_references.popitem(last=False)
+        return reference_data
+
+
+def uses_faker(domain_config):
+    """Whether any field of a domain or its child collections calls a Faker provider."""
+    return any(field.get('type') == 'string' and 'faker' in field for field in domain_fields(domain_config))
+
+
+def _seeded_faker(seed):
+    """Return this thread's Faker instance reseeded for a shard."""
+    fake = getattr(_worker_fakes, 'fake', None)
+    if fake is None:
+        from faker import Faker  # Loading every provider is slow, so only schemas with faker fields pay for it
+        fake = _worker_fakes.fake = Faker()
+    fake.seed_instance(seed)
+    return fake
+
+
+def _generate_rows(plan, count, keys, stats=None, sample_every=None):
+    """Generate `count` records with the row engine into one list per field, timing every field of one
+    record in `sample_every`.
+
+    Fields read earlier values of their record from one scratch dict reused for every record;
+    datetimes other fields read are formatted into it, while their columns keep the microseconds.
+    """
+    columns = {field.name: [] for field in plan.fields}
+    formats = record_formats(plan)
+    appends = [(field, columns[field.name].append, formats[field.name].format_value if field.name in formats else None)
+               for field in plan.fields]
+    types = {field.name: generator_type(field.config) for field in plan.fields} if stats is not None else None
+    record = {}
+    for position in range(count):
+        record.clear()
+        timed = stats is not None and position % sample_every == 0
+        for field, append, format_value in appends:
+            try:
+                if timed:
+                    started = time.perf_counter()
+                    value = record[field.name] = field.generate(record, keys)
+                    add_field_time(stats, field.name, types[field.name], time.perf_counter() - started, 1)
+                else:
+                    value = record[field.name] = field.generate(record, keys)
+                if format_value is not None:
+                    record[field.name] = format_value(value)
+            except Exception as e:
+                logging.error(f"Error generating data for field {field.name}: {e}")
+                raise
+            append(value)
+    if stats is not None:
+        count_values(stats, plan, count)
+    return columns
+
+
+def generate_shard(domain_config, shard, record_count, seed, engine='row', options=None, reference_data=None,
+                   sample_every=None):
+    """Generate one shard of a domain with its own RNG, Faker instance and key positions.
+
+    Returns (batch, stats): the records as a `RecordBatch`, and the shard's stage and field
+    timings when `sample_every` is set (see `instrumentation`), else None.
+    """
+    shard_index, start, count = shard
+    options = dict(options or {}, pool_seed=seed)  # Pools without a seed of their own follow the run's
+    if isinstance(reference_data, SharedReferences):
+        reference_data = _load_references(reference_data)
+    reference_data = reference_data if reference_data is not None else _worker_reference_data
+    local_seed = shard_seed(seed, domain_config['name'], shard_index)
+    fake = _seeded_faker(local_seed) if uses_faker(domain_config) else None
+    stats = new_shard_stats() if sample_every else None
+    started = time.perf_counter()
+
+    combinations = domain_config.get('unique_combinations')
+    if engine == 'columnar' and not combinations:
+        import numpy as np
+        from columnar import compile_columns, generate_columns
+        plan = compile_columns(domain_config, fake, np.random.default_rng(local_seed), reference_data, **options)
+        keys = create_key_allocators(plan, record_count, seed, position=start)
+        compiled = time.perf_counter()
+        columns = generate_columns(plan, count, keys, stats=stats)
+    else:
+        plan = compile_domain(domain_config, fake, random.Random(local_seed), reference_data, **options)
+        keys = create_key_allocators(plan, record_count, seed, position=start)
+        compiled = time.perf_counter()
+        if combinations:  # Positions index one run-wide sequence of distinct combinations
+            _, combination_at = combination_sequence(CombinationSpace(domain_config), domain_config['name'],
+                                                     record_count, seed)
+            columns = generate_combination_columns(plan, keys, combination_at, start, count)
+            if stats is not None:
+                count_values(stats, plan, count)
+        else:
+            columns = _generate_rows(plan, count, keys, stats, sample_every)
+    batch = RecordBatch.from_columns(columns, plan.field_names, count, plan_categories(plan), plan.formats)
+
+    if domain_config.get('children'):
+        import numpy as np
+        from children import compile_children, attach_children
+        # Children draw from their own stream so adding a collection leaves parent values unchanged
+        child_started = time.perf_counter()
+        child_plans = compile_children(domain_config, fake, np.random.default_rng([local_seed, 1]),
+                                       reference_data, **options)
+        compiled += time.perf_counter() - child_started  # Compilation is charged to compile, not generate
+        attach_children(child_plans, batch, stats)
+
+    if stats is not None:
+        stats['stages']['compile'] += compiled - started
+        stats['stages']['generate'] += time.perf_counter() - compiled
+        stats['records'] += count
+    return batch, stats
+
+
+def open_executor(workers=None):
+    """Start a process pool shared by every domain of a run, or return None to generate in-process.
+
+    Call it after `warm_pools` and before any domain threads start, so workers fork from a
+    single-threaded parent that already holds the faker pools and value lists.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return None
+    from concurrent.futures import ProcessPoolExecutor
+    executor = ProcessPoolExecutor(max_workers=workers)
+    executor.submit(int).result()  # Fork-based pools start every worker on the first task
+    return executor
+
+
+def _in_order(submit, shards, window):
+    """Submit shards and yield their results in order, with at most `window` shards in flight."""
+    pending = deque()
+    for shard in shards:
+        # Keep a bounded window of shards in flight so finished shards don't pile up
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(submit(shard))
+    while pending:
+        yield pending.popleft().result()
+
+
+def generate_sharded(domain_config, record_count, seed=None, workers=None, shard_size=DEFAULT_SHARD_SIZE,
+                     engine='row', reference_data=None, executor=None, metrics=None, first_shard=0, first_record=0,
+                     first_index=None, **options):
+    """Generate a domain shard by shard across processes, yielding each shard's `RecordBatch` in order.
+
+    Shard boundaries depend only on record_count and shard_size, and every shard is seeded
+    from (seed, domain, shard index), so the merged output is identical for any worker count.
+    With a shared `executor` (see `open_executor`) the reference data is sent to each worker once
+    (see `share_references`).
+    Shards report their timings into `metrics` (a `RunMetrics`) when one is given.
+    `first_shard` skips the shards before it, e.g. ones a resumed run already wrote;
+    `first_record` and `first_index` generate only the records an appended run adds (see `plan_shards`).
+    """
+    seed = resolve_seed(seed, domain_config['name'])
+    shards = plan_shards(record_count, shard_size, first_record, first_index)[first_shard:]
+    sample_every = metrics.sample_every if metrics is not None else None
+
+    def collect(results):
+        for batch, stats in results:
+            if stats is not None:
+                metrics.add_shard(domain_config['name'], stats)
+            yield batch
+
+    if executor is not None:
+        references = share_references(reference_data, domain_config['name'], seed)
+        try:
+            yield from collect(_in_order(
+                lambda shard: executor.submit(generate_shard, domain_config, shard, record_count, seed, engine,
+                                              options, references, sample_every),
+                shards, (workers or os.cpu_count() or 1) * 2))
+        finally:
+            release_references(references)
+        return
+
+    workers = min(workers or os.cpu_count() or 1, len(shards) or 1)
+    if workers == 1:
+        yield from collect(generate_shard(domain_config, shard, record_count, seed, engine, options, reference_data,
+                                          sample_every) for shard in shards)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    warm_pools(domain_config, options.get('faker_pool'))
+    warm_value_lists(domain_config)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(reference_data,)) as executor:
+        yield from collect(_in_order(
+            lambda shard: executor.submit(generate_shard, domain_config, shard, record_count, seed, engine, options,
+                                          None, sample_every),
+            shards, workers * 2))
@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from collections import deque, namedtuple
+from urllib.parse import urlsplit, parse_qsl
+
+from config_cache import load_config
+from pipeline import generation_options, load_references, reference_indexes
+from schema_compiler import referenced_columns
+from sharding import (generate_shard, generate_sharded, resolve_seed, open_executor, plan_shards, domain_record_count,
+                      share_references, release_references)
+from relationships import ColumnCollector, key_range_index
+from scheduler import domain_dependencies, domain_references
+from faker_pool import warm_pools
+from value_lists import warm_value_lists
+
+DEFAULT_PORT = 8765
+DEFAULT_SHARD_SIZE = 1000  # Smaller than for files, so the first records arrive quickly
+DEFAULT_AHEAD = 4  # Shards generated ahead of each connection, per worker
+MAX_REQUEST_LINE = 8192
+REFERENCE_CACHE_SIZE = 16  # Parent indexes kept for recently streamed seeds
+
+
+def encode_shard(domain_config, shard, record_count, seed, engine, options, reference_data):
+    """Generate one shard in a worker and return it as JSON lines, so the event loop only copies bytes."""
+    batch, _ = generate_shard(domain_config, shard, record_count, seed, engine, options, reference_data)
+    encode = json.JSONEncoder().encode
+    return ''.join(f"{encode(record)}\n" for record in batch.records()).encode('utf-8')
+
+
+# One client's stream: a domain, its seed and how many records to send
+StreamRequest = namedtuple('StreamRequest', ['domain_config', 'seed', 'count'])
+
+
+class ReferenceIndexes:
+    """The parent indexes relationship fields sample from, per domain and seed, kept for recent seeds.
+
+    Referenced primary keys are described by their key range; other referenced columns are
+    collected by generating the parent domain, on `executor` when one is given. Parents from
+    other configuration files (`references`, see `load_references`) are indexed once, with the
+    seed of their own file, whatever seed a stream asks for.
+    """
+
+    def __init__(self, config, shard_size, workers=None, executor=None, references=None):
+        self.settings = config['mock_data_generator']['settings']
+        self.domains = {domain['name']: domain for domain in config['mock_data_generator']['domains']}
+        self.external = references or {}
+        self.dependencies = domain_dependencies(list(self.domains.values()), self.external)
+        self.referenced = referenced_columns(list(self.domains.values()))
+        self.options = generation_options(self.settings)
+        self.engine = self.settings.get('engine', 'row').lower()
+        self.shard_size = shard_size
+        self.workers = workers
+        self.executor = executor
+        self._indexes = {}  # (domain, seed) -> referenced columns, most recently used last
+        self._external_indexes = None
+        self._lock = threading.RLock()  # Held while a parent's own parents are indexed
+
+    def domain_indexes(self, domain_name, seed):
+        """Return the referenced columns of a domain for a seed, generating the domain when they are not keys."""
+        key = (domain_name, seed)
+        with self._lock:
+            if key in self._indexes:
+                self._indexes[key] = self._indexes.pop(key)
+                return self._indexes[key]
+            domain = self.domains[domain_name]
+            record_count = domain_record_count(domain, self.settings)
+            indexes = {name: key_range_index(domain, name, record_count, seed)
+                       for name in self.referenced.get(domain_name, ())}
+            collectors = {name: ColumnCollector() for name, index in indexes.items() if index is None}
+            if collectors:
+                logging.info(f"Generating domain '{domain_name}' (seed {seed}) for the columns its children reference")
+                for batch in generate_sharded(domain, record_count, seed, self.workers, self.shard_size, self.engine,
+                                              self.reference_data(domain_name, seed), self.executor, **self.options):
+                    for name, collector in collectors.items():
+                        collector.extend(batch.column(name))
+                indexes.update((name, collector.finish()) for name, collector in collectors.items())
+            self._indexes[key] = indexes
+            while len(self._indexes) > REFERENCE_CACHE_SIZE:
+                self._indexes.pop(next(iter(self._indexes)))
+            return indexes
+
+    def reference_data(self, domain_name, seed):
+        """Return the parent indexes the relationship fields of a domain sample from."""
+        parents = {parent: self.domain_indexes(parent, seed) for parent in self.dependencies[domain_name]}
+        external = domain_references(self.domains[domain_name]) & self.external.keys()
+        if external:
+            with self._lock:
+                if self._external_indexes is None:
+                    self._external_indexes = reference_indexes(self.external, self.referenced, self.executor)
+            parents.update((name, self._external_indexes[name]) for name in external)
+        return parents
+
+
+class StreamServer:
+    """Stream the records of a configuration's domains to any number of clients as JSON lines.
+
+    Each connection names a domain and optionally a seed and count, and gets its own stream:
+    records are generated shard by shard on a process pool shared by every connection, at most
+    `ahead` shards ahead of what the client has read. A slow client therefore stops its own
+    generation rather than buffering, while a fast one keeps every worker busy. The records of a
+    given seed and count are the same as a file run with that seed, record_count and shard_size.
+
+    Clients speak HTTP (`GET /stream/<domain>?seed=1&count=1000`, answered with a chunked
+    `application/x-ndjson` body) or a raw line protocol (`<domain> seed=1 count=1000\\n`, answered
+    with JSON lines until the stream ends) on the same TCP port or Unix socket.
+    """
+
+    def __init__(self, config, workers=None, shard_size=DEFAULT_SHARD_SIZE, ahead=None, references=None):
+        self.config = config
+        self.external = references or {}
+        self.settings = config['mock_data_generator']['settings']
+        self.domains = {domain['name']: domain for domain in config['mock_data_generator']['domains']}
+        self.options = generation_options(self.settings)
+        self.engine = self.settings.get('engine', 'row').lower()
+        self.shard_size = shard_size
+        self.workers = workers or self.settings.get('workers')
+        self.executor = None
+        self.references = None
+        self.ahead = ahead
+        self.connections = 0
+
+    def start(self):
+        """Warm the faker pools and value lists and start the worker pool; call it before the event loop starts threads."""
+        for domain in self.domains.values():
+            warm_pools(domain, self.options['faker_pool'])
+            warm_value_lists(domain)
+        for domain, reference_settings in self.external.values():
+            warm_pools(domain, generation_options(reference_settings)['faker_pool'])
+            warm_value_lists(domain)
+        self.executor = open_executor(self.workers)
+        self.references = ReferenceIndexes(self.config, self.shard_size, self.workers, self.executor, self.external)
+        self.ahead = self.ahead or DEFAULT_AHEAD * (self.workers or os.cpu_count() or 1)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    def parse_request(self, domain_name, parameters):
+        """Validate a client's domain and parameters into a StreamRequest."""
+        domain = self.domains.get(domain_name)
+        if domain is None:
+            raise ValueError(f"Unknown domain '{domain_name}'. Options: {', '.join(self.domains)}")
+        unknown = set(parameters) - {'seed', 'count'}
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}. Options: seed, count")
+        try:
+            seed = int(parameters['seed']) if 'seed' in parameters else self.settings.get('seed')
+            count = int(parameters.get('count', domain.get('record_count', self.settings['record_count'])))
+        except ValueError:
+            raise ValueError("seed and count must be integers")
+        if count < 0:
+            raise ValueError(f"Invalid count: {count}")
+        # Without a seed here or in settings each connection draws its own, so concurrent clients differ
+        seed = resolve_seed(seed, domain_name)
+        return StreamRequest(domain, seed, domain_record_count(dict(domain, record_count=count), self.settings))
+
+    async def produce(self, request, queue):
+        """Generate a stream's shards in order into `queue`, blocking while it is full.
+
+        The stream ends with None, or with the exception that stopped generation.
+        """
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        references = None
+        try:
+            name = request.domain_config['name']
+            reference_data = await loop.run_in_executor(None, self.references.reference_data, name, request.seed)
+            # Sent to each worker once per stream rather than with every shard
+            references = share_references(reference_data, name, request.seed)
+            for shard in plan_shards(request.count, self.shard_size):
+                if len(pending) >= self.ahead:
+                    await queue.put(await pending.popleft())
+                pending.append(loop.run_in_executor(self.executor, encode_shard, request.domain_config, shard,
+                                                    request.count, request.seed, self.engine, self.options,
+                                                    references))
+            while pending:
+                await queue.put(await pending.popleft())
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            for future in pending:  # The client went away; shards not yet started are dropped
+                future.cancel()
+            release_references(references)
+
+    async def stream(self, request, send):
+        """Send a stream's chunks with `send` as they are generated; return the number of bytes sent."""
+        queue = asyncio.Queue(maxsize=1)  # Finished shards wait in `produce`, which then stops submitting
+        producer = asyncio.create_task(self.produce(request, queue))
+        sent = 0
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                await send(chunk)  # Waits for the client to read, which holds back the producer
+                sent += len(chunk)
+            await producer
+        finally:
+            producer.cancel()
+        return sent
+
+    async def handle(self, reader, writer):
+        """Serve one connection, HTTP or raw line protocol, whichever its first line is."""
+        self.connections += 1
+        connection = self.connections
+        try:
+            line = await reader.readline()
+            if len(line) > MAX_REQUEST_LINE:
+                return
+            if line.startswith(b'GET '):
+                await self.handle_http(connection, line, reader, writer)
+            elif line.strip():
+                await self.handle_raw(connection, line, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            logging.info(f"Connection {connection} closed by the client")
+        except Exception as e:  # Ends the stream early, which a client sees as a truncated response
+            logging.error(f"Connection {connection}: stream failed: {e}")
+        finally:
+            writer.close()
+
+    async def handle_raw(self, connection, line, writer):
+        words = line.decode('utf-8', 'replace').split()
+        try:
+            parameters = dict(word.split('=', 1) for word in words[1:])
+            request = self.parse_request(words[0], parameters)
+        except ValueError as e:
+            writer.write(f"{json.dumps({'error': str(e)})}\n".encode('utf-8'))
+            await writer.drain()
+            return
+
+        async def send(chunk):
+            writer.write(chunk)
+            await writer.drain()
+        await self.serve_stream(connection, request, send)
+
+    async def handle_http(self, connection, line, reader, writer):
+        while (await reader.readline()).strip():  # Headers carry nothing a stream needs
+            pass
+        url = urlsplit(line.split()[1].decode('utf-8', 'replace'))
+        parts = url.path.strip('/').split('/')
+        try:
+            if len(parts) != 2 or parts[0] != 'stream':
+                raise LookupError(f"Not found: {url.path}; use /stream/<domain>")
+            request = self.parse_request(parts[1], dict(parse_qsl(url.query)))
+        except (LookupError, ValueError) as e:
+            status = '404 Not Found' if isinstance(e, LookupError) else '400 Bad Request'
+            body = f"{json.dumps({'error': str(e)})}\n".encode('utf-8')
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode('ascii') + body)
+            await writer.drain()
+            return
+        writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n"
+                     f"X-Seed: {request.seed}\r\nX-Record-Count: {request.count}\r\n"
+                     f"Connection: close\r\n\r\n".encode('ascii'))
+
+        async def send(chunk):
+            writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            await writer.drain()
+        await self.serve_stream(connection, request, send)
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    async def serve_stream(self, connection, request, send):
+        name = request.domain_config['name']
+        logging.info(f"Connection {connection}: streaming {request.count} {name} records with seed {request.seed}")
+        started = time.perf_counter()
+        sent = await self.stream(request, send)
+        seconds = time.perf_counter() - started
+        logging.info(f"Connection {connection}: sent {request.count} {name} records ({sent} bytes) in {seconds:.2f}s"
+                     f" ({request.count / seconds if seconds else 0:.0f} records/s)")
+
+
+async def serve(server, host=None, port=None, unix=None):
+    """Listen on TCP and/or a Unix socket until cancelled."""
+    listeners = []
+    if unix:
+        listeners.append(await asyncio.start_unix_server(server.handle, unix))
+        logging.info(f"Streaming {', '.join(server.domains)} on unix:{unix}")
+    if port is not None or not unix:
+        port = DEFAULT_PORT if port is None else port
+        listeners.append(await asyncio.start_server(server.handle, host, port))
+        logging.info(f"Streaming {', '.join(server.domains)} on {host}:{port}")
+    try:
+        await asyncio.gather(*(listener.serve_forever() for listener in listeners))
+    finally:
+        for listener in listeners:
+            listener.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream generated records to clients over HTTP or a raw socket.")
+    parser.add_argument('config', help="configuration file, e.g. customer.yaml")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default 127.0.0.1)")
+    parser.add_argument('--port', type=int, help=f"TCP port (default {DEFAULT_PORT} unless --unix is given)")
+    parser.add_argument('--unix', help="also, or only, listen on this Unix socket path")
+    parser.add_argument('--workers', type=int, help="generator processes shared by all streams (default settings.workers)")
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE,
+                        help=f"records generated per task (default {DEFAULT_SHARD_SIZE})")
+    parser.add_argument('--ahead', type=int,
+                        help=f"shards generated ahead of each client (default {DEFAULT_AHEAD} per worker)")
+    args = parser.parse_args(argv)
+    try:
+        config = load_config(args.config)
+        server = StreamServer(config, args.workers, args.shard_size, args.ahead,
+                              load_references(config['mock_data_generator'], args.config))
+        server.start()
+    except Exception as e:
+        logging.critical(f"Program terminated due to an error: {e}")
+        return 1
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
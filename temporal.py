@@ -0,0 +1,292 @@
+import re
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+DATETIME_DISTRIBUTIONS = ('uniform', 'business_hours', 'seasonal', 'increasing')
+DEFAULT_FORMAT = 'YYYY-MM-DDTHH:mm:ss'
+DATE_FORMAT = 'YYYY-MM-DD'
+
+# Values are microseconds since the Unix epoch (naive, no time zone)
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+SECOND = 1_000_000
+DAY = 86_400 * SECOND
+
+# Format token: (width, component, microseconds per unit when it is the finest token)
+TOKENS = {
+    'YYYY': (4, 'year', DAY),
+    'MM': (2, 'month', DAY),
+    'DD': (2, 'day', DAY),
+    'HH': (2, 'hour', 3600 * SECOND),
+    'mm': (2, 'minute', 60 * SECOND),
+    'ss': (2, 'second', SECOND),
+    'SSS': (3, 'millisecond', 1000),
+    'SSSSSS': (6, 'microsecond', 1),
+}
+TOKEN_PATTERN = re.compile('|'.join(sorted(TOKENS, key=len, reverse=True)))
+
+
+class DatetimeFormat:
+    """A `format` such as `YYYY-MM-DD HH:mm:ss`, compiled once into fixed-width formatters and parsers.
+
+    Every token has a fixed width, so a whole column is formatted or parsed with a handful of
+    array operations on character codes instead of one strftime/strptime call per value.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.parts = []  # (start, width, component) for tokens, (start, literal) for literals
+        template, position, offset = [], 0, 0
+        for match in TOKEN_PATTERN.finditer(pattern):
+            literal = pattern[position:match.start()]
+            if literal:
+                self.parts.append((offset, literal))
+                template.append(literal.replace('{', '{{').replace('}', '}}'))
+                offset += len(literal)
+            width, component, _ = TOKENS[match.group()]
+            self.parts.append((offset, width, component))
+            template.append('{1:03d}' if component == 'millisecond' else f"{{0.{component}:0{width}d}}")
+            offset += width
+            position = match.end()
+        literal = pattern[position:]
+        if literal:
+            self.parts.append((offset, literal))
+            template.append(literal.replace('{', '{{').replace('}', '}}'))
+            offset += len(literal)
+        components = {part[2] for part in self.parts if len(part) == 3}
+        if not {'year', 'month', 'day'} <= components:
+            raise ValueError(f"Datetime format '{pattern}' needs YYYY, MM and DD.")
+        self.width = offset
+        self.resolution = min(TOKENS[token][2] for token in TOKENS if TOKENS[token][1] in components)
+        self._template = ''.join(template)
+
+    def format_value(self, value):
+        """Format microseconds since the epoch."""
+        moment = EPOCH + timedelta(microseconds=value)
+        return self._template.format(moment, moment.microsecond // 1000)
+
+    def parse_value(self, text):
+        """Parse a string written by `format_value` back into microseconds since the epoch."""
+        values = {'hour': 0, 'minute': 0, 'second': 0, 'microsecond': 0}
+        for part in self.parts:
+            if len(part) == 3:
+                start, width, component = part
+                values[component] = int(text[start:start + width])
+        if 'millisecond' in values:
+            values['microsecond'] += values.pop('millisecond') * 1000
+        return (datetime(**values) - EPOCH) // MICROSECOND
+
+    def format_array(self, values):
+        """Format an int64 array of microseconds since the epoch as a fixed-width string array."""
+        import numpy as np
+        values = np.asarray(values, dtype=np.int64)
+        components = _components(values)
+        codes = np.empty((len(values), self.width), dtype=np.uint32)
+        for part in self.parts:
+            if len(part) == 2:
+                start, literal = part
+                codes[:, start:start + len(literal)] = [ord(character) for character in literal]
+                continue
+            start, width, component = part
+            digits = components[component]
+            for position in range(start + width - 1, start - 1, -1):
+                codes[:, position] = 48 + digits % 10
+                digits = digits // 10
+        return codes.view(f'U{self.width}').reshape(len(values))
+
+    def parse_array(self, values):
+        """Parse strings written by `format_array` into an int64 array of microseconds since the epoch."""
+        import numpy as np
+        strings = np.asarray(values, dtype=f'U{self.width}')
+        codes = np.ascontiguousarray(strings).view(np.uint32).reshape(len(strings), self.width).astype(np.int64) - 48
+        components = {}
+        for part in self.parts:
+            if len(part) == 3:
+                start, width, component = part
+                number = np.zeros(len(strings), dtype=np.int64)
+                for position in range(start, start + width):
+                    number = number * 10 + codes[:, position]
+                components[component] = number
+        months = (components['year'] - 1970) * 12 + components['month'] - 1
+        days = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + components['day'] - 1
+        result = days * DAY
+        for component, unit in (('hour', 3600 * SECOND), ('minute', 60 * SECOND), ('second', SECOND),
+                                ('millisecond', 1000), ('microsecond', 1)):
+            if component in components:
+                result += components[component] * unit
+        return result
+
+
+@lru_cache(maxsize=None)
+def compile_format(pattern):
+    """Return the compiled DatetimeFormat for a pattern, shared by every field using it."""
+    return DatetimeFormat(pattern)
+
+
+def _components(values):
+    """Split an int64 array of microseconds since the epoch into calendar components."""
+    import numpy as np
+    days = values // DAY
+    months = days.astype('datetime64[D]').astype('datetime64[M]')
+    time_of_day = values - days * DAY
+    return {
+        'year': months.astype(np.int64) // 12 + 1970,
+        'month': months.astype(np.int64) % 12 + 1,
+        'day': days - months.astype('datetime64[D]').astype(np.int64) + 1,
+        'hour': time_of_day // (3600 * SECOND),
+        'minute': time_of_day // (60 * SECOND) % 60,
+        'second': time_of_day // SECOND % 60,
+        'millisecond': time_of_day // 1000 % 1000,
+        'microsecond': time_of_day % SECOND,
+    }
+
+
+def field_format(field, date_only=False):
+    """Return the compiled output format of a datetime field.
+
+    Fields without `format` take their offset base's format, else `YYYY-MM-DD` when
+    `date_only` is set, else `YYYY-MM-DDTHH:mm:ss`.
+    """
+    pattern = field.get('format') or (field.get('offset') or {}).get('base_format')
+    return compile_format(pattern or (DATE_FORMAT if date_only else DEFAULT_FORMAT))
+
+
+def offset_base_format(field, date_only=False):
+    """Return the compiled format of the field an offset field is based on (see `with_base_format`)."""
+    return compile_format(field['offset'].get('base_format') or (DATE_FORMAT if date_only else DEFAULT_FORMAT))
+
+
+def with_base_format(field, fields, date_only=False):
+    """Record the format of an offset field's base on the field, so its values can be parsed back."""
+    offset = field.get('offset') if field.get('type') == 'datetime' else None
+    if not offset or 'base_format' in offset:
+        return field
+    for base in fields:
+        if base['name'] == offset['field']:
+            offset = dict(offset, base_format=field_format(base, date_only).pattern)
+            return dict(field, offset=offset)
+    return field
+
+
+def datetime_formats(fields, date_only=False):
+    """Map every generated datetime field of a list of field configs to its compiled output format.
+
+    A datetime field with neither `range` nor `offset` has no generator and stays empty.
+    """
+    return {field['name']: field_format(with_base_format(field, fields, date_only), date_only)
+            for field in fields if field.get('type') == 'datetime' and ('range' in field or 'offset' in field)}
+
+
+def _to_microseconds(text):
+    return (datetime.fromisoformat(str(text)) - EPOCH) // MICROSECOND
+
+
+def _range_microseconds(field):
+    """Return the first and last microsecond of a datetime field's range; a date-only `end` includes that day."""
+    start, end = field['range']['start'], field['range']['end']
+    last = _to_microseconds(end)
+    if len(str(end)) <= len('YYYY-MM-DD'):
+        last += DAY - 1
+    return _to_microseconds(start), last
+
+
+def _bounds(field, unit):
+    """Return the range of a datetime field in whole units of `unit` microseconds, both ends inclusive."""
+    start, end = _range_microseconds(field)
+    low, high = -(-start // unit), end // unit
+    if high < low:
+        raise ValueError(f"Empty datetime range {field['range']['start']}..{field['range']['end']} "
+                         f"for field {field['name']}.")
+    return low, high
+
+
+def _distribution(field):
+    distribution = field.get('distribution', 'uniform')
+    if distribution not in DATETIME_DISTRIBUTIONS:
+        raise ValueError(f"Unsupported datetime distribution '{distribution}' for field {field['name']}. "
+                         f"Options: {', '.join(DATETIME_DISTRIBUTIONS)}")
+    return distribution
+
+
+def _weighted_days(field, unit):
+    """Compile day weights (`months`, `weekdays`) and the `hours` window of a business_hours or seasonal field.
+
+    Returns (days, cumulative weights, first and last microsecond of the day window in units).
+    """
+    name = field['name']
+    business = field.get('distribution') == 'business_hours'
+    months = field.get('months', [1] * 12)
+    weekdays = field.get('weekdays', [1] * 5 + [0] * 2 if business else [1] * 7)
+    hours = field.get('hours', [9, 17] if business else [0, 24])
+    if len(months) != 12 or len(weekdays) != 7:
+        raise ValueError(f"Field {name} needs 12 month weights and 7 weekday weights (Monday first).")
+    if not 0 <= hours[0] < hours[1] <= 24:
+        raise ValueError(f"Invalid hours {hours} for field {name}; use [start, end] within 0..24.")
+    first, last = (value // DAY for value in _range_microseconds(field))
+    days, cumulative, total = [], [], 0.0
+    for day in range(first, last + 1):
+        moment = EPOCH.date() + timedelta(days=day)
+        weight = months[moment.month - 1] * weekdays[moment.weekday()]
+        if weight > 0:
+            total += weight
+            days.append(day)
+            cumulative.append(total)
+    if not days:
+        raise ValueError(f"No day in the range of field {name} has a positive weight.")
+    window = (-(-hours[0] * 3600 * SECOND // unit), hours[1] * 3600 * SECOND // unit - 1) if unit < DAY else (0, 0)
+    return days, cumulative, window
+
+
+def _clamp(value, low, high):
+    return low if value < low else high if value > high else value
+
+
+def row_datetime_sampler(field, rng, unit):
+    """Return `sample(keys)` drawing one datetime, in whole `unit`s of microseconds since the epoch."""
+    distribution = _distribution(field)
+    low, high = _bounds(field, unit)
+    if distribution == 'increasing':  # Spread evenly over the range by record position, so values never decrease
+        field_name, span = field['name'], high - low + 1
+
+        def sample_increasing(keys):
+            positions = keys[field_name]
+            return (low + int((positions.allocate() + rng.random()) * span / positions.size)) * unit
+        return sample_increasing
+    if distribution in ('business_hours', 'seasonal'):
+        days, cumulative, (first, last) = _weighted_days(field, unit)
+        total, units_per_day = cumulative[-1], DAY // unit
+
+        def sample_weighted(keys):
+            day = days[min(bisect_right(cumulative, rng.random() * total), len(days) - 1)]
+            return _clamp(day * units_per_day + rng.randint(first, last), low, high) * unit
+        return sample_weighted
+    return lambda keys: rng.randint(low, high) * unit
+
+
+def column_datetime_sampler(field, rng, unit):
+    """Return `sample(count, keys)` drawing an int64 array of datetimes in whole `unit`s of microseconds."""
+    import numpy as np
+    distribution = _distribution(field)
+    low, high = _bounds(field, unit)
+    if distribution == 'increasing':
+        field_name, span = field['name'], high - low + 1
+
+        def sample_increasing(count, keys):
+            positions = keys[field_name]
+            offsets = (positions.allocate_many(count) + rng.random(count)) * (span / positions.size)
+            return (low + offsets.astype(np.int64)) * unit
+        return sample_increasing
+    if distribution in ('business_hours', 'seasonal'):
+        days, cumulative, (first, last) = _weighted_days(field, unit)
+        days, cumulative = np.asarray(days, dtype=np.int64), np.asarray(cumulative)
+        units_per_day = DAY // unit
+
+        def sample_weighted(count, keys):
+            picks = np.minimum(np.searchsorted(cumulative, rng.random(count) * cumulative[-1], side='right'),
+                               len(days) - 1)
+            values = days[picks] * units_per_day + rng.integers(first, last, count, endpoint=True)
+            return np.clip(values, low, high) * unit
+        return sample_weighted
+    return lambda count, keys: rng.integers(low, high, count, endpoint=True) * unit
+
@@ -0,0 +1,535 @@
+import io
+import os
+import re
+import asyncio
+import csv
+import gzip
+import json
+import time
+import random
+import struct
+from datetime import date
+
+import numpy as np
+import pytest
+
+from key_allocator import KeyAllocator, KEY_MODES
+from combinations import CombinationSpace, combination_sequence
+from value_lists import AliasTable
+from expressions import compile_formula, bind_row, bind_columns
+import pipeline
+import sharding
+from config_cache import load_config
+from domain_cache import DomainCache
+from writers import CompressedRawFile, STREAM_COMPRESSIONS
+from stream_server import StreamServer
+from event_stream import EventStream, ARRIVALS
+
+
+@pytest.mark.parametrize('mode', KEY_MODES)
+@pytest.mark.parametrize('start, end', [(1, 1), (1, 10), (100, 1100), (0, 4095)])
+def test_allocator_is_a_permutation(mode, start, end):
+    allocator = KeyAllocator(start, end, mode, seed=42)
+    keys = [allocator.key_at(position) for position in range(allocator.size)]
+    assert sorted(keys) == list(range(start, end + 1))
+    assert allocator.allocate_many(allocator.size).tolist() == keys
+    with pytest.raises(ValueError):
+        allocator.allocate()
+
+
+def test_combination_indexes_round_trip():
+    domain = {'name': 'cars', 'fields': [
+        {'name': 'model', 'type': 'dependency',
+         'dependency': {'field': 'make', 'values': {'A': ['a1', 'a2', 'a3'], 'B': ['b1'], 'C': ['c1', 'c2']}}},
+        {'name': 'make', 'type': 'predefined_list', 'values': ['A', 'B', 'C']},
+        {'name': 'color', 'type': 'predefined_list', 'values': ['red', 'blue']},
+        {'name': 'trim', 'type': 'dependency',
+         'dependency': {'field': 'model', 'values': {'a1': ['x', 'y'], 'a2': ['x'], 'a3': ['x', 'y', 'z'],
+                                                     'b1': ['x'], 'c1': ['y'], 'c2': ['x', 'z']}}},
+    ]}
+    space = CombinationSpace(domain, ['trim', 'make', 'model', 'color'])  # Parents are sorted first
+    expected = {(make, model, color, trim)
+                for make in ['A', 'B', 'C']
+                for model in domain['fields'][0]['dependency']['values'][make]
+                for color in ['red', 'blue']
+                for trim in domain['fields'][3]['dependency']['values'][model]}
+    assert space.size == len(expected)
+    encode = {}
+    for index in range(space.size):
+        record = space.combination(index)
+        encode[record['make'], record['model'], record['color'], record['trim']] = index
+    assert set(encode) == expected
+    assert all(space.combination(index) == dict(zip(('make', 'model', 'color', 'trim'), combination))
+               for combination, index in encode.items())
+    with pytest.raises(IndexError):
+        space.combination(space.size)
+
+    count, combination_at = combination_sequence(space, 'cars', space.size - 3, seed=7)
+    sampled = {tuple(sorted(combination_at(position).items())) for position in range(count)}
+    assert len(sampled) == count == space.size - 3
+
+
+def test_alias_table_frequencies():
+    weights = [1, 2, 3, 4, 0, 10, 0.5]
+    table = AliasTable.build(weights)
+    draws = 200000
+    counts = [0] * len(weights)
+    rng = random.Random(3)
+    for _ in range(draws):
+        counts[table.draw(rng)] += 1
+    array_counts = np.bincount(table.draw_array(np.random.default_rng(3), draws), minlength=len(weights))
+    for observed in (counts, array_counts.tolist()):
+        assert observed[4] == 0
+        for count, weight in zip(observed, weights):
+            assert abs(count / draws - weight / sum(weights)) < 0.005
+
+
+PEOPLE_FIELDS = [
+    {'name': 'person_id', 'type': 'primary_key', 'range': {'start': 1, 'end': 1000}},
+    {'name': 'name', 'type': 'string', 'faker': 'first_name'},
+    {'name': 'city', 'type': 'string', 'faker': 'city', 'pool': False},
+    {'name': 'tier', 'type': 'predefined_list', 'values': ['gold', 'silver'], 'probabilities': [0.3, 0.7]},
+    {'name': 'joined', 'type': 'datetime', 'range': {'start': '2020-01-01', 'end': '2024-12-31'}},
+    {'name': 'score', 'type': 'computed', 'formula': "person_id * 2 if tier == 'gold' else person_id"},
+]
+
+
+def _write_config(path, seed=11, engine='row', domains=None, **settings):
+    """Write a JSON (so also YAML) config of the `people` domain, or of `domains`, and return its path."""
+    settings = dict({'output_format': 'csv', 'record_count': 45, 'shard_size': 10, 'workers': 1, 'engine': engine,
+                     'faker_pool': {'size': 20}}, **settings)
+    if seed is not None:
+        settings['seed'] = seed
+    domains = domains or [{'name': 'people', 'fields': PEOPLE_FIELDS}]
+    path.write_text(json.dumps({'mock_data_generator': {'settings': settings, 'domains': domains}}))
+    return str(path)
+
+
+def _run_in(directory, monkeypatch, *args, **settings):
+    """Run a config in a fresh `directory` and return it."""
+    directory.mkdir(exist_ok=True)
+    monkeypatch.chdir(directory)
+    pipeline.run(_write_config(directory / 'config.yaml', *args, **settings))
+    return directory
+
+
+@pytest.mark.parametrize('engine', ['row', 'columnar'])
+@pytest.mark.parametrize('seed', [11, None])
+def test_resumed_checkpoint_matches_uninterrupted_run(tmp_path, monkeypatch, seed, engine):
+    interrupted, uninterrupted = tmp_path / 'interrupted', tmp_path / 'uninterrupted'
+    interrupted.mkdir()
+    uninterrupted.mkdir()
+    generate_sharded = pipeline.generate_sharded
+
+    def failing(*args, **kwargs):  # Fails after two of the five shards were written
+        for index, batch in enumerate(generate_sharded(*args, **kwargs)):
+            if index == 2:
+                raise RuntimeError("interrupted")
+            yield batch
+    monkeypatch.chdir(interrupted)
+    config = _write_config(interrupted / 'people.yaml', seed, engine, checkpoint={'directory': 'checkpoint'})
+    with monkeypatch.context() as patch:
+        patch.setattr(pipeline, 'generate_sharded', failing)
+        with pytest.raises(RuntimeError):
+            pipeline.run(config)
+    manifest = json.loads((interrupted / 'checkpoint' / 'manifest.json').read_text())
+    assert manifest['domains']['people']['completed'] == 2
+    assert not [path.name for path in (interrupted / 'checkpoint').rglob('*') if '.tmp' in path.name]
+    run_seed = manifest['domains']['people']['seed']  # Drawn at random when the config sets none
+    pipeline.run(config, resume=True)
+
+    monkeypatch.chdir(uninterrupted)
+    pipeline.run(_write_config(uninterrupted / 'people.yaml', run_seed, engine, checkpoint=True))
+    resumed = (interrupted / 'people_mock_data.csv').read_bytes()
+    assert resumed == (uninterrupted / 'people_mock_data.csv').read_bytes()
+    assert len(resumed.splitlines()) == 46
+
+
+@pytest.mark.parametrize('formula', [
+    'x + 7 ** 100000', '"ab" * 3000000', 'str(x).rjust(3000000000)', 'f"{x:>3000000000}"', 'f"{x:>{w}}"',
+    'f"{1.5:.3000000000f}"', '"%3000000000d" % x', '"%.3000000000f" % x', '"%*d" % (w, x)',
+])
+def test_formula_sizes_are_bounded(formula):
+    compiled = compile_formula(formula, 'total', known_fields={'x', 'w'})
+    with pytest.raises(ValueError):
+        bind_row(compiled)({'x': 7, 'w': 3000000000})
+    with pytest.raises(ValueError):
+        bind_columns(compiled, np.random.default_rng(1))({'x': np.array([7, 8]), 'w': np.array([3000000000] * 2)}, 2)
+
+
+@pytest.mark.parametrize('formula, expected', [
+    ('f"{x:>6.2f}"', '  7.00'), ('f"{x:0{w}d}"', '0007'), ('"%05d|%-3s|%%" % (x, "a")', '00007|a  |%'), ('x % 4', 3),
+])
+def test_bounded_formulas_still_format(formula, expected):
+    compiled = compile_formula(formula, 'total', known_fields={'x', 'w'})
+    assert bind_row(compiled)({'x': 7, 'w': 4}) == expected
+    assert bind_columns(compiled, np.random.default_rng(1))({'x': np.array([7]), 'w': np.array([4])}, 1)[0] == expected
+
+
+@pytest.mark.parametrize('engine', ['row', 'columnar'])
+def test_output_does_not_depend_on_worker_count(tmp_path, monkeypatch, engine):
+    outputs = [(_run_in(tmp_path / str(workers), monkeypatch, 5, engine, record_count=95, workers=workers)
+                / 'people_mock_data.csv').read_bytes() for workers in (1, 4)]
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0].splitlines()) == 96
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'jsonl'])
+def test_append_matches_one_run(tmp_path, monkeypatch, output_format):
+    # Appending at a shard boundary numbers and seeds the new shards as one larger run would
+    single = _run_in(tmp_path / 'single', monkeypatch, output_format=output_format, record_count=70)
+    _run_in(tmp_path / 'appended', monkeypatch, output_format=output_format, record_count=40, append=True)
+    appended = _run_in(tmp_path / 'appended', monkeypatch, output_format=output_format, record_count=70, append=True)
+    file_name = f"people_mock_data.{output_format}"
+    assert (appended / file_name).read_bytes() == (single / file_name).read_bytes()
+    assert json.loads((appended / f"{file_name}.state.json").read_text())['records'] == 70
+
+
+def test_parquet_append_adds_a_sibling_file(tmp_path, monkeypatch):
+    pq = pytest.importorskip('pyarrow.parquet')
+    single = _run_in(tmp_path / 'single', monkeypatch, output_format='parquet', record_count=70)
+    _run_in(tmp_path / 'appended', monkeypatch, output_format='parquet', record_count=40, append=True)
+    appended = _run_in(tmp_path / 'appended', monkeypatch, output_format='parquet', record_count=70, append=True)
+    first, second = (pq.read_table(appended / name)
+                     for name in ('people_mock_data.parquet', 'people_mock_data.1.parquet'))
+    assert (first.num_rows, second.num_rows) == (40, 30)
+    whole = pq.read_table(single / 'people_mock_data.parquet')
+    assert first.schema == second.schema == whole.schema
+    assert first.to_pylist() + second.to_pylist() == whole.to_pylist()
+
+
+def test_cache_hit_restores_identical_output(tmp_path, monkeypatch):
+    cache = {'directory': str(tmp_path / 'cache')}
+    generated = _run_in(tmp_path / 'generated', monkeypatch, cache=cache)
+    with monkeypatch.context() as patch:  # A hit copies the files without generating anything
+        patch.setattr(pipeline, 'generate_sharded', None)
+        restored = _run_in(tmp_path / 'restored', monkeypatch, cache=cache)
+    assert (restored / 'people_mock_data.csv').read_bytes() == (generated / 'people_mock_data.csv').read_bytes()
+    counters = DomainCache(cache['directory']).stats()['counters']
+    assert (counters['misses'], counters['stores'], counters['hits']) == (1, 1, 1)
+
+
+def test_cache_misses_when_config_or_seed_changes(tmp_path, monkeypatch):
+    cache = {'directory': str(tmp_path / 'cache')}
+    _run_in(tmp_path / 'first', monkeypatch, cache=cache)
+    reseeded = _run_in(tmp_path / 'reseeded', monkeypatch, 12, cache=cache)
+    changed = [dict(field, values=['gold', 'bronze']) if field['name'] == 'tier' else field for field in PEOPLE_FIELDS]
+    _run_in(tmp_path / 'changed', monkeypatch, cache=cache, domains=[{'name': 'people', 'fields': changed}])
+    stats = DomainCache(cache['directory']).stats()
+    assert stats['counters'] == {'misses': 3, 'stores': 3}
+    assert stats['entries'] == 3
+    first = (tmp_path / 'first' / 'people_mock_data.csv').read_bytes()
+    assert (reseeded / 'people_mock_data.csv').read_bytes() != first
+
+
+def _decompress(data, compression):
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    zstandard = pytest.importorskip('zstandard')
+    return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True).read()
+
+
+@pytest.mark.parametrize('compression', list(STREAM_COMPRESSIONS))
+def test_compressed_chunks_round_trip(tmp_path, compression):
+    data = b''.join(f"{index},{'x' * (index % 13)}\n".encode() for index in range(2000))
+    path = tmp_path / 'chunks'
+    with CompressedRawFile(open(path, 'wb'), compression, threads=3, chunk_size=1000) as file:
+        for start in range(0, len(data), 777):  # Writes that straddle chunk boundaries
+            file.write(data[start:start + 777])
+        assert file.chunks > 10
+    with CompressedRawFile(open(path, 'ab'), compression, threads=2, chunk_size=1000) as file:
+        file.write(data)
+    assert _decompress(path.read_bytes(), compression) == data + data
+
+
+@pytest.mark.parametrize('compression', list(STREAM_COMPRESSIONS))
+@pytest.mark.parametrize('output_format', ['csv', 'jsonl'])
+def test_compressed_output_matches_uncompressed(tmp_path, monkeypatch, compression, output_format):
+    file_name = f"people_mock_data.{output_format}"
+    plain = _run_in(tmp_path / 'plain', monkeypatch, output_format=output_format, record_count=70)
+    _run_in(tmp_path / 'compressed', monkeypatch, output_format=output_format, record_count=40,
+            compression=compression, append=True)
+    compressed = _run_in(tmp_path / 'compressed', monkeypatch, output_format=output_format, record_count=70,
+                         compression=compression, append=True)
+    data = (compressed / f"{file_name}{STREAM_COMPRESSIONS[compression]}").read_bytes()
+    assert _decompress(data, compression) == (plain / file_name).read_bytes()
+
+
+TYPED_FIELDS = [
+    {'name': 'person_id', 'type': 'primary_key', 'range': {'start': 1, 'end': 1000}},
+    {'name': 'note', 'type': 'predefined_list', 'values': ['tab\there', 'back\\slash', 'new\nline', 'plain']},
+    {'name': 'joined', 'type': 'datetime', 'format': 'YYYY-MM-DD', 'range': {'start': '2020-01-01', 'end': '2024-12-31'}},
+    {'name': 'amount', 'type': 'float', 'range': {'min': 1, 'max': 5}},
+]
+
+
+def _typed_rows(tmp_path, monkeypatch):
+    """The rows of the typed domain, from a CSV run, with the key as an int."""
+    directory = _run_in(tmp_path / 'csv', monkeypatch, domains=[{'name': 'people', 'fields': TYPED_FIELDS}])
+    with open(directory / 'people_mock_data.csv', newline='', encoding='utf-8') as file:
+        return [dict(row, person_id=int(row['person_id'])) for row in csv.DictReader(file)]
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow'])
+def test_columnar_formats_keep_types(tmp_path, monkeypatch, output_format):
+    pa = pytest.importorskip('pyarrow')
+    rows = _typed_rows(tmp_path, monkeypatch)
+    directory = _run_in(tmp_path / output_format, monkeypatch, output_format=output_format,
+                        domains=[{'name': 'people', 'fields': TYPED_FIELDS}])
+    path = str(directory / f"people_mock_data.{output_format}")
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+    else:
+        import pyarrow.ipc
+        table = pyarrow.ipc.open_file(path).read_all()
+    assert table.schema.field('person_id').type == pa.int64()
+    assert table.schema.field('joined').type == pa.date32()
+    assert table.schema.field('amount').type == pa.float64()
+    assert pa.types.is_dictionary(table.schema.field('note').type)
+    assert table.num_rows == len(rows) == 45
+    assert table.column('person_id').to_pylist() == [row['person_id'] for row in rows]
+    assert [value.isoformat() for value in table.column('joined').to_pylist()] == [row['joined'] for row in rows]
+    assert table.column('note').to_pylist() == [row['note'] for row in rows]
+
+
+def test_sqlite_table(tmp_path, monkeypatch):
+    import sqlite3
+    rows = _typed_rows(tmp_path, monkeypatch)
+    directory = _run_in(tmp_path / 'sqlite', monkeypatch, output_format='sqlite',
+                        domains=[{'name': 'people', 'fields': TYPED_FIELDS}])
+    connection = sqlite3.connect(directory / 'people_mock_data.sqlite')
+    try:
+        columns = {name: column_type for _, name, column_type, *_ in connection.execute('PRAGMA table_info(people)')}
+        assert columns == {'person_id': 'INTEGER', 'note': 'TEXT', 'joined': 'TEXT', 'amount': 'REAL'}
+        loaded = connection.execute('SELECT person_id, note, joined FROM people ORDER BY rowid').fetchall()
+    finally:
+        connection.close()
+    assert loaded == [(row['person_id'], row['note'], row['joined']) for row in rows]
+
+
+def _copy_text_rows(script):
+    """The rows of the one COPY ... FROM STDIN block of a psql script, unescaped."""
+    lines = script.split('\n')
+    start = next(index for index, line in enumerate(lines) if line.startswith('COPY ')) + 1
+    rows = lines[start:lines.index('\\.')]
+    unescape = {'\\t': '\t', '\\n': '\n', '\\r': '\r', '\\\\': '\\'}
+    return [[re.sub(r'\\[tnr\\]', lambda match: unescape[match.group()], value) for value in row.split('\t')]
+            for row in rows]
+
+
+def test_postgres_text_copy(tmp_path, monkeypatch):
+    rows = _typed_rows(tmp_path, monkeypatch)
+    directory = _run_in(tmp_path / 'sql', monkeypatch, output_format='sql',
+                        domains=[{'name': 'people', 'fields': TYPED_FIELDS}])
+    script = (directory / 'people_mock_data.sql').read_text(encoding='utf-8')
+    assert 'CREATE TABLE "people" ("person_id" bigint, "note" text, "joined" date, "amount" double precision);' \
+        in script
+    assert 'COPY "people" ("person_id", "note", "joined", "amount") FROM STDIN;' in script
+    copied = _copy_text_rows(script)
+    assert [(int(row[0]), row[1], row[2]) for row in copied] == [
+        (row['person_id'], row['note'], row['joined']) for row in rows]
+    assert {row[1] for row in copied} == set(TYPED_FIELDS[1]['values'])  # Every escape appears
+
+
+def test_postgres_binary_copy(tmp_path, monkeypatch):
+    rows = _typed_rows(tmp_path, monkeypatch)
+    directory = _run_in(tmp_path / 'pgcopy', monkeypatch, output_format='pgcopy',
+                        domains=[{'name': 'people', 'fields': TYPED_FIELDS}])
+    data = (directory / 'people_mock_data.pgcopy').read_bytes()
+    assert data[:11] == b'PGCOPY\n\xff\r\n\x00'
+    assert struct.unpack_from('>ii', data, 11) == (0, 0)  # No flags, no header extension
+    position, copied = 19, []
+    while True:
+        (count,) = struct.unpack_from('>h', data, position)
+        position += 2
+        if count == -1:
+            break
+        values = []
+        for _ in range(count):
+            (length,) = struct.unpack_from('>i', data, position)
+            values.append(data[position + 4:position + 4 + length])
+            position += 4 + length
+        copied.append(values)
+    assert position == len(data)
+    epoch = date(2000, 1, 1).toordinal()  # PostgreSQL dates count days from 2000-01-01
+    assert [(struct.unpack('>q', key)[0], note.decode('utf-8'), date.fromordinal(epoch + struct.unpack('>i', day)[0]))
+            for key, note, day, _ in copied] == [
+        (row['person_id'], row['note'], date.fromisoformat(row['joined'])) for row in rows]
+    assert 'FORMAT binary' in (directory / 'people_mock_data.pgcopy.sql').read_text(encoding='utf-8')
+
+
+def _failing_after(count):
+    """Stand-in for generate_sharded that fails after `count` shards."""
+    generate_sharded = pipeline.generate_sharded
+
+    def failing(*args, **kwargs):
+        for index, batch in enumerate(generate_sharded(*args, **kwargs)):
+            if index == count:
+                raise RuntimeError("interrupted")
+            yield batch
+    return failing
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'json', 'parquet'])
+def test_failed_run_leaves_no_output(tmp_path, monkeypatch, output_format):
+    monkeypatch.setattr(pipeline, 'generate_sharded', _failing_after(2))
+    with pytest.raises(RuntimeError):
+        _run_in(tmp_path / 'failed', monkeypatch, output_format=output_format)
+    assert sorted(path.name for path in (tmp_path / 'failed').iterdir()) == ['config.yaml']
+
+
+def test_failed_append_is_rolled_back(tmp_path, monkeypatch):
+    directory = _run_in(tmp_path / 'appended', monkeypatch, output_format='json', record_count=40, append=True)
+    before = (directory / 'people_mock_data.json').read_bytes()
+    with monkeypatch.context() as patch:
+        patch.setattr(pipeline, 'generate_sharded', _failing_after(2))
+        with pytest.raises(RuntimeError):
+            _run_in(directory, monkeypatch, output_format='json', record_count=90, append=True)
+    assert (directory / 'people_mock_data.json').read_bytes() == before
+    assert len(json.loads(before)) == 40
+
+
+async def _request(port, line):
+    """Send one request line to a stream server and read the whole response."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(line)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+def _dechunk(body):
+    """Decode an HTTP chunked body."""
+    data = b''
+    while True:
+        size, body = body.split(b'\r\n', 1)
+        if not int(size, 16):
+            return data
+        data, body = data + body[:int(size, 16)], body[int(size, 16) + 2:]
+
+
+def _serve(config, requests):
+    """Start a StreamServer on a free port, send each request in turn and return the responses."""
+    server = StreamServer(config, workers=1, shard_size=config['mock_data_generator']['settings']['shard_size'])
+    server.start()
+
+    async def main():
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            return [await _request(port, request) for request in requests]
+        finally:
+            listener.close()
+            await listener.wait_closed()
+    try:
+        return asyncio.run(main())
+    finally:
+        server.close()
+
+
+def test_stream_server_matches_jsonl_file(tmp_path, monkeypatch):
+    directory = _run_in(tmp_path / 'file', monkeypatch, output_format='jsonl', record_count=45)
+    expected = (directory / 'people_mock_data.jsonl').read_bytes()
+    http, raw = _serve(json.loads((directory / 'config.yaml').read_text()),
+                       [b'GET /stream/people?seed=11&count=45 HTTP/1.1\r\nHost: test\r\n\r\n',
+                        b'people seed=11 count=45\n'])
+    head, body = http.split(b'\r\n\r\n', 1)
+    assert head.startswith(b'HTTP/1.1 200 OK\r\n')
+    assert b'X-Seed: 11' in head and b'X-Record-Count: 45' in head
+    assert _dechunk(body) == expected
+    assert raw == expected
+
+
+def test_stream_server_errors(tmp_path):
+    _write_config(tmp_path / 'config.yaml')
+    config = json.loads((tmp_path / 'config.yaml').read_text())
+    responses = _serve(config, [b'GET /other HTTP/1.1\r\n\r\n', b'GET /stream/nobody HTTP/1.1\r\n\r\n',
+                                b'GET /stream/people?count=many HTTP/1.1\r\n\r\n',
+                                b'GET /stream/people?colour=red HTTP/1.1\r\n\r\n', b'nobody count=3\n'])
+    statuses, bodies = [], []
+    for response in responses[:-1]:
+        head, body = response.split(b'\r\n\r\n', 1)
+        statuses.append(head.split(b'\r\n', 1)[0])
+        assert b'Content-Type: application/json' in head and b'Content-Length: %d' % len(body) in head
+        bodies.append(json.loads(body)['error'])
+    assert statuses == [b'HTTP/1.1 404 Not Found'] + [b'HTTP/1.1 400 Bad Request'] * 3
+    assert bodies == ["Not found: /other; use /stream/<domain>", "Unknown domain 'nobody'. Options: people",
+                      "seed and count must be integers", "Unknown parameters: colour. Options: seed, count"]
+    assert json.loads(responses[-1]) == {'error': "Unknown domain 'nobody'. Options: people"}
+
+
+@pytest.mark.parametrize('arrival', ARRIVALS)
+def test_event_stream_is_monotonic_and_paced_like_fast_forward(tmp_path, arrival):
+    _write_config(tmp_path / 'config.yaml', record_count=300, shard_size=64)
+    config = json.loads((tmp_path / 'config.yaml').read_text())
+    outputs = {}
+    for speed in (0, 4):  # 300 events at 2000 a second: paced, about 40 ms of wall-clock time
+        chunks = []
+        stream = EventStream(config, 'people', {'rate': 2000, 'arrival': arrival, 'speed': speed,
+                                                'start': '2024-03-01T13:59:00', 'amplitude': 0.9})
+        started = time.monotonic()
+        assert stream.run(chunks.append) == 300
+        if speed:
+            assert time.monotonic() - started >= stream.arrivals.elapsed / speed * 0.9
+        outputs[speed] = b''.join(chunks)
+    assert outputs[0] == outputs[4]
+    times = [json.loads(line)['event_time'] for line in outputs[0].splitlines()]
+    assert len(times) == 300 and times == sorted(times)
+    assert times[0] >= '2024-03-01T13:59:00.000'
+
+
+@pytest.mark.parametrize('content, missing', [('settings: {}\n', "top-level 'mock_data_generator' key"),
+                                              ('mock_data_generator:\n  domains: []\n', "no 'settings'")])
+def test_config_without_generator_keys_is_named(tmp_path, content, missing):
+    path = tmp_path / 'config.yaml'
+    path.write_text(content)
+    with pytest.raises(ValueError, match=missing):
+        load_config(str(path), directory=None)
+
+
+def test_large_reference_data_is_shared_once_per_worker(tmp_path, monkeypatch):
+    domains = [
+        {'name': 'people', 'record_count': 8000, 'fields': [
+            {'name': 'person_id', 'type': 'primary_key', 'range': {'start': 1, 'end': 100000}},
+            {'name': 'city', 'type': 'string', 'faker': 'city', 'pool': False}]},
+        {'name': 'visits', 'fields': [
+            {'name': 'visit_id', 'type': 'primary_key', 'range': {'start': 1, 'end': 1000}},
+            {'name': 'person_id', 'type': 'relationship', 'relation': {'domain': 'people', 'field': 'person_id'}},
+            {'name': 'city', 'type': 'relationship', 'relation': {'domain': 'people', 'field': 'city'}},
+        ]},
+    ]
+    submitted = []
+    share = sharding.share_references
+
+    def recording(reference_data, domain_name, seed):
+        submitted.append(share(reference_data, domain_name, seed))
+        return submitted[-1]
+    monkeypatch.setattr(sharding, 'share_references', recording)
+    outputs = [(_run_in(tmp_path / str(workers), monkeypatch, domains=domains, record_count=95, shard_size=100,
+                        workers=workers) / 'visits_mock_data.csv').read_bytes() for workers in (1, 4)]
+    assert outputs[0] == outputs[1]
+    shared = [references for references in submitted if isinstance(references, sharding.SharedReferences)]
+    assert [references.key[0] for references in shared] == ['visits']
+    assert not os.path.exists(shared[0].path)  # Removed once the domain's shards are done
+
+
+def test_shared_references_are_read_once_per_process():
+    reference_data = {'people': {'city': [f"city {index}" for index in range(20000)]}}
+    references = sharding.share_references(reference_data, 'visits', 3)
+    assert isinstance(references, sharding.SharedReferences)
+    try:
+        assert sharding._load_references(references) == reference_data
+    finally:
+        sharding.release_references(references)
+    assert sharding._load_references(references) == reference_data  # Kept after the file is gone
+    assert sharding.share_references({'people': {'city': ['a']}}, 'visits', 3) == {'people': {'city': ['a']}}
+
+
+def test_append_rejects_increasing_datetimes(tmp_path, monkeypatch):
+    fields = PEOPLE_FIELDS + [{'name': 'logged', 'type': 'datetime', 'distribution': 'increasing',
+                               'range': {'start': '2024-01-01', 'end': '2024-12-31'}}]
+    with pytest.raises(ValueError, match="logged of domain 'people'"):
+        _run_in(tmp_path / 'appended', monkeypatch, append=True, domains=[{'name': 'people', 'fields': fields}])
+    assert sorted(path.name for path in (tmp_path / 'appended').iterdir()) == ['config.yaml']
@@ -0,0 +1,265 @@
+import os
+import csv
+import mmap
+import struct
+import hashlib
+import logging
+import threading
+from array import array
+
+from config_cache import DEFAULT_DIRECTORY
+
+VALUE_LIST_VERSION = 1
+_HEADER = struct.Struct('<8sQQ')  # Magic, value count, whether alias tables follow the offsets
+_MAGIC = b'MGVLIST1'
+
+# External value lists opened in this process, by source fingerprint; forked workers inherit the maps
+_loaded = {}
+_lock = threading.Lock()
+
+
+class AliasTable:
+    """Walker/Vose alias table: draws index i with probability weights[i] / sum(weights) in O(1).
+
+    Each draw picks a column uniformly and keeps it with `probability[column]`, else takes its
+    `alias`; both are typed arrays (or memoryviews of a mapped file), built once in O(n).
+    """
+
+    def __init__(self, probability, alias):
+        self.probability = probability
+        self.alias = alias
+        self.size = len(probability)
+        self._arrays = None
+
+    @classmethod
+    def build(cls, weights):
+        weights = [float(weight) for weight in weights]
+        if not weights:
+            raise ValueError("Cannot sample from an empty list of values.")
+        if min(weights) < 0:
+            raise ValueError("Probabilities cannot be negative.")
+        total = sum(weights)
+        if not total > 0:
+            raise ValueError("Probabilities must not all be zero.")
+        size = len(weights)
+        scaled = [weight * size / total for weight in weights]
+        probability = array('d', bytes(8 * size))
+        alias = array('q', range(size))
+        small = [index for index, weight in enumerate(scaled) if weight < 1]
+        large = [index for index, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            probability[less], alias[less] = scaled[less], more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+        for index in small + large:  # Left over only through rounding: always kept
+            probability[index] = 1.0
+        return cls(probability, alias)
+
+    def draw(self, rng):
+        """Draw one index with a `random.Random`."""
+        column = rng.random() * self.size
+        index = min(int(column), self.size - 1)
+        return index if column - index < self.probability[index] else self.alias[index]
+
+    def draw_array(self, rng, count):
+        """Draw `count` indices as an int64 array with a NumPy Generator."""
+        import numpy as np
+        if self._arrays is None:
+            self._arrays = (np.frombuffer(self.probability, dtype=np.float64),
+                            np.frombuffer(self.alias, dtype=np.int64))
+        probability, alias = self._arrays
+        columns = rng.random(count) * self.size
+        indices = np.minimum(columns.astype(np.int64), self.size - 1)
+        return np.where(columns - indices < probability[indices], indices, alias[indices])
+
+
+def list_values(option):
+    """Return the inline values of a value list — a list, or a mapping with `values` — else None."""
+    if isinstance(option, list):
+        return option
+    if isinstance(option, dict) and 'values' in option:
+        return option['values']
+    return None
+
+
+def _source_format(source):
+    file_name = source['file']
+    return 'csv' if 'column' in source or file_name.lower().endswith('.csv') else 'text'
+
+
+def source_fingerprint(source):
+    """Identify an external value list by its file's path, size and modification time and how it is read."""
+    status = os.stat(source['file'])
+    return (os.path.abspath(source['file']), status.st_size, status.st_mtime_ns, _source_format(source),
+            source.get('column', 0), source.get('weights'))
+
+
+def value_list_sources(domain_config):
+    """Yield the `source` of every external value list a domain's fields draw from."""
+    from schema_compiler import domain_fields
+    for field in domain_fields(domain_config):
+        if field.get('type') == 'predefined_list' and 'source' in field:
+            yield field['source']
+        elif field.get('type') == 'dependency':
+            for option in field['dependency']['values'].values():
+                if isinstance(option, dict) and 'source' in option:
+                    yield option['source']
+
+
+def _column_index(header, column, file_name):
+    if isinstance(column, int):
+        return column
+    if header is None or column not in header:
+        raise ValueError(f"Column '{column}' not found in value list {file_name}.")
+    return header.index(column)
+
+
+def _read_source(source):
+    """Yield (value, weight) pairs from a text file (one value per line) or a CSV column."""
+    file_name = source['file']
+    weights = source.get('weights')
+    with open(file_name, 'r', encoding='utf-8', newline='') as file:
+        if _source_format(source) == 'text':
+            if weights is not None:
+                raise ValueError(f"Weights need a CSV value list, not {file_name}.")
+            for line in file:
+                value = line.rstrip('\r\n')
+                if value:
+                    yield value, None
+            return
+        rows = csv.reader(file)
+        column = source.get('column', 0)
+        header = next(rows, None) if isinstance(column, str) or isinstance(weights, str) else None
+        value_index = _column_index(header, column, file_name)
+        weight_index = _column_index(header, weights, file_name) if weights is not None else None
+        for row in rows:
+            if row:
+                yield row[value_index], float(row[weight_index]) if weight_index is not None else None
+
+
+def _build_index(source, path):
+    """Write a value list's index file: header, value offsets, alias table when weighted, then the values."""
+    offsets = array('q', [0])
+    weights = array('d')
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(f"{temp_path}.data", 'wb') as data:
+        for value, weight in _read_source(source):
+            encoded = value.encode('utf-8')
+            data.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+            if weight is not None:
+                weights.append(weight)
+    count = len(offsets) - 1
+    if not count:
+        os.remove(f"{temp_path}.data")
+        raise ValueError(f"Value list {source['file']} has no values.")
+    table = AliasTable.build(weights) if weights else None
+    with open(temp_path, 'wb') as file:
+        file.write(_HEADER.pack(_MAGIC, count, table is not None))
+        offsets.tofile(file)
+        if table is not None:
+            table.probability.tofile(file)
+            table.alias.tofile(file)
+        with open(f"{temp_path}.data", 'rb') as data:
+            while True:
+                chunk = data.read(1 << 20)
+                if not chunk:
+                    break
+                file.write(chunk)
+    os.remove(f"{temp_path}.data")
+    os.replace(temp_path, path)
+    logging.info(f"Indexed {count} values of {source['file']}")
+
+
+class ValueList:
+    """An external value list read through a memory map of its index file.
+
+    Values are decoded one at a time (`values[i]`), so a list of millions of values costs
+    only the pages read, and every process mapping the file shares them in the page cache.
+    `alias` is the AliasTable of a weighted list, else None.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, weighted = _HEADER.unpack_from(self.map)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a value list index.")
+        view = memoryview(self.map)
+        position = _HEADER.size
+        self.offsets = view[position:position + 8 * (count + 1)].cast('q')
+        position += 8 * (count + 1)
+        self.alias = None
+        if weighted:
+            self.alias = AliasTable(view[position:position + 8 * count].cast('d'),
+                                    view[position + 8 * count:position + 16 * count].cast('q'))
+            position += 16 * count
+        self.start = position
+        self.size = count
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError(f"Value index {index} is out of range")
+        return str(self.map[self.start + self.offsets[index]:self.start + self.offsets[index + 1]], 'utf-8')
+
+    def take(self, indices):
+        """Decode the values at an array of indices into a NumPy object array."""
+        import numpy as np
+        values = np.empty(len(indices), dtype=object)
+        values[:] = [self[index] for index in indices.tolist()]
+        return values
+
+
+def load_value_list(source, directory=None):
+    """Return the ValueList of an external `source`, indexing the file on first use.
+
+    The index is kept under the cache directory, keyed by the file's path, size and mtime,
+    so later runs and other processes map it without reading the source again.
+    """
+    key = source_fingerprint(source)
+    with _lock:
+        if key not in _loaded:
+            if directory is None:
+                directory = os.path.join(DEFAULT_DIRECTORY, 'value_lists')
+            digest = hashlib.sha256(repr((VALUE_LIST_VERSION, key)).encode('utf-8')).hexdigest()
+            path = os.path.join(directory, f"{digest}.values")
+            if not os.path.exists(path):
+                try:
+                    os.makedirs(directory, exist_ok=True)
+                    _build_index(source, path)
+                except OSError as e:  # A read-only cache directory: index into a temporary file instead
+                    import tempfile
+                    logging.debug(f"Could not index {source['file']} in {directory}: {e}")
+                    path = os.path.join(tempfile.gettempdir(), f"mockgen-{digest}.values")
+                    if not os.path.exists(path):
+                        _build_index(source, path)
+            _loaded[key] = ValueList(path)
+        return _loaded[key]
+
+
+def warm_value_lists(domain_config):
+    """Index and map a domain's external value lists before worker processes fork, so they share the maps."""
+    for source in value_list_sources(domain_config):
+        load_value_list(source)
+
+
+def row_source_sampler(source, rng):
+    """Compile an external value list into a zero-argument sampler for the row engine."""
+    values = load_value_list(source)
+    if values.alias is not None:
+        draw = values.alias.draw
+        return lambda: values[draw(rng)]
+    size = len(values)
+    return lambda: values[rng.randrange(size)]
+
+
+def column_source_sampler(source, rng):
+    """Compile an external value list into `sample(count)` returning an object array, for the columnar engine."""
+    values = load_value_list(source)
+    if values.alias is not None:
+        return lambda count: values.take(values.alias.draw_array(rng, count))
+    return lambda count: values.take(rng.integers(0, len(values), count))
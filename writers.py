@@ -0,0 +1,923 @@
+import io
+import os
+import re
+import csv
+import json
+import time
+import struct
+import shutil
+import logging
+import threading
+from collections import deque
+
+from record_batch import RecordBatch, Categorical, Timestamps, field_categories
+
+WRITE_BUFFER_SIZE = 1 << 20
+STREAM_COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}  # Whole-file compression of text formats, and its suffix
+DEFAULT_COMPRESSION_LEVELS = {'gzip': 6, 'zstd': 3}
+COMPRESSION_CHUNK_SIZE = 4 << 20  # Uncompressed bytes per gzip member or zstd frame
+
+
+class TimedRawFile(io.RawIOBase):
+    """Unbuffered file that adds the time spent in operating-system writes to `seconds`."""
+
+    def __init__(self, file_name, mode='w'):
+        super().__init__()
+        self.raw = io.FileIO(file_name, mode)
+        self.seconds = 0.0
+
+    def writable(self):
+        return True
+
+    def fileno(self):
+        return self.raw.fileno()
+
+    def write(self, data):
+        started = time.perf_counter()
+        try:
+            return self.raw.write(data)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super().close()
+
+
+def _import_zstandard():
+    """Import zstandard, which is only needed for zstd-compressed text output."""
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        logging.error("zstd output compression requires zstandard: pip install zstandard")
+        raise
+
+
+def chunk_compressor(compression, level=None):
+    """Return a function that compresses one chunk into a self-contained gzip member or zstd frame."""
+    level = DEFAULT_COMPRESSION_LEVELS[compression] if level is None else int(level)
+    if compression == 'gzip':
+        import zlib
+
+        def compress(data):
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip header and trailer, mtime 0
+            return compressor.compress(data) + compressor.flush()
+        return compress
+    zstandard = _import_zstandard()
+    compressors = threading.local()  # A ZstdCompressor must not be shared between threads
+
+    def compress(data):
+        compressor = getattr(compressors, 'compressor', None)
+        if compressor is None:
+            compressor = compressors.compressor = zstandard.ZstdCompressor(level=level)
+        return compressor.compress(data)
+    return compress
+
+
+class CompressedRawFile(io.RawIOBase):
+    """Unbuffered file that compresses what is written to it in independent chunks on a thread pool.
+
+    Every `chunk_size` bytes become one gzip member or zstd frame. Chunks are compressed
+    `threads` at a time (zlib and zstandard release the GIL) and written in order. Concatenated
+    members or frames decompress as one stream, so the file stays a valid .gz or .zst file,
+    parts written separately can be joined byte for byte and appending adds members.
+    """
+
+    def __init__(self, raw, compression, level=None, threads=None, chunk_size=COMPRESSION_CHUNK_SIZE):
+        from concurrent.futures import ThreadPoolExecutor
+        super().__init__()
+        self.raw = raw
+        self.compress = chunk_compressor(compression, level)
+        self.chunk_size = chunk_size
+        self.threads = threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(self.threads)
+        self.buffer = bytearray()
+        self.pending = deque()
+        self.chunks = 0
+
+    def writable(self):
+        return True
+
+    def fileno(self):
+        return self.raw.fileno()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            chunk = bytes(self.buffer[:self.chunk_size])
+            del self.buffer[:self.chunk_size]
+            self._submit(chunk)
+        return len(data)
+
+    def _submit(self, chunk):
+        """Queue a chunk for compression, first writing out the oldest one if enough are in flight."""
+        if len(self.pending) >= 2 * self.threads:
+            self._write_compressed(self.pending.popleft().result())
+        self.pending.append(self.executor.submit(self.compress, chunk))
+        self.chunks += 1
+
+    def _write_compressed(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[self.raw.write(view):]
+
+    def close(self):
+        if not self.closed:
+            try:
+                if self.buffer or not self.chunks:  # An empty output is still one valid member
+                    self._submit(bytes(self.buffer))
+                    self.buffer.clear()
+                while self.pending:
+                    self._write_compressed(self.pending.popleft().result())
+            finally:
+                self.executor.shutdown(cancel_futures=True)
+                self.raw.close()
+        super().close()
+
+
+class RecordWriter:
+    """Base class for writers that flush record batches to a file as they are produced.
+
+    With `timed=True` the writer splits its time into serialize (encoding records) and
+    write (flushing bytes to the file), reported by `timings()`.
+
+    `part=(first, last, records_before)` writes one part of a larger output: only the first
+    part gets the preamble and only the last the epilogue, so for `concatenable` formats the
+    parts joined byte for byte equal the output written in one go (see `merge_parts`).
+    With `append=True` the part is added to the end of an existing file instead; formats
+    whose `append_mode` is 'new_file' are appended as separate files by the caller.
+
+    `compressible` formats take `compression` gzip or zstd (see `CompressedRawFile`), at
+    `compression_level` on `compression_threads` threads; the caller names the file (see `output_name`).
+
+    A new file is written under a temporary name and moved into place when the writer closes
+    cleanly; leaving the `with` block on an exception skips `finish()` and removes it, so a
+    failed run never leaves a truncated output that looks complete.
+    """
+
+    newline = None
+    binary = False
+    concatenable = True
+    resumable = True  # Whether a checkpointed run can write this format in parts
+    append_mode = 'in_place'  # How new records are added to an existing output: in_place, new_file or None
+    companions = ()  # Suffixes of files written next to the output, e.g. a load script
+    opens_file = True  # False for writers that manage their own output, such as a database connection
+    nested = True  # Whether records may hold nested child collections
+    compressible = True  # Whether the output may be compressed as a whole with gzip or zstd
+
+    def __init__(self, file_name, field_names, timed=False, part=None, append=False, **options):
+        self.file_name = file_name
+        self.field_names = list(field_names)
+        self.options = options
+        self.record_count = 0
+        self.first, self.last, self.records_before = part or (True, True, 0)
+        self.busy_seconds = 0.0
+        compression = options.get('compression')
+        self.compressed = self.opens_file and self.compressible and compression in STREAM_COMPRESSIONS
+        if self.compressible and compression not in (None, 'none', *STREAM_COMPRESSIONS):
+            raise ValueError(f"Unsupported compression '{compression}' for {file_name}. "
+                             f"Options: {', '.join(STREAM_COMPRESSIONS)}")
+        mode = 'a' if append else 'w'
+        self.restore = None  # (size, epilogue) that put an appended file back as it was if writing fails
+        if append and self.opens_file:
+            epilogue = self.prepare_append()
+            self.restore = (os.path.getsize(file_name), epilogue or b'')
+        # Appends add to the existing file in place; anything else is moved into place by close()
+        self.temp_name = f"{file_name}.{os.getpid()}.tmp" if self.opens_file and not append else None
+        path = self.temp_name or file_name
+        self.raw = TimedRawFile(path, mode) if timed and self.opens_file else None
+        stream = self.raw
+        if self.compressed:
+            stream = CompressedRawFile(self.raw or io.FileIO(path, mode), compression,
+                                       options.get('compression_level'), options.get('compression_threads'))
+        if not self.opens_file:
+            self.file = None
+        elif stream is not None:
+            self.file = io.BufferedWriter(stream, WRITE_BUFFER_SIZE)
+            if not self.binary:
+                self.file = io.TextIOWrapper(self.file, encoding='utf-8', newline=self.newline)
+        elif self.binary:
+            self.file = open(path, f'{mode}b', buffering=WRITE_BUFFER_SIZE)
+        else:
+            self.file = open(path, mode, encoding='utf-8', newline=self.newline, buffering=WRITE_BUFFER_SIZE)
+        self.start()
+
+    def prepare_append(self):
+        """Get an existing file ready for records to be appended, e.g. by removing its epilogue.
+
+        Returns the bytes removed, which `abort()` writes back.
+        """
+        if self.append_mode != 'in_place':
+            raise ValueError(f"{type(self).__name__} cannot append to {self.file_name}.")
+
+    def start(self):
+        """Write anything that precedes the first record."""
+
+    def write_records(self, batch):
+        """Serialize one `RecordBatch`."""
+        raise NotImplementedError
+
+    def finish(self):
+        """Write anything that follows the last record."""
+
+    def write_batch(self, batch):
+        """Write one `RecordBatch`, or an iterable of record dicts, and return how many records were written."""
+        if not isinstance(batch, RecordBatch):
+            batch = RecordBatch.from_records(batch)
+        if len(batch):
+            started = time.perf_counter()
+            self.write_records(batch)
+            self.busy_seconds += time.perf_counter() - started
+            self.record_count += len(batch)
+        return len(batch)
+
+    def close(self):
+        """Finish the output, close the file and move it into place."""
+        if self.file is None or self.file.closed:
+            return
+        started = time.perf_counter()
+        try:
+            self.finish()
+            self.file.close()
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self.busy_seconds += time.perf_counter() - started
+        if self.temp_name is not None:
+            os.replace(self.temp_name, self.file_name)
+
+    def abort(self):
+        """Close the file without finishing it, after a failure.
+
+        A new file is removed rather than left truncated; an appended file is cut back to its
+        previous records and gets its epilogue back.
+        """
+        if self.file is not None and not self.file.closed:
+            try:
+                self.file.close()
+            except OSError as e:  # E.g. the disk filled up while flushing the buffer
+                logging.debug(f"Could not flush {self.file_name}: {e}")
+        if self.temp_name is not None and os.path.exists(self.temp_name):
+            os.remove(self.temp_name)
+        if self.restore is not None:
+            size, epilogue = self.restore
+            with open(self.file_name, 'rb+') as file:
+                file.truncate(size)
+                file.seek(size)
+                file.write(epilogue)
+            self.restore = None
+
+    def timings(self):
+        """Return seconds spent per stage, serialize and write; empty unless the writer is timed."""
+        if self.raw is None:
+            return {}
+        return {'serialize': self.busy_seconds - self.raw.seconds, 'write': self.raw.seconds}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class JsonLinesWriter(RecordWriter):
+    """Write one compact JSON object per line."""
+
+    def start(self):
+        self.encode = json.JSONEncoder().encode
+
+    def write_records(self, batch):
+        self.file.write('\n'.join(map(self.encode, batch.records())))
+        self.file.write('\n')
+
+
+class JsonArrayWriter(RecordWriter):
+    """Stream records into a single JSON array without holding the array in memory."""
+
+    def prepare_append(self):
+        if self.compressed:
+            raise ValueError(f"Cannot append to compressed JSON array {self.file_name}; use jsonl output.")
+        epilogue = b'\n]\n' if self.records_before else b']\n'
+        with open(self.file_name, 'rb+') as file:
+            file.seek(-len(epilogue), os.SEEK_END)
+            if file.read() != epilogue:
+                raise ValueError(f"Cannot append to {self.file_name}: it does not end like a complete JSON array.")
+            file.seek(-len(epilogue), os.SEEK_END)
+            file.truncate()
+        return epilogue
+
+    def start(self):
+        self.encode = json.JSONEncoder(indent=self.options.get('indent')).encode
+        if self.first:
+            self.file.write('[')
+
+    def write_records(self, batch):
+        self.file.write(',\n' if self.records_before + self.record_count else '\n')
+        self.file.write(',\n'.join(map(self.encode, batch.records())))
+
+    def finish(self):
+        if self.last:
+            self.file.write('\n]\n' if self.records_before + self.record_count else ']\n')
+
+
+class CsvWriter(RecordWriter):
+    """Write CSV rows under a fixed header taken from the compiled schema."""
+
+    newline = ''
+    nested = False
+
+    def start(self):
+        self.writer = csv.writer(self.file)
+        if self.first:
+            self.writer.writerow(self.field_names)
+
+    def write_records(self, batch):
+        self.writer.writerows(batch.rows(self.field_names))
+
+
+def _import_pyarrow():
+    """Import pyarrow, which is only needed for the columnar output formats."""
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        logging.error("Parquet and Arrow output require pyarrow: pip install pyarrow")
+        raise
+
+
+def _dictionary_values(field):
+    """Return every value a categorical field can take as a string, or None if it is not categorical."""
+    categories = field_categories(field)
+    return None if categories is None else list(dict.fromkeys(str(value) for value in categories))
+
+
+class ArrowTableWriter(RecordWriter):
+    """Base class for Arrow-backed writers; each batch is converted to a table and written as it arrives.
+
+    Column types come from the YAML field types: primary_key is int64, datetime is a timestamp (a date for date-only formats) and
+    categorical fields are dictionary-encoded against their full value list, so every batch shares
+    one dictionary. Other fields take the type inferred from the first batch. Datetimes are
+    converted from the microseconds the batch holds, never formatted.
+    """
+
+    binary = True
+    concatenable = False  # Parts are complete files, merged table by table
+    append_mode = 'new_file'
+    compressible = False  # Compressed internally: `compression` picks the codec of the file format
+    default_compression = None
+
+    def start(self):
+        self.pa = _import_pyarrow()
+        self.compression = self.options.get('compression') or self.default_compression
+        fields = {field['name']: field for field in self.options.get('fields') or ()}
+        self.converters = [self._column_converter(fields.get(name, {})) for name in self.field_names]
+        self.dictionary_fields = {name for name in self.field_names if _dictionary_values(fields.get(name, {}))}
+        self.datetime_fields = {name for name in self.field_names if fields.get(name, {}).get('type') == 'datetime'}
+        self.schema = None
+        self.writer = None
+
+    def _column_converter(self, field):
+        """Build a function that turns a list or NumPy array of values into an Arrow array for one field.
+
+        Categorical fields also take a `Categorical`, whose codes are remapped to the field's
+        dictionary in bulk, and datetime fields `Timestamps`; plain datetime strings, from batches
+        built of record dicts, are cast from ISO format.
+        """
+        pa = self.pa
+        field_type = field.get('type')
+        if field_type == 'primary_key':
+            return lambda values: pa.array(values, pa.int64())
+        if field_type == 'datetime':
+            # Date formats become date32, other formats and unformatted datetimes timestamp[us]
+            from temporal import compile_format, DAY
+            dates = bool(field.get('format')) and compile_format(field['format']).resolution == DAY
+
+            def convert_datetimes(values):
+                if not isinstance(values, Timestamps):
+                    return pa.array(values, pa.string()).cast(pa.date32() if dates else pa.timestamp('us'))
+                import numpy as np
+                micros = np.asarray(values.micros, dtype=np.int64)
+                return pa.array((micros // DAY).astype('datetime64[D]') if dates else micros.astype('datetime64[us]'))
+            return convert_datetimes
+        if field_type == 'integer':
+            return lambda values: pa.array(values, pa.int64())
+        if field_type == 'float':
+            return lambda values: pa.array(values, pa.float64())
+        if field_type == 'string':
+            return lambda values: pa.array(values, pa.string())
+        dictionary_values = _dictionary_values(field)
+        if dictionary_values is not None:
+            dictionary = pa.array(dictionary_values, pa.string())
+            codes = {value: code for code, value in enumerate(dictionary_values)}
+
+            def convert(values):
+                if isinstance(values, Categorical):
+                    import numpy as np
+                    remap = np.array([codes[str(value)] for value in values.categories], dtype=np.int32)
+                    return pa.DictionaryArray.from_arrays(pa.array(remap[values.code_array()]), dictionary)
+                return pa.DictionaryArray.from_arrays(pa.array([codes[str(value)] for value in values], pa.int32()),
+                                                      dictionary)
+            return convert
+        return lambda values: pa.array(values)
+
+    def write_records(self, batch):
+        pa = self.pa
+        arrays = [
+            convert(batch.columns[name] if name in self.dictionary_fields or name in self.datetime_fields
+                    else batch.array(name))
+            for name, convert in zip(self.field_names, self.converters)
+        ]
+        self.write_table(pa.Table.from_arrays(arrays, names=self.field_names))
+
+    def write_table(self, table):
+        """Write an Arrow table, cast to the schema of the first one."""
+        if self.schema is None:
+            self.schema = table.schema
+            self.writer = self.open_table_writer(self.schema)
+        self.writer.write_table(table.cast(self.schema) if table.schema != self.schema else table)
+
+    def finish(self):
+        if self.writer is None:  # No records: still produce a valid, empty file
+            pa = self.pa
+            self.schema = pa.schema([
+                pa.field(name, convert([]).type) for name, convert in zip(self.field_names, self.converters)
+            ])
+            self.writer = self.open_table_writer(self.schema)
+        self.writer.close()
+
+    def abort(self):
+        if self.writer is not None:  # Released rather than left to the garbage collector; the file is removed
+            try:
+                self.writer.close()
+            except (OSError, self.pa.ArrowException) as e:
+                logging.debug(f"Could not close the Arrow writer of {self.file_name}: {e}")
+            self.writer = None
+        super().abort()
+
+    def open_table_writer(self, schema):
+        """Create the underlying Arrow writer once the schema is known."""
+        raise NotImplementedError
+
+    def read_table(self, file_name):
+        """Read back a whole file written in this format."""
+        raise NotImplementedError
+
+
+class ParquetWriter(ArrowTableWriter):
+    """Write each batch as a Parquet row group (snappy-compressed by default)."""
+
+    default_compression = 'snappy'
+
+    def open_table_writer(self, schema):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(self.file, schema, compression=self.compression,
+                               compression_level=self.options.get('compression_level'))
+
+    def read_table(self, file_name):
+        import pyarrow.parquet as pq
+        return pq.read_table(file_name)
+
+
+class ArrowIpcWriter(ArrowTableWriter):
+    """Write each batch as a record batch of an Arrow IPC file (lz4 or zstd compression)."""
+
+    def open_table_writer(self, schema):
+        if self.compression not in (None, 'lz4', 'zstd'):
+            raise ValueError(f"Unsupported compression for arrow output: {self.compression}")
+        level = self.options.get('compression_level')
+        compression = self.pa.Codec(self.compression, level) if self.compression and level is not None \
+            else self.compression
+        options = self.pa.ipc.IpcWriteOptions(compression=compression)
+        return self.pa.ipc.new_file(self.file, schema, options=options)
+
+    def read_table(self, file_name):
+        with self.pa.memory_map(file_name) as source:
+            return self.pa.ipc.open_file(source).read_all()
+
+
+SQLITE_TIMEOUT = 600  # Seconds a writer waits for another connection's transaction on the same database
+PG_EPOCH_DAYS = 10_957  # 2000-01-01, the PostgreSQL epoch, in days since 1970-01-01
+PG_COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+ISO_DATETIME = re.compile(r'YYYY-MM-DD([ T]HH:mm(:ss(\.SSS|\.SSSSSS)?)?)?')  # Formats PostgreSQL parses as-is
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+COPY_NULL = '\\N'
+_INT4 = struct.Struct('>ii')
+_INT8 = struct.Struct('>iq')
+_FLOAT8 = struct.Struct('>id')
+_BOOL = struct.Struct('>i?')
+_LENGTH = struct.Struct('>i')
+_BINARY_NULL = _LENGTH.pack(-1)
+
+
+def _quote(name):
+    """Quote an SQL identifier, for SQLite and PostgreSQL alike."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _column_type(field, sample=None):
+    """Return the SQL type of a column: integer, float, boolean, text, date or timestamp.
+
+    The YAML field type decides where it can; inline predefined lists use their values and other
+    fields (computed, relationship, dependency, external value lists) the first value generated.
+    """
+    field_type = field.get('type')
+    if field_type in ('primary_key', 'integer'):
+        return 'integer'
+    if field_type == 'float':
+        return 'float'
+    if field_type == 'datetime' and field.get('format'):
+        from temporal import compile_format, DAY
+        return 'date' if compile_format(field['format']).resolution == DAY else 'timestamp'
+    if field_type in ('string', 'datetime'):
+        return 'text'
+    samples = (field_categories(field) if field_type == 'predefined_list' else None) or [sample]
+    if all(isinstance(value, bool) for value in samples):
+        return 'boolean'
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in samples):
+        return 'integer'
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in samples):
+        return 'float'
+    return 'text'
+
+
+def _datetime_micros(values, datetime_format):
+    """Return a datetime column as a list of microseconds since the epoch, keeping None.
+
+    Generated batches hold `Timestamps`, whose microseconds are taken as they are; plain strings,
+    from batches built of record dicts, are parsed with the field's format.
+    """
+    if isinstance(values, Timestamps):
+        return values.micros if isinstance(values.micros, list) else values.micros.tolist()
+    present = [value for value in values if value is not None]
+    parsed = iter(datetime_format.parse_array(present).tolist() if present else ())
+    return [None if value is None else next(parsed) for value in values]
+
+
+class SqlTableWriter(RecordWriter):
+    """Base class for database writers: one table whose DDL comes from the YAML field types.
+
+    The primary key, unique keys and indexes on relationship columns are created after the
+    data is loaded, which is much faster than maintaining them row by row. The `table`,
+    `primary_key` and `indexes` options override the table name and key columns.
+    """
+
+    nested = False
+    append_mode = None  # The load script or database recreates the table
+    sql_types = {}
+
+    def start(self):
+        self.table = self.options.get('table') or os.path.basename(self.file_name).split('.')[0]
+        fields = {field['name']: field for field in self.options.get('fields') or ()}
+        self.column_fields = [fields.get(name, {}) for name in self.field_names]
+        keys = [name for name, field in zip(self.field_names, self.column_fields) if field.get('type') == 'primary_key']
+        if self.options.get('primary_key') is None:
+            self.primary_key, self.unique = keys[:1], keys[1:]
+        else:
+            self.primary_key, self.unique = list(self.options['primary_key']), []
+        self.indexes = list(dict.fromkeys([*(self.options.get('indexes') or ()), *(
+            name for name, field in zip(self.field_names, self.column_fields) if field.get('type') == 'relationship')]))
+        self.column_types = None
+
+    def resolve_types(self, batch=None):
+        """Fix the column types, from the field configs and the first batch."""
+        if self.column_types is None:
+            self.column_types = [
+                _column_type(field, next((value for value in batch.column(name) if value is not None), None)
+                             if batch is not None else None)
+                for name, field in zip(self.field_names, self.column_fields)
+            ]
+        return self.column_types
+
+    def create_statements(self):
+        columns = ', '.join(f"{_quote(name)} {self.sql_types[column_type]}"
+                            for name, column_type in zip(self.field_names, self.column_types))
+        return [f"DROP TABLE IF EXISTS {_quote(self.table)}", f"CREATE TABLE {_quote(self.table)} ({columns})"]
+
+    def primary_key_statement(self):
+        return (f"CREATE UNIQUE INDEX {_quote(self.table + '_pkey')} ON {_quote(self.table)} "
+                f"({', '.join(map(_quote, self.primary_key))})")
+
+    def index_statements(self):
+        """Statements that add the keys and indexes once the table is loaded."""
+        table = _quote(self.table)
+        statements = [self.primary_key_statement()] if self.primary_key else []
+        statements += [f"CREATE UNIQUE INDEX {_quote(f'{self.table}_{name}_key')} ON {table} ({_quote(name)})"
+                       for name in self.unique]
+        statements += [f"CREATE INDEX {_quote(f'{self.table}_{name}_idx')} ON {table} ({_quote(name)})"
+                       for name in self.indexes if name not in self.primary_key[:1]]
+        return statements
+
+
+class SqliteWriter(SqlTableWriter):
+    """Load batches into a SQLite table with `executemany`, one transaction per batch.
+
+    Tables of several domains can share a database through the `database` option (by default
+    the output file is the database); each run replaces the table. Datetimes are stored as text.
+    """
+
+    opens_file = False
+    concatenable = False
+    resumable = False
+    compressible = False
+    sql_types = {'integer': 'INTEGER', 'float': 'REAL', 'boolean': 'INTEGER', 'text': 'TEXT',
+                 'date': 'TEXT', 'timestamp': 'TEXT'}
+
+    def start(self):
+        import sqlite3
+        super().start()
+        database = self.options.get('database') or self.file_name
+        self.file_name = f"{database} (table {self.table})"
+        # Other domains' writers may load the same database from other threads: wait for their transactions
+        self.connection = sqlite3.connect(database, timeout=SQLITE_TIMEOUT, isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=OFF')
+        self.insert = None
+
+    def transaction(self, batch=None, statements=()):
+        """Run statements and insert a batch of records in one write transaction."""
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            for statement in statements:
+                self.connection.execute(statement)
+            if batch is not None:
+                self.connection.executemany(self.insert, batch.rows(self.field_names))
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def write_records(self, batch):
+        statements = []
+        if self.insert is None:
+            self.resolve_types(batch)
+            statements = self.create_statements()
+            self.insert = (f"INSERT INTO {_quote(self.table)} ({', '.join(map(_quote, self.field_names))}) "
+                           f"VALUES ({', '.join('?' * len(self.field_names))})")
+        self.transaction(batch, statements)
+
+    def finish(self):
+        statements = []
+        if self.insert is None:  # No records: still create the empty table
+            self.resolve_types()
+            statements = self.create_statements()
+        self.transaction(None, statements + self.index_statements())
+        self.connection.execute('PRAGMA optimize')
+
+    def close(self):
+        if self.connection is None:
+            return
+        started = time.perf_counter()
+        try:
+            self.finish()
+        finally:
+            self.abort()
+            self.busy_seconds += time.perf_counter() - started
+
+    def abort(self):
+        """Close the connection without adding the keys and indexes; committed batches stay in the table."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class PostgresTableWriter(SqlTableWriter):
+    """Base class for PostgreSQL COPY writers; datetimes with a `format` become date or timestamp columns."""
+
+    sql_types = {'integer': 'bigint', 'float': 'double precision', 'boolean': 'boolean', 'text': 'text',
+                 'date': 'date', 'timestamp': 'timestamp'}
+
+    def primary_key_statement(self):
+        return f"ALTER TABLE {_quote(self.table)} ADD PRIMARY KEY ({', '.join(map(_quote, self.primary_key))})"
+
+    def load_statements(self, copy_statement):
+        """The whole load script around the COPY: DDL first, keys and indexes after the data."""
+        before = ['BEGIN;', *(f"{statement};" for statement in self.create_statements()), copy_statement]
+        after = [*(f"{statement};" for statement in self.index_statements()), f"ANALYZE {_quote(self.table)};",
+                 'COMMIT;']
+        return before, after
+
+    def start(self):
+        super().start()
+        self.encoders = None
+
+    def resolve_encoders(self, batch=None):
+        """Build per-column functions that encode a list of values; return True the first time."""
+        if self.encoders is not None:
+            return False
+        self.encoders = [self.column_encoder(column_type, field) for column_type, field
+                         in zip(self.resolve_types(batch), self.column_fields)]
+        return True
+
+    def columns(self, batch):
+        """Encode a batch column by column; datetimes as the batch's `Timestamps` where it holds them."""
+        encoded = []
+        for name, column_type, encode in zip(self.field_names, self.column_types, self.encoders):
+            timestamps = batch.timestamps(name) if column_type in ('date', 'timestamp') else None
+            encoded.append(encode(batch.column(name) if timestamps is None else timestamps))
+        return encoded
+
+
+class PostgresCopyWriter(PostgresTableWriter):
+    """Write a psql script: the table DDL, the rows as a text-format COPY stream, then keys and indexes.
+
+    Load it with `psql -f customers_mock_data.sql` or pipe it into psql. Parts concatenate, so
+    checkpointed runs are supported.
+    """
+
+    def column_encoder(self, column_type, field):
+        if column_type == 'boolean':
+            return lambda values: [COPY_NULL if value is None else 't' if value else 'f' for value in values]
+        if column_type in ('integer', 'float'):
+            return lambda values: [COPY_NULL if value is None else str(value) for value in values]
+        if column_type in ('date', 'timestamp'):
+            from temporal import compile_format, DAY
+            datetime_format = compile_format(field['format'])
+            iso = datetime_format if ISO_DATETIME.fullmatch(datetime_format.pattern) else \
+                compile_format('YYYY-MM-DD' if datetime_format.resolution == DAY else 'YYYY-MM-DD HH:mm:ss.SSSSSS')
+
+            def encode_datetimes(values):
+                if isinstance(values, Timestamps):  # Formatted straight from the microseconds
+                    return Timestamps(values.micros, iso.pattern).tolist()
+                if iso is datetime_format:
+                    return [COPY_NULL if value is None else value for value in values]
+                return [COPY_NULL if value is None else iso.format_value(value)
+                        for value in _datetime_micros(values, datetime_format)]
+            return encode_datetimes
+        return lambda values: [COPY_NULL if value is None else str(value).translate(COPY_ESCAPES)
+                               for value in values]
+
+    def write_preamble(self):
+        if self.first:
+            columns = ', '.join(map(_quote, self.field_names))
+            before, _ = self.load_statements(f"COPY {_quote(self.table)} ({columns}) FROM STDIN;")
+            self.file.write('\n'.join(before) + '\n')
+
+    def write_records(self, batch):
+        if self.resolve_encoders(batch):
+            self.write_preamble()
+        self.file.write(''.join('\t'.join(row) + '\n' for row in zip(*self.columns(batch))))
+
+    def finish(self):
+        if self.resolve_encoders():
+            self.write_preamble()
+        if self.last:
+            _, after = self.load_statements('')
+            self.file.write('\\.\n' + '\n'.join(after) + '\n')
+
+
+class PostgresBinaryWriter(PostgresTableWriter):
+    """Write a binary-format COPY stream plus a `<file>.sql` psql script that creates the table and loads it.
+
+    Run the script from the output directory (`psql -f customers_mock_data.pgcopy.sql`), or pipe
+    the stream into `COPY ... FROM STDIN WITH (FORMAT binary)`. Parts concatenate; when writing
+    one, `output_name` names the merged file the script refers to.
+    """
+
+    binary = True
+    companions = ('.sql',)
+    compressible = False  # The load script reads the stream with \copy, which cannot decompress
+
+    def start(self):
+        super().start()
+        self.row_header = struct.pack('>h', len(self.field_names))
+        if self.first:
+            self.file.write(PG_COPY_SIGNATURE + _INT4.pack(0, 0))  # No flags, no header extension
+
+    def column_encoder(self, column_type, field):
+        if column_type == 'integer':
+            return lambda values: [_BINARY_NULL if value is None else _INT8.pack(8, value) for value in values]
+        if column_type == 'float':
+            return lambda values: [_BINARY_NULL if value is None else _FLOAT8.pack(8, value) for value in values]
+        if column_type == 'boolean':
+            return lambda values: [_BINARY_NULL if value is None else _BOOL.pack(1, value) for value in values]
+        if column_type in ('date', 'timestamp'):
+            from temporal import compile_format, DAY
+            datetime_format = compile_format(field['format'])
+            if column_type == 'date':
+                return lambda values: [_BINARY_NULL if value is None else _INT4.pack(4, value // DAY - PG_EPOCH_DAYS)
+                                       for value in _datetime_micros(values, datetime_format)]
+            return lambda values: [_BINARY_NULL if value is None else _INT8.pack(8, value - PG_EPOCH_DAYS * DAY)
+                                   for value in _datetime_micros(values, datetime_format)]
+
+        def encode_text(values):
+            encoded = []
+            for value in values:
+                if value is None:
+                    encoded.append(_BINARY_NULL)
+                else:
+                    data = str(value).encode('utf-8')
+                    encoded.append(_LENGTH.pack(len(data)) + data)
+            return encoded
+        return encode_text
+
+    def write_script(self):
+        """Write the psql script that creates the table, loads the stream and adds the keys."""
+        if not self.first:
+            return
+        output_name = self.options.get('output_name') or self.file_name
+        columns = ', '.join(map(_quote, self.field_names))
+        data_file = os.path.basename(output_name).replace("'", "''")
+        before, after = self.load_statements(
+            f"\\copy {_quote(self.table)} ({columns}) FROM '{data_file}' WITH (FORMAT binary)")
+        with open(f"{output_name}.sql", 'w', encoding='utf-8') as script:
+            script.write('\n'.join(before + after) + '\n')
+
+    def write_records(self, batch):
+        if self.resolve_encoders(batch):
+            self.write_script()
+        chunks, header = [], self.row_header
+        for cells in zip(*self.columns(batch)):
+            chunks.append(header)
+            chunks.extend(cells)
+        self.file.write(b''.join(chunks))
+
+    def finish(self):
+        if self.resolve_encoders():
+            self.write_script()
+        if self.last:
+            self.file.write(struct.pack('>h', -1))
+
+
+WRITERS = {
+    'json': JsonArrayWriter,
+    'jsonl': JsonLinesWriter,
+    'csv': CsvWriter,
+    'parquet': ParquetWriter,
+    'arrow': ArrowIpcWriter,
+    'sqlite': SqliteWriter,
+    'sql': PostgresCopyWriter,  # PostgreSQL text COPY, as a psql script
+    'pgcopy': PostgresBinaryWriter,  # PostgreSQL binary COPY
+}
+
+
+def open_writer(file_name, output_format, field_names, **options):
+    """Open a streaming writer for one of the supported output formats.
+
+    Options: `indent` for JSON, `fields` (field configs, for typed columnar and database schemas),
+    `compression` and `compression_level` (the codec for Parquet and Arrow, gzip or zstd for the
+    whole file in text formats) and `compression_threads`, `table`, `primary_key`, `indexes` and `database` for
+    database output, `append` to add to an existing file, and `timed` to split serialize and write time.
+    """
+    writer_class = WRITERS.get(output_format)
+    if writer_class is None:
+        logging.error(f"Unsupported output format: {output_format}")
+        raise ValueError(f"Unsupported output format: {output_format}")
+    return writer_class(file_name, field_names, **options)
+
+
+def output_name(file_name, output_format, compression=None):
+    """Name an output file, adding `.gz` or `.zst` when a compressible format is compressed as a whole."""
+    writer_class = WRITERS.get(output_format)
+    if writer_class is not None and writer_class.compressible and compression in STREAM_COMPRESSIONS:
+        return file_name + STREAM_COMPRESSIONS[compression]
+    return file_name
+
+
+def output_files(file_name, output_format):
+    """Return every file a writer produces for `file_name`, companions included."""
+    return [file_name] + [file_name + suffix for suffix in WRITERS[output_format].companions]
+
+
+def write_output(file_name, batches, output_format, field_names, timings=None, **options):
+    """Stream record batches to a file in the specified format and return the record count.
+
+    Serialize and write seconds are added to the `timings` dict when one is given.
+    """
+    try:
+        with open_writer(file_name, output_format, field_names, timed=timings is not None, **options) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+        for stage, seconds in writer.timings().items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+        logging.info(f"{writer.record_count} records successfully written to {writer.file_name}")
+        return writer.record_count
+    except Exception as e:
+        logging.error(f"Error writing to file {file_name}: {e}")
+        raise
+
+
+def merge_parts(part_names, file_name, output_format, field_names, **options):
+    """Join part files written with `part` into one output file and return its size in bytes.
+
+    Text formats are concatenated byte for byte; Arrow-backed formats are rewritten table by table.
+    The output appears atomically, so a crash mid-merge leaves the parts untouched.
+    """
+    if WRITERS[output_format].concatenable:
+        temp_name = f"{file_name}.{os.getpid()}.tmp"
+        with open(temp_name, 'wb') as output:
+            for part_name in part_names:
+                with open(part_name, 'rb') as part:
+                    shutil.copyfileobj(part, output, WRITE_BUFFER_SIZE)
+        os.replace(temp_name, file_name)
+    else:  # The writer itself writes under a temporary name and renames the finished file
+        with open_writer(file_name, output_format, field_names, **options) as writer:
+            for part_name in part_names:
+                writer.write_table(writer.read_table(part_name))
+    return os.path.getsize(file_name)